@@ -0,0 +1,66 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Tuple
+import logging
+import threading
+import urllib.parse
+
+# A route handler gets the parsed query string and returns (status code, content type, body), optionally followed by
+# a dict of extra response headers
+Handler = Callable[[Dict[str, List[str]]], Tuple]
+
+class AdminServer:
+    def __init__(self, port: int, ready_check: Callable[[], bool] = None, host: str = '0.0.0.0'):
+        self.port = port
+        self.host = host
+        self.ready_check = ready_check
+        self.routes = {}
+        self._server = None
+        self.add_route('/healthz', lambda query: (200, 'text/plain', b'ok'))
+        self.add_route('/readyz', self._readyz)
+
+    def add_route(self, path: str, handler: Handler):
+        self.routes[path] = handler
+
+    def start(self):
+        routes = self.routes
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urllib.parse.urlsplit(self.path)
+                handler = routes.get(url.path)
+                headers = {}
+                if handler is None:
+                    status, content_type, body = 404, 'text/plain', b'not found'
+                else:
+                    try:
+                        status, content_type, body, *extra = handler(urllib.parse.parse_qs(url.query))
+                        headers = extra[0] if extra else {}
+                    except Exception:
+                        logging.exception(f'Error serving admin request {self.path}')
+                        status, content_type, body = 500, 'text/plain', b'internal error'
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug('Admin request: ' + format % args)
+
+        self._server = ThreadingHTTPServer((self.host, self.port), RequestHandler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name='admin-server', daemon=True).start()
+        logging.info(f'Serving health checks on port {self.port}')
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _readyz(self, query):
+        if self.ready_check is None or self.ready_check():
+            return 200, 'text/plain', b'ready'
+        return 503, 'text/plain', b'not ready'
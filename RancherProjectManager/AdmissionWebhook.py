@@ -0,0 +1,223 @@
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List
+import base64
+import json
+import logging
+import ssl
+import threading
+import time
+import requests
+from .RancherApi import RancherResponseError
+
+# (name, type, description) of everything AdmissionWebhook.stats holds, for publishing on /metrics
+METRICS = (
+    ('admission_reviews_total', 'counter', 'Namespace admission reviews answered'),
+    ('admission_patches_total', 'counter', 'Namespaces given their project ID at admission'),
+    ('admission_errors_total', 'counter', 'Admission reviews let through unchanged because their project could not be resolved'),
+    ('admission_index_misses_total', 'counter', 'Admission reviews whose project was not in the project index'),
+    ('admission_index_projects', 'gauge', 'Projects in the admission project index'),
+    ('admission_index_refresh_errors_total', 'counter', 'Failed reloads of the admission project index'),
+    ('admission_max_seconds', 'gauge', 'Slowest admission review so far')
+)
+
+def escape_pointer(key: str) -> str:
+    # JSON Pointer (RFC 6901) escaping, annotation keys are full of slashes
+    return key.replace('~', '~0').replace('/', '~1')
+
+class AdmissionWebhook:
+    # A mutating admission webhook that writes the project ID onto namespaces as they're created or updated, from an
+    # in-memory index of Rancher's projects, so a namespace is in its project before anything is deployed into it.
+    # Role bindings are still left to the controller. Every review is allowed: a namespace whose project can't be
+    # resolved goes through unchanged, and the controller assigns it as before. Missing projects are only created when
+    # can_create says so, e.g. on the leader, so standby replicas only ever look them up
+    def __init__(self, controller, port: int = 8443, cert_file: str = None, key_file: str = None,
+                    refresh_interval: float = 300, host: str = '0.0.0.0', can_create: Callable[[], bool] = None):
+        self.controller = controller
+        self.can_create = can_create
+        self.port = port
+        self.host = host
+        self.cert_file = cert_file
+        self.key_file = key_file
+        self.refresh_interval = refresh_interval
+        # (cluster ID, project name) -> project ID, replaced whole by each refresh and added to on every miss
+        self.index = {}
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._server = None
+
+    def refresh(self):
+        index = {}
+        for project in self.controller.rancher.list_projects():
+            index.setdefault((project['clusterId'], project['name']), project['id'])
+        with self._lock:
+            self.index = index
+            self.stats['admission_index_projects'] = len(index)
+
+    def project_id(self, name: str, cluster: str, create: bool = True) -> str:
+        # Same-named projects in different clusters are different projects
+        key = (self.controller.rancher.get_cluster_id(cluster), name)
+        with self._lock:
+            project_id = self.index.get(key)
+        if project_id is not None:
+            return project_id
+
+        with self._lock:
+            self.stats['admission_index_misses_total'] += 1
+        # Only the replica processing the project creates it: standbys and other shards just look it up, so they can't
+        # race the leader's or owning shard's watch to create the same project
+        shard = self.controller.shard
+        create = (create and (self.can_create is None or self.can_create())
+                  and (shard is None or shard.owns(name)))
+        project = self.controller.find_or_create_project(name, cluster, create)
+        if project is None:
+            return None
+        with self._lock:
+            self.index[key] = project['id']
+            self.stats['admission_index_projects'] = len(self.index)
+        return project['id']
+
+    def review(self, admission_review: Dict) -> Dict:
+        start = time.perf_counter()
+        request = admission_review.get('request') or {}
+        response = { 'uid': request.get('uid'), 'allowed': True }
+        failed = False
+        try:
+            patch = self._patch(request)
+            if patch:
+                response['patchType'] = 'JSONPatch'
+                response['patch'] = base64.b64encode(json.dumps(patch).encode('utf-8')).decode('ascii')
+        except (requests.RequestException, RancherResponseError, ValueError, KeyError, TypeError):
+            failed = True
+            logging.exception(f'ERROR resolving the project of namespace {request.get("name")} at admission, letting it through unchanged',
+                                extra={ 'namespace': request.get('name') })
+
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.stats['admission_reviews_total'] += 1
+            self.stats['admission_patches_total'] += 'patch' in response
+            self.stats['admission_errors_total'] += failed
+            self.stats['admission_max_seconds'] = max(self.stats['admission_max_seconds'], elapsed)
+        return { 'apiVersion': admission_review.get('apiVersion', 'admission.k8s.io/v1'), 'kind': 'AdmissionReview',
+                 'response': response }
+
+    def _patch(self, request: Dict) -> List[Dict]:
+        if (request.get('kind') or {}).get('kind') != 'Namespace' or request.get('operation') not in ('CREATE', 'UPDATE'):
+            return None
+        metadata = (request.get('object') or {}).get('metadata') or {}
+        annotations = metadata.get('annotations') or {}
+        controller = self.controller
+        name = annotations.get(controller.project_name_annotation)
+        if name is None:
+            return None
+
+        cluster = annotations.get(controller.cluster_name_annotation, controller.default_cluster)
+        # Dry runs mustn't leave anything behind, so they only ever see projects that exist already
+        project_id = self.project_id(name, cluster, create=not request.get('dryRun'))
+        if project_id is None or annotations.get(controller.project_id_annotation) == project_id:
+            return None
+
+        logging.info(f'Assigning namespace {request.get("name")} to project {name} ({project_id}) at admission',
+                        extra={ 'namespace': request.get('name'), 'project_id': project_id })
+        # add replaces the value when the annotation is already there
+        return [ { 'op': 'add', 'path': '/metadata/annotations/' + escape_pointer(controller.project_id_annotation), 'value': project_id } ]
+
+    def start(self):
+        try:
+            self.refresh()
+        except (requests.RequestException, RancherResponseError):
+            # Reviews still work from misses until the next refresh
+            logging.exception('Failed to load the admission project index')
+            self.stats['admission_index_refresh_errors_total'] += 1
+
+        webhook = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path.split('?')[0] != '/mutate':
+                    self._send(404, b'not found')
+                    return
+                try:
+                    admission_review = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                except ValueError:
+                    admission_review = None
+                if not isinstance(admission_review, dict):
+                    self._send(400, b'expected an AdmissionReview')
+                    return
+                self._send(200, json.dumps(webhook.review(admission_review)).encode('utf-8'))
+
+            def _send(self, status: int, body: bytes):
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json' if status == 200 else 'text/plain')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug('Admission request: ' + format % args)
+
+        self._server = ThreadingHTTPServer((self.host, self.port), RequestHandler)
+        self._server.daemon_threads = True
+        if self.cert_file is not None:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(self.cert_file, self.key_file)
+            self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name='admission-webhook', daemon=True).start()
+        threading.Thread(target=self._refresh_loop, name='admission-index-refresh', daemon=True).start()
+        logging.info(f'Serving namespace admission reviews on port {self.port}')
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except (requests.RequestException, RancherResponseError):
+                logging.exception('Failed to refresh the admission project index')
+                with self._lock:
+                    self.stats['admission_index_refresh_errors_total'] += 1
+
+    def stop(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+class AdmissionClient:
+    # A stand-in for the API server's side of the webhook, for trying it out locally: sends an AdmissionReview for a
+    # namespace and applies the patch that comes back
+    def __init__(self, url: str, ca_file: str = None, timeout: float = 10):
+        self.url = url
+        self.verify = ca_file if ca_file is not None else True
+        self.timeout = timeout
+        self._uids = 0
+
+    def send(self, admission_review: Dict) -> Dict:
+        r = requests.post(self.url, json=admission_review, verify=self.verify, timeout=self.timeout)
+        r.raise_for_status()
+        return r.json()
+
+    def review_namespace(self, name: str, annotations: Dict[str, str] = None, operation: str = 'CREATE',
+                            dry_run: bool = False) -> Dict:
+        # The namespace as it would be stored, annotations and all
+        self._uids += 1
+        namespace = { 'apiVersion': 'v1', 'kind': 'Namespace', 'metadata': { 'name': name } }
+        if annotations is not None:
+            namespace['metadata']['annotations'] = dict(annotations)
+        response = self.send({ 'apiVersion': 'admission.k8s.io/v1', 'kind': 'AdmissionReview',
+                                'request': { 'uid': f'local-{self._uids}', 'kind': { 'group': '', 'version': 'v1', 'kind': 'Namespace' },
+                                             'operation': operation, 'name': name, 'object': namespace, 'dryRun': dry_run } })['response']
+        if not response.get('allowed'):
+            raise ValueError(f'Namespace {name} was denied: {response.get("status")}')
+        for change in json.loads(base64.b64decode(response['patch'])) if 'patch' in response else []:
+            apply_add(namespace, change)
+        return namespace
+
+def apply_add(document: Dict, operation: Dict):
+    # Just enough JSON Patch for what the webhook sends back
+    if operation['op'] != 'add':
+        raise ValueError(f'Unsupported patch operation {operation["op"]}')
+    *parents, key = [ part.replace('~1', '/').replace('~0', '~') for part in operation['path'].split('/')[1:] ]
+    for part in parents:
+        document = document[part]
+    document[key] = operation['value']
@@ -0,0 +1,146 @@
+from collections import Counter, defaultdict
+from typing import Any, Iterable, List, Tuple
+import hashlib
+import logging
+import random
+import threading
+import time
+import requests
+from kubernetes.client.exceptions import ApiException
+from .RancherApi import RancherResponseError, binding_principal_id
+
+# (name, type, description) of everything DriftResync.stats holds, for publishing on /metrics
+METRICS = (
+    ('resync_runs_total', 'counter', 'Drift resync passes completed'),
+    ('resync_errors_total', 'counter', 'Drift resync passes that failed to read bindings from Rancher'),
+    ('resync_projects_checked_total', 'counter', 'Project roles compared against Rancher by drift resyncs'),
+    ('resync_drift_found_total', 'counter', 'Projects whose members in Rancher no longer matched their namespace'),
+    ('resync_repairs_total', 'counter', 'Drifted projects reconciled again'),
+    ('resync_repair_errors_total', 'counter', 'Drifted projects that failed to reconcile'),
+    ('resync_rancher_requests_total', 'counter', 'Rancher requests made by drift resyncs, repairs included'),
+    ('resync_last_duration_seconds', 'gauge', 'Wall time of the last drift resync pass'),
+    ('resync_interval_seconds', 'gauge', 'Current interval between drift resync passes')
+)
+
+def membership_fingerprint(principal_ids: Iterable[str]) -> str:
+    # Order-insensitive and small enough to keep one per project role for every project
+    digest = hashlib.blake2b(digest_size=8)
+    for principal_id in sorted(set(principal_ids)):
+        digest.update(principal_id.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+class DriftResync:
+    # Periodically compares what each project's members should be against one bulk read of Rancher's role bindings,
+    # and reconciles only the projects that have drifted. The controllers, one per cluster, share a Rancher client and
+    # every pass reads the bindings once for all of them
+    def __init__(self, controllers: List, interval: float = 600, min_interval: float = 60, max_interval: float = 3600,
+                    jitter: float = 0.1, spread: float = 0.25):
+        if not 0 < min_interval <= interval <= max_interval:
+            raise ValueError("Intervals must satisfy 0 < min_interval <= interval <= max_interval")
+        if not controllers:
+            raise ValueError("DriftResync needs at least one controller")
+        self.controllers = controllers
+        self.rancher = controllers[0].rancher
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        # Fraction of the interval that repairs are spread over, rather than fired back to back
+        self.spread = spread
+        self.stats = Counter()
+        self.stats['resync_interval_seconds'] = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='drift-resync', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self._next_delay()):
+            if not any(controller.ready.is_set() for controller in self.controllers):
+                continue
+            try:
+                self.run_once()
+            except (requests.RequestException, RancherResponseError, ApiException):
+                self.stats['resync_errors_total'] += 1
+                logging.exception('Drift resync failed, will try again next interval')
+            except Exception:
+                # Whatever it was, the thread has to live on or drift is never looked for again
+                self.stats['resync_errors_total'] += 1
+                logging.exception('Unexpected error in drift resync, will try again next interval')
+
+    def _next_delay(self) -> float:
+        # Jittered so replicas and clusters started together don't all hit Rancher at the same moment
+        return self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def run_once(self) -> int:
+        started = time.perf_counter()
+        # Only this thread's requests, the watch and the webhook share the client
+        requests_made = Counter()
+        try:
+            with self.rancher.count_requests(requests_made):
+                drifted, checked = self._check()
+                self._repair(drifted)
+        finally:
+            self.stats['resync_rancher_requests_total'] += sum(requests_made.values())
+
+        self._adapt(checked, len(drifted))
+        self.stats['resync_runs_total'] += 1
+        self.stats['resync_last_duration_seconds'] = time.perf_counter() - started
+        return len(drifted)
+
+    def _check(self) -> Tuple[List[Tuple[Any, str]], int]:
+        # The drifted projects, each with the controller managing it, and how many project roles were compared
+        actual = defaultdict(set)
+        for binding in self.rancher.list_project_role_bindings():
+            principal_id = binding_principal_id(binding)
+            if principal_id is not None:
+                actual[(binding.get('projectId'), binding.get('roleTemplateId'))].add(principal_id)
+
+        checked = 0
+        projects = 0
+        drifted = []
+        for controller in self.controllers:
+            # One still on its startup listing has nothing worth comparing yet
+            if not controller.ready.is_set():
+                continue
+            desired = controller.desired_snapshot()
+            projects += len(desired)
+            for project_id, roles in desired.items():
+                # Roles whose members couldn't all be looked up have no fingerprint, they'd look drifted on every pass
+                roles = { role: fingerprint for role, fingerprint in roles.items() if fingerprint is not None }
+                checked += len(roles)
+                if any(membership_fingerprint(actual.get((project_id, role), ())) != fingerprint
+                        for role, fingerprint in roles.items()):
+                    drifted.append((controller, project_id))
+
+        self.stats['resync_projects_checked_total'] += checked
+        self.stats['resync_drift_found_total'] += len(drifted)
+        if drifted:
+            logging.info(f'Drift resync found {len(drifted)} of {projects} projects out of date, reconciling them')
+        return drifted, checked
+
+    def _repair(self, drifted: List[Tuple[Any, str]]):
+        window = self.interval * self.spread
+        for i, (controller, project_id) in enumerate(drifted):
+            if i > 0 and window > 0 and self._stop.wait(window / len(drifted) * random.uniform(0.5, 1.5)):
+                return
+            try:
+                controller.recheck_project(project_id)
+                self.stats['resync_repairs_total'] += 1
+            except (requests.RequestException, RancherResponseError, ApiException, ValueError, KeyError):
+                self.stats['resync_repair_errors_total'] += 1
+                logging.exception(f'ERROR reconciling drifted project {project_id}')
+
+    def _adapt(self, checked: int, drifted: int):
+        # Drift means someone is editing members by hand, so look again sooner; quiet passes back off
+        if drifted:
+            self.interval = max(self.min_interval, self.interval / 2)
+        elif checked:
+            self.interval = min(self.max_interval, self.interval * 1.5)
+        self.stats['resync_interval_seconds'] = self.interval
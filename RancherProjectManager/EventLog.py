@@ -0,0 +1,129 @@
+from kubernetes.client.models.v1_namespace import V1Namespace
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from .NamespaceRecord import NamespaceRecord
+
+# The event type recorded for namespaces seen while listing, rather than watching
+LIST = 'LIST'
+
+def _as_record(namespace: Union[V1Namespace, NamespaceRecord]) -> NamespaceRecord:
+    return namespace if isinstance(namespace, NamespaceRecord) else NamespaceRecord.from_model(namespace)
+
+class EventRecorder:
+    # Appends every namespace the controller lists or is told about to a JSONL file, one line per namespace:
+    # {"t": seconds since recording started, "e": event type, "n": name, "a": annotations, "v": resourceVersion}
+    # With anonymize, names and annotation values are replaced by keyed hashes, the same input always giving the same
+    # hash within one recording, so who shares a project with whom survives but the names themselves don't
+    def __init__(self, path: str, anonymize: bool = False, salt: bytes = None):
+        self.path = path
+        self.anonymize = anonymize
+        self._salt = salt if salt is not None else os.urandom(16)
+        self._started = time.monotonic()
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def record_page(self, namespaces: Iterable[Union[V1Namespace, NamespaceRecord]], annotation_keys: Iterable[str] = None):
+        lines = [ self._line(LIST, namespace, annotation_keys) for namespace in namespaces ]
+        with self._lock:
+            self._file.writelines(lines)
+            self._file.flush()
+
+    def record_event(self, ns_event: Dict, annotation_keys: Iterable[str] = None):
+        line = self._line(ns_event['type'], ns_event['object'], annotation_keys)
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def _line(self, event_type: str, namespace: Union[V1Namespace, NamespaceRecord], annotation_keys: Iterable[str]) -> str:
+        record = _as_record(namespace)
+        annotations = record.annotations
+        if annotation_keys is not None:
+            annotations = { key: annotations[key] for key in annotation_keys if key in annotations }
+        name = record.name
+        if self.anonymize:
+            name = self._hash(name)
+            annotations = { key: self._anonymize_value(value) for key, value in annotations.items() }
+        entry = { 't': round(time.monotonic() - self._started, 3), 'e': event_type, 'n': name, 'a': annotations,
+                  'v': record.resource_version }
+        return json.dumps(entry, separators=(',', ':')) + '\n'
+
+    def _anonymize_value(self, value: str) -> str:
+        # Hashes each member of a comma separated list, and each part of a cluster:project ID, keeping the separators
+        return re.sub(r'[^,:]+', lambda match: self._hash(match.group(0)), value)
+
+    def _hash(self, value: str) -> str:
+        return 'x' + hashlib.blake2b(value.encode('utf-8'), digest_size=6, key=self._salt).hexdigest()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def read_events(path: str) -> Iterator[Tuple[float, str, NamespaceRecord]]:
+    with open(path, 'r', encoding='utf-8') as events:
+        for line in events:
+            if line.strip():
+                entry = json.loads(line)
+                yield entry['t'], entry['e'], NamespaceRecord(entry['n'], entry['a'], entry.get('v'))
+
+class EventReplayer:
+    # Plays a recording back in place of the cluster. list_page, stream and stop stand in for RawNamespaceWatch and
+    # patch_namespace for the kubernetes API, so a controller given it as both namespace_source and kubeapi runs just
+    # as it did when recording. Events come at their recorded pace divided by speed, or as fast as they're taken with 0
+    def __init__(self, path: str, speed: float = 1.0):
+        self.speed = speed
+        self.listing = []
+        self.events = []
+        for t, event_type, record in read_events(path):
+            if event_type == LIST and not self.events:
+                self.listing.append(record)
+            else:
+                # A relist later on, after a resync or an expired watch, replays as the namespaces being seen again
+                self.events.append((t, 'MODIFIED' if event_type == LIST else event_type, record))
+        self.resource_version = None
+        self.patches = []
+        self.events_replayed = 0
+        # How far behind the recorded pace the consumer fell, at worst
+        self.max_lag = 0.0
+        self._position = 0
+        self._stop = False
+
+    def list_page(self, limit: int, _continue: str = None) -> Tuple[List[NamespaceRecord], str]:
+        start = int(_continue or 0)
+        end = start + limit
+        page = [ _copy(record) for record in self.listing[start:end] ]
+        return page, str(end) if end < len(self.listing) else None
+
+    def stream(self) -> Iterator[Dict]:
+        # Picks up where a stopped stream left off, and ends once the recording runs out
+        self._stop = False
+        if self._position >= len(self.events):
+            return
+        started = time.monotonic()
+        first = self.events[self._position][0]
+        while self._position < len(self.events) and not self._stop:
+            t, event_type, record = self.events[self._position]
+            self._position += 1
+            if self.speed > 0:
+                delay = started + (t - first) / self.speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    self.max_lag = max(self.max_lag, -delay)
+            self.resource_version = record.resource_version
+            self.events_replayed += 1
+            yield { 'type': event_type, 'object': _copy(record) }
+
+    def stop(self):
+        self._stop = True
+
+    def patch_namespace(self, name: str, body: Dict):
+        self.patches.append((name, body))
+
+def _copy(record: NamespaceRecord) -> NamespaceRecord:
+    # The controller writes the project ID into the annotations it's handed, which mustn't leak into the recording
+    return NamespaceRecord(record.name, dict(record.annotations), record.resource_version)
@@ -0,0 +1,125 @@
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Dict, List
+import itertools
+import threading
+import time
+from .RancherPrincipal import RancherPrincipal
+
+class FakeRancher:
+    # An in-memory stand-in for RancherApi, for replaying recorded namespace events without a Rancher server.
+    # Every name searched for turns out to be a principal, and call_counts goes up by what the real client would
+    # have sent, each request taking latency seconds
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.call_counts = Counter()
+        self.projects = {}
+        self.bindings = {}
+        # Binding IDs by project, so looking up one project's bindings doesn't scan every binding
+        self._project_bindings = defaultdict(set)
+        self._clusters = set()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._request_counters = threading.local()
+
+    @contextmanager
+    def count_requests(self, counter: Counter):
+        previous = self.request_counter()
+        self._request_counters.counter = counter
+        try:
+            yield counter
+        finally:
+            self._request_counters.counter = previous
+
+    def request_counter(self) -> Counter:
+        return getattr(self._request_counters, 'counter', None)
+
+    def _request(self, *methods: str):
+        counter = self.request_counter()
+        with self._lock:
+            self.call_counts.update(methods)
+            if counter is not None:
+                counter.update(methods)
+        if self.latency > 0:
+            time.sleep(self.latency * len(methods))
+
+    def list_projects(self) -> List[Dict]:
+        self._request('GET')
+        with self._lock:
+            return [ dict(project) for project in self.projects.values() ]
+
+    def list_project_role_bindings(self) -> List[Dict]:
+        self._request('GET')
+        with self._lock:
+            return [ dict(binding) for binding in self.bindings.values() ]
+
+    def get_project(self, name: str, cluster_id: str = None) -> Dict:
+        self._request('GET')
+        with self._lock:
+            return next((dict(project) for project in self.projects.values()
+                         if project['name'] == name and cluster_id in (None, project['clusterId'])), None)
+
+    def get_project_by_id(self, project_id: str) -> Dict:
+        self._request('GET')
+        with self._lock:
+            project = self.projects.get(project_id)
+            return dict(project) if project is not None else None
+
+    def create_project(self, name: str, cluster: str) -> Dict:
+        if name is None or cluster is None:
+            raise TypeError("Project and cluster must not be None")
+        cluster_id = self.get_cluster_id(cluster)
+        self._request('POST')
+        with self._lock:
+            project = { 'id': f'{cluster_id}:p-{next(self._ids)}', 'name': name, 'clusterId': cluster_id }
+            self.projects[project['id']] = project
+            return dict(project)
+
+    def get_cluster_id(self, cluster: str) -> str:
+        # Every cluster's ID is its name. Looked up the first time RancherApi sees the cluster, cached after that
+        with self._lock:
+            looked_up = cluster in self._clusters
+            self._clusters.add(cluster)
+        if not looked_up:
+            self._request('GET')
+        return cluster
+
+    def search_principal(self, name: str) -> RancherPrincipal:
+        if name is None:
+            raise TypeError("name must not be None")
+        self._request('POST')
+        return RancherPrincipal({ 'id': f'local://{name}', 'principalType': 'user', 'name': name })
+
+    def get_project_bindings(self, project_id: str) -> List[Dict]:
+        if project_id is None:
+            raise TypeError("project_id must not be None")
+        self._request('GET')
+        with self._lock:
+            return [ dict(self.bindings[binding_id]) for binding_id in self._project_bindings.get(project_id, ()) ]
+
+    def create_project_binding(self, project_id: str, rolename: str, member: RancherPrincipal) -> Dict:
+        if project_id is None or member is None or rolename is None:
+            raise TypeError("project_id, member, and rolename must not be None")
+        self._request('POST')
+        with self._lock:
+            binding_id = f"{project_id.split(':')[-1]}:prtb-{next(self._ids)}"
+            binding = { 'id': binding_id, 'projectId': project_id, 'roleTemplateId': rolename,
+                        'groupPrincipalId': member.id if member.is_group else None,
+                        'userPrincipalId': None if member.is_group else member.id }
+            self.add_binding(binding)
+            return dict(binding)
+
+    def delete_project_binding(self, binding_id: str) -> Dict:
+        if binding_id is None:
+            raise TypeError("binding_id must not be None")
+        self._request('DELETE')
+        with self._lock:
+            binding = self.bindings.pop(binding_id, None)
+            if binding is not None:
+                self._project_bindings[binding['projectId']].discard(binding_id)
+            return binding
+
+    def add_binding(self, binding: Dict):
+        # For seeding bindings that exist before a replay starts, without counting a request
+        self.bindings[binding['id']] = binding
+        self._project_bindings[binding['projectId']].add(binding['id'])
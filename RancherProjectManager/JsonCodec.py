@@ -0,0 +1,48 @@
+from typing import Any, Dict, Iterable, List
+import json
+import requests
+
+class JsonCodec:
+    # The standard library codec, which leaves decoding and encoding to requests itself
+    name = 'json'
+
+    def decode_response(self, response: requests.Response) -> Any:
+        return response.json()
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+    def request_kwargs(self, body: Dict) -> Dict:
+        return { 'json': body }
+
+class OrjsonCodec(JsonCodec):
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+
+    def decode_response(self, response: requests.Response) -> Any:
+        return self._orjson.loads(response.content)
+
+    def loads(self, data: bytes) -> Any:
+        return self._orjson.loads(data)
+
+    def request_kwargs(self, body: Dict) -> Dict:
+        return { 'data': self._orjson.dumps(body), 'headers': { 'Content-Type': 'application/json' } }
+
+def get_codec(name: str = 'auto') -> JsonCodec:
+    if name == 'json':
+        return JsonCodec()
+    if name == 'orjson':
+        return OrjsonCodec()
+    if name == 'auto':
+        try:
+            return OrjsonCodec()
+        except ImportError:
+            return JsonCodec()
+    raise ValueError(f"Unknown JSON codec {name}")
+
+def keep_fields(items: List[Dict], fields: Iterable[str]) -> List[Dict]:
+    # Drops everything but the named fields (links, actions, annotations...) so large listings don't stay in memory
+    return [ { field: item[field] for field in fields if field in item } for item in items ]
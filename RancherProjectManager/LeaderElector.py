@@ -0,0 +1,129 @@
+from datetime import datetime, timedelta, timezone
+from kubernetes import client
+from kubernetes.client.exceptions import ApiException
+from typing import Callable
+import logging
+import threading
+import time
+
+class LeaderElector:
+    def __init__(self, coordination_api: client.CoordinationV1Api, namespace: str, name: str, identity: str,
+                    lease_duration: int = 15, renew_interval: float = 5, on_lost: Callable[[], None] = None,
+                    renew_deadline: float = 10):
+        if renew_interval >= lease_duration:
+            raise ValueError("renew_interval must be shorter than lease_duration")
+        if not renew_interval < renew_deadline < lease_duration:
+            raise ValueError("renew_deadline must be between renew_interval and lease_duration")
+        self.coordination_api = coordination_api
+        self.namespace = namespace
+        self.name = name
+        self.identity = identity
+        self.lease_duration = lease_duration
+        self.renew_interval = renew_interval
+        self.renew_deadline = renew_deadline
+        self.on_lost = on_lost
+        self.is_leader = False
+        # Who held the lease when it was last read
+        self.holder = None
+        self._stop = threading.Event()
+        self._renew_thread = None
+
+    def acquire(self):
+        logging.info(f'Waiting to acquire leader lease {self.namespace}/{self.name} as {self.identity}...')
+        while not self._stop.is_set():
+            if self.try_acquire_or_renew(time.monotonic() + self.renew_deadline):
+                logging.info(f'Acquired leader lease {self.namespace}/{self.name}')
+                self.is_leader = True
+                self._renew_thread = threading.Thread(target=self._renew_loop, name='lease-renewer', daemon=True)
+                self._renew_thread.start()
+                return
+            self._stop.wait(self.renew_interval)
+
+    def stop(self):
+        self._stop.set()
+
+    def _renew_loop(self):
+        last_renewal = time.monotonic()
+        while not self._stop.wait(self.renew_interval):
+            # Like client-go, give up leading once renew_deadline has passed without a renewal, which is before the
+            # lease runs out for the other replicas
+            deadline = last_renewal + self.renew_deadline
+            started = time.monotonic()
+            try:
+                renewed = started < deadline and self.try_acquire_or_renew(deadline)
+            except Exception:
+                logging.exception(f'Error renewing leader lease {self.namespace}/{self.name}')
+                renewed = False
+
+            if renewed:
+                last_renewal = started
+            elif self.holder not in (None, self.identity):
+                self._step_down(f'Leader lease {self.namespace}/{self.name} was taken over by {self.holder}')
+                return
+            elif time.monotonic() >= deadline:
+                self._step_down(f'Could not renew leader lease {self.namespace}/{self.name} within {self.renew_deadline}s')
+                return
+
+    def _step_down(self, reason: str):
+        logging.error(f'Lost leader lease: {reason}')
+        self.is_leader = False
+        if self.on_lost is not None:
+            self.on_lost()
+
+    def try_acquire_or_renew(self, deadline: float = None) -> bool:
+        # deadline is a time.monotonic() by which every request has to have been answered
+        now = datetime.now(timezone.utc)
+        try:
+            lease = self.coordination_api.read_namespaced_lease(self.name, self.namespace, _request_timeout=request_timeout(deadline))
+        except ApiException as e:
+            if e.status != 404:
+                raise
+            return self._create_lease(now, deadline)
+
+        spec = lease.spec
+        self.holder = spec.holder_identity
+        if spec.holder_identity != self.identity:
+            if not lease_expired(spec, now):
+                return False
+            spec.holder_identity = self.identity
+            spec.acquire_time = now
+            spec.lease_transitions = (spec.lease_transitions or 0) + 1
+        spec.renew_time = now
+        spec.lease_duration_seconds = self.lease_duration
+
+        try:
+            # The lease's resourceVersion makes this a compare-and-swap, so only one contender wins
+            self.coordination_api.replace_namespaced_lease(self.name, self.namespace, lease,
+                                                            _request_timeout=request_timeout(deadline))
+        except ApiException as e:
+            if e.status == 409:
+                return False
+            raise
+        self.holder = self.identity
+        return True
+
+    def _create_lease(self, now: datetime, deadline: float = None) -> bool:
+        lease = client.V1Lease(
+            metadata=client.V1ObjectMeta(name=self.name, namespace=self.namespace),
+            spec=client.V1LeaseSpec(holder_identity=self.identity, lease_duration_seconds=self.lease_duration,
+                                    acquire_time=now, renew_time=now, lease_transitions=0))
+        try:
+            self.coordination_api.create_namespaced_lease(self.namespace, lease, _request_timeout=request_timeout(deadline))
+        except ApiException as e:
+            if e.status == 409:
+                return False
+            raise
+        self.holder = self.identity
+        return True
+
+def request_timeout(deadline: float) -> float:
+    # What's left until deadline, as a request timeout. A request can't be given nothing, so at least a moment
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0.1)
+
+def lease_expired(spec: client.V1LeaseSpec, now: datetime) -> bool:
+    if spec.holder_identity is None or spec.renew_time is None:
+        return True
+    duration = timedelta(seconds=spec.lease_duration_seconds or 0)
+    return spec.renew_time + duration < now
@@ -0,0 +1,87 @@
+from datetime import datetime, timezone
+import itertools
+import json
+import logging
+import threading
+
+PAYLOAD_LOGGER = 'RancherProjectManager.payloads'
+
+# Attributes every LogRecord has; anything else on a record came in through extra= and is worth emitting
+_STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | { 'message', 'asctime' }
+
+class Payload:
+    # Defers rendering a (potentially huge) response until a handler actually formats the record
+    max_chars = 2000
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        if isinstance(self.data, (str, bytes)):
+            text = self.data if isinstance(self.data, str) else self.data.decode('utf-8', 'replace')
+            return self._truncate(text)
+
+        # Encode incrementally and stop at the limit, so a truncated payload never gets rendered whole
+        chunks = []
+        length = 0
+        for chunk in json.JSONEncoder(default=str).iterencode(self.data):
+            chunks.append(chunk)
+            length += len(chunk)
+            if self.max_chars and length > self.max_chars:
+                return self._truncate(''.join(chunks))
+        return ''.join(chunks)
+
+    def _truncate(self, text: str) -> str:
+        if self.max_chars and len(text) > self.max_chars:
+            return f'{text[:self.max_chars]}... (truncated)'
+        return text
+
+class SampleFilter(logging.Filter):
+    # Lets through one record in every `rate`
+    def __init__(self, rate: int):
+        super().__init__()
+        if rate < 1:
+            raise ValueError("rate must be at least 1")
+        self.rate = rate
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        with self._lock:
+            return next(self._counter) % self.rate == 0
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def configure_logging(level: str = 'INFO', json_format: bool = False, payload_limit: int = 2000, payload_sample_rate: int = 1):
+    handler = logging.StreamHandler()
+    if json_format:
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    Payload.max_chars = payload_limit
+    payloads = logging.getLogger(PAYLOAD_LOGGER)
+    for existing in list(payloads.filters):
+        payloads.removeFilter(existing)
+    if payload_sample_rate > 1:
+        payloads.addFilter(SampleFilter(payload_sample_rate))
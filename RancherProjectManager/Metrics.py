@@ -0,0 +1,39 @@
+from typing import Callable, Dict, List, Union
+
+# A collector returns one value, or a dict of values keyed by the metric's label
+Collector = Callable[[], Union[float, Dict[str, float]]]
+
+class MetricsRegistry:
+    # Reads counters from the objects that already keep them, only when /metrics is scraped
+    def __init__(self, prefix: str = 'rancher_project_manager'):
+        self.prefix = prefix
+        self._metrics = []
+
+    def register(self, name: str, kind: str, help: str, collect: Collector, label: str = None):
+        if kind not in ('counter', 'gauge'):
+            raise ValueError(f"Unknown metric type {kind}")
+        self._metrics.append((f'{self.prefix}_{name}', kind, help, collect, label))
+
+    def render(self) -> str:
+        lines = []
+        for name, kind, help, collect, label in self._metrics:
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            value = collect()
+            if label is None:
+                lines.append(f'{name} {_format_value(value)}')
+            else:
+                for key, item in sorted(value.items()):
+                    lines.append(f'{name}{{{label}="{_escape(key)}"}} {_format_value(item)}')
+        return '\n'.join(lines) + '\n'
+
+    def handle(self, query: Dict[str, List[str]]):
+        return 200, 'text/plain; version=0.0.4', self.render().encode('utf-8')
+
+def _format_value(value: float) -> str:
+    if value is None:
+        return 'NaN'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,62 @@
+from kubernetes import client, config
+from typing import Callable, Dict, List, Tuple
+import logging
+import os
+import threading
+import time
+from .RancherProjectManagement import RancherProjectManagement
+
+def discover_contexts(kubeconfig: str) -> List[Tuple[str, str]]:
+    if os.path.isdir(kubeconfig):
+        files = [ os.path.join(kubeconfig, f) for f in sorted(os.listdir(kubeconfig)) if not f.startswith('.') ]
+        files = [ f for f in files if os.path.isfile(f) ]
+    else:
+        files = [ kubeconfig ]
+
+    found = {}
+    for config_file in files:
+        contexts, _ = config.list_kube_config_contexts(config_file=config_file)
+        for context in contexts:
+            name = context['name']
+            if name in found:
+                logging.warning(f'Kube context {name} in {config_file} is already defined in {found[name]}, ignoring it')
+                continue
+            found[name] = config_file
+    return [ (config_file, name) for name, config_file in found.items() ]
+
+class MultiClusterManager:
+    def __init__(self, controller_factory: Callable[[client.CoreV1Api, str], RancherProjectManagement], kubeconfig: str,
+                    cluster_map: Dict[str, str] = None, retry_delay: float = 10):
+        self.retry_delay = retry_delay
+        self.controllers = {}
+        cluster_map = cluster_map or {}
+        for config_file, context in discover_contexts(kubeconfig):
+            api_client = config.new_client_from_config(config_file=config_file, context=context)
+            cluster_id = cluster_map.get(context, context)
+            logging.info(f'Managing kube context {context} as Rancher cluster {cluster_id}')
+            self.controllers[context] = controller_factory(client.CoreV1Api(api_client), cluster_id)
+
+        if len(self.controllers) == 0:
+            raise ValueError(f'No kube contexts found in {kubeconfig}')
+
+    def run(self):
+        threads = []
+        for context, controller in self.controllers.items():
+            thread = threading.Thread(target=self._run_cluster, args=(context, controller), name=f'cluster-{context}', daemon=True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+    def _run_cluster(self, context: str, controller: RancherProjectManagement):
+        # One unreachable cluster shouldn't take the others down with it
+        while True:
+            try:
+                controller.run()
+            except Exception:
+                logging.exception(f'Watch on kube context {context} failed, retrying in {self.retry_delay}s')
+                time.sleep(self.retry_delay)
+
+    def request_resync(self, *args):
+        for controller in self.controllers.values():
+            controller.request_resync()
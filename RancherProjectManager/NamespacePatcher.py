@@ -0,0 +1,150 @@
+from collections import Counter, OrderedDict
+from kubernetes import client
+from kubernetes.client.exceptions import ApiException
+from typing import Any, Callable
+import logging
+import threading
+import time
+from .RateLimiter import RateLimiter
+
+# (name, type, description) of everything NamespacePatcher.stats holds, for publishing on /metrics
+METRICS = (
+    ('namespace_patches_total', 'counter', 'Namespace patches sent to the Kubernetes API, retries included'),
+    ('namespace_patch_retries_total', 'counter', 'Failed namespace patches queued to be sent again'),
+    ('namespace_patch_errors_total', 'counter', 'Namespace patches given up on, rejected or never answered'),
+    ('namespace_patches_coalesced_total', 'counter', 'Namespace patches merged into one already waiting to be sent'),
+    ('namespace_patch_seconds_total', 'counter', 'Time spent waiting on the Kubernetes API for namespace patches'),
+    ('namespace_patch_max_seconds', 'gauge', 'Slowest namespace patch so far'),
+    ('namespace_patches_throttled_total', 'counter', 'Namespace patches held back by the client-side rate limit'),
+    ('namespace_patch_throttled_seconds_total', 'counter', 'Time namespace patches spent held back by the rate limit'),
+    ('namespace_patches_pending', 'gauge', 'Namespace patches waiting to be sent')
+)
+
+class NamespacePatcher:
+    # Sends namespace patches from up to workers threads, no faster than rate_limiter allows. A patch for a namespace
+    # whose previous patch is still waiting is merged into that one, so a burst of changes costs one request. A patch
+    # that fails with an error worth retrying goes back in the queue, up to max_retries times, waiting retry_delay
+    # seconds and twice as long after each further failure. on_patched is called with each namespace patched
+    def __init__(self, kubeapi: client.CoreV1Api, rate_limiter: RateLimiter = None, workers: int = 4,
+                    max_retries: int = 5, retry_delay: float = 1, on_patched: Callable[[str], None] = None):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.kubeapi = kubeapi
+        self.rate_limiter = rate_limiter
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.on_patched = on_patched
+        self.stats = Counter()
+        self._pending = OrderedDict()
+        # Failed attempts so far and when the next may go out, for patches waiting to be retried
+        self._attempts = {}
+        self._not_before = {}
+        self._in_flight = set()
+        self._threads = []
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def patch(self, name: str, body: Any):
+        with self._cond:
+            if name in self._pending:
+                self._pending[name] = _merge(self._pending[name], body)
+                self.stats['namespace_patches_coalesced_total'] += 1
+                return
+            self._pending[name] = body
+            self.stats['namespace_patches_pending'] = len(self._pending)
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f'namespace-patcher-{len(self._threads)}', daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            self._cond.notify_all()
+
+    def _next(self):
+        # The oldest waiting patch for a namespace that isn't being patched already, so patches to one namespace go
+        # out in order, and isn't waiting out a retry delay
+        with self._cond:
+            while not self._closed:
+                now = time.monotonic()
+                waiting = [ name for name in self._pending if name not in self._in_flight ]
+                name = next((name for name in waiting if self._not_before.get(name, now) <= now), None)
+                if name is not None:
+                    self._in_flight.add(name)
+                    body = self._pending.pop(name)
+                    self._not_before.pop(name, None)
+                    self.stats['namespace_patches_pending'] = len(self._pending)
+                    return name, body, self._attempts.pop(name, 0)
+                delays = [ self._not_before[name] - now for name in waiting if name in self._not_before ]
+                self._cond.wait(min(delays) if delays else None)
+            return None
+
+    def _work(self):
+        while True:
+            task = self._next()
+            if task is None:
+                return
+            name, body, attempts = task
+            throttled = self.rate_limiter.acquire() if self.rate_limiter is not None else 0.0
+            start = time.perf_counter()
+            failed = False
+            retry = False
+            try:
+                self.kubeapi.patch_namespace(name, body)
+                # Before it stops counting as in flight, so it's been counted by the time join() returns
+                if self.on_patched is not None:
+                    self.on_patched(name)
+            except ApiException as e:
+                if e.status == 404:
+                    logging.info(f'Namespace {name} was deleted before it could be patched', extra={ 'namespace': name })
+                else:
+                    # Throttling and server errors may well pass, anything else would only be rejected again
+                    retry = attempts < self.max_retries and (not e.status or e.status == 429 or e.status >= 500)
+                    failed = not retry
+                    logging.exception(f'ERROR patching namespace {name}{", will retry" if retry else ""}', extra={ 'namespace': name })
+            except Exception:
+                # Anything else too, a worker that dies would leave every later patch stuck. Most likely the
+                # connection, so worth another go
+                retry = attempts < self.max_retries
+                failed = not retry
+                logging.exception(f'ERROR patching namespace {name}{", will retry" if retry else ""}', extra={ 'namespace': name })
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._cond:
+                    self._in_flight.discard(name)
+                    if retry:
+                        # Merged under any newer patch that came in meanwhile, which wins key by key
+                        self._pending[name] = _merge(body, self._pending[name]) if name in self._pending else body
+                        self._attempts[name] = attempts + 1
+                        self._not_before[name] = time.monotonic() + self.retry_delay * 2 ** attempts
+                        self.stats['namespace_patches_pending'] = len(self._pending)
+                        self.stats['namespace_patch_retries_total'] += 1
+                    self.stats['namespace_patches_total'] += 1
+                    self.stats['namespace_patch_errors_total'] += failed
+                    self.stats['namespace_patch_seconds_total'] += elapsed
+                    self.stats['namespace_patch_max_seconds'] = max(self.stats['namespace_patch_max_seconds'], elapsed)
+                    if throttled > 0:
+                        self.stats['namespace_patches_throttled_total'] += 1
+                        self.stats['namespace_patch_throttled_seconds_total'] += throttled
+                    self._cond.notify_all()
+
+    def pending(self) -> int:
+        # Patches waiting or being sent
+        with self._cond:
+            return len(self._pending) + len(self._in_flight)
+
+    def join(self, timeout: float = None) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._in_flight, timeout)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+def _merge(older: Any, newer: Any) -> Any:
+    # Merge patch semantics: the newer patch wins key by key, and a whole object, like a V1Namespace, just replaces
+    if isinstance(older, dict) and isinstance(newer, dict):
+        merged = dict(older)
+        for key, value in newer.items():
+            merged[key] = _merge(older[key], value) if key in older else value
+        return merged
+    return newer
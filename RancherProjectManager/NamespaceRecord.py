@@ -0,0 +1,33 @@
+from kubernetes.client.models.v1_namespace import V1Namespace
+from typing import Dict, Iterable
+
+class NamespaceRecord:
+    # Everything process_namespace needs from a namespace, without the weight of a V1Namespace model
+    __slots__ = ('name', 'annotations', 'resource_version')
+
+    def __init__(self, name: str, annotations: Dict[str, str], resource_version: str = None):
+        self.name = name
+        self.annotations = annotations
+        self.resource_version = resource_version
+
+    @classmethod
+    def from_dict(cls, obj: Dict, annotation_keys: Iterable[str] = None) -> 'NamespaceRecord':
+        metadata = obj['metadata']
+        annotations = metadata.get('annotations') or {}
+        if annotation_keys is not None:
+            annotations = { key: annotations[key] for key in annotation_keys if key in annotations }
+        return cls(metadata['name'], annotations, metadata.get('resourceVersion'))
+
+    @classmethod
+    def from_model(cls, namespace: V1Namespace) -> 'NamespaceRecord':
+        # Shares the model's annotations dict, so annotations written to the record show up on the model too
+        metadata = namespace.metadata
+        annotations = metadata.annotations if metadata.annotations is not None else {}
+        return cls(metadata.name, annotations, metadata.resource_version)
+
+    def __eq__(self, other):
+        return isinstance(other, NamespaceRecord) and (self.name, self.annotations, self.resource_version) == \
+                (other.name, other.annotations, other.resource_version)
+
+    def __repr__(self):
+        return f"NamespaceRecord({self.name}@{self.resource_version})"
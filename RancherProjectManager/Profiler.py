@@ -0,0 +1,125 @@
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Tuple
+import inspect
+import sys
+import threading
+import time
+import tracemalloc
+from .RancherApi import RancherApi
+from .RancherProjectManagement import RancherProjectManagement
+
+# Longest capture allowed, so a typo in the query can't tie the profiler up for hours
+MAX_SECONDS = 300
+
+def default_focus() -> List[Callable]:
+    # The controller's main entry points and every Rancher request, which profiles are summarised by
+    focus = [ RancherProjectManagement.watch, RancherProjectManagement.process_namespace,
+              RancherProjectManagement.handle_project_role, RancherProjectManagement.handle_project_roles ]
+    focus.extend(member for name, member in vars(RancherApi).items() if inspect.isfunction(member) and not name.startswith('__'))
+    return focus
+
+class Profiler:
+    # Captures profiles of the live process on request. CPU profiles sample every thread's stack from a thread of their
+    # own, and heap diffs only trace allocations between their two snapshots, so nothing is paid outside a capture
+    def __init__(self, focus: Iterable[Callable] = None, interval: float = 0.005):
+        self.interval = interval
+        self.focus = { fn.__code__: fn.__qualname__ for fn in (focus if focus is not None else default_focus()) }
+        self._capturing = threading.Lock()
+
+    def cpu_profile(self, seconds: float) -> Tuple[Counter, int]:
+        # Collapsed stacks ("thread;module:function;... count"), and how many times the threads were sampled
+        stacks = Counter()
+        rounds = 0
+        ignored = { threading.get_ident() }
+        names = {}
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frames = sys._current_frames()
+            if len(names) != len(frames):
+                names = { thread.ident: thread.name for thread in threading.enumerate() }
+            for ident, frame in frames.items():
+                if ident not in ignored:
+                    stacks[self._collapse(names.get(ident, str(ident)), frame)] += 1
+            del frames
+            rounds += 1
+            time.sleep(self.interval)
+        return stacks, rounds
+
+    def _collapse(self, thread_name: str, frame) -> str:
+        calls = []
+        while frame is not None:
+            code = frame.f_code
+            calls.append(self.focus.get(code) or f'{frame.f_globals.get("__name__", "?")}:{code.co_name}')
+            frame = frame.f_back
+        calls.append(thread_name)
+        return ';'.join(reversed(calls))
+
+    def summarize(self, stacks: Counter, rounds: int, seconds: float) -> str:
+        # Thread time spent under each focus function, counted once per sample however deep the recursion
+        per_sample = seconds / rounds if rounds else 0
+        inclusive = Counter()
+        for stack, count in stacks.items():
+            for name in set(stack.split(';')) & set(self.focus.values()):
+                inclusive[name] += count
+        lines = [ f'{rounds} samples of every thread over {seconds:.1f}s, about {per_sample * 1000:.1f}ms apart',
+                  '',
+                  'Thread seconds under each controller and Rancher API function:' ]
+        lines.extend(f'{count * per_sample:10.2f}s  {name}' for name, count in inclusive.most_common())
+        lines.extend([ '', 'Busiest stacks (thread seconds):' ])
+        lines.extend(f'{count * per_sample:10.2f}s  {stack}' for stack, count in stacks.most_common(20))
+        return '\n'.join(lines) + '\n'
+
+    def heap_diff(self, seconds: float, limit: int = 50, frames: int = 10) -> str:
+        # Allocations still held at the end of the window, grouped by the line that made them
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start(frames)
+        try:
+            before = tracemalloc.take_snapshot()
+            time.sleep(seconds)
+            after = tracemalloc.take_snapshot()
+        finally:
+            if started:
+                tracemalloc.stop()
+        stats = after.compare_to(before, 'lineno')
+        growth = sum(stat.size_diff for stat in stats)
+        lines = [ f'Heap grew by {growth / 1024:.1f} KiB over {seconds:.1f}s', '' ]
+        lines.extend(str(stat) for stat in stats[:limit])
+        return '\n'.join(lines) + '\n'
+
+    def handle_cpu(self, query: Dict[str, List[str]]):
+        # /debug/profile?seconds=30, with format=collapsed for input to flame graph tools
+        output = query.get('format', [ 'text' ])[0]
+        extension = 'folded' if output == 'collapsed' else 'txt'
+        return self._capture(query, f'cpu-profile.{extension}', lambda seconds: self._cpu_body(seconds, output))
+
+    def handle_heap(self, query: Dict[str, List[str]]):
+        # /debug/heap?seconds=30&limit=50
+        try:
+            limit = int(query.get('limit', [ 50 ])[0])
+        except ValueError:
+            return 400, 'text/plain', b'limit must be a whole number'
+        return self._capture(query, 'heap-diff.txt', lambda seconds: self.heap_diff(seconds, limit))
+
+    def _cpu_body(self, seconds: float, output: str) -> str:
+        stacks, rounds = self.cpu_profile(seconds)
+        if output == 'collapsed':
+            return ''.join(f'{stack} {count}\n' for stack, count in stacks.items())
+        return self.summarize(stacks, rounds, seconds)
+
+    def _capture(self, query: Dict[str, List[str]], filename: str, capture: Callable[[float], str]):
+        try:
+            seconds = float(query.get('seconds', [ 30 ])[0])
+        except ValueError:
+            return 400, 'text/plain', b'seconds must be a number'
+        if not 0 < seconds <= MAX_SECONDS:
+            return 400, 'text/plain', f'seconds must be between 0 and {MAX_SECONDS}'.encode('utf-8')
+        # One capture at a time, a second one would mostly be profiling the first
+        if not self._capturing.acquire(blocking=False):
+            return 409, 'text/plain', b'a profile is already being captured'
+        try:
+            body = capture(seconds).encode('utf-8')
+            stamp = time.strftime('%Y%m%dT%H%M%S')
+            return 200, 'text/plain; charset=utf-8', body, { 'Content-Disposition': f'attachment; filename="{stamp}-{filename}"' }
+        finally:
+            self._capturing.release()
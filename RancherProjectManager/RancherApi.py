@@ -1,75 +1,208 @@
-from typing import List, Dict
+from collections import Counter
+from contextlib import contextmanager
+from typing import List, Dict, Tuple
 import requests
 import logging
+import threading
 import urllib.parse
 from .RancherPrincipal import RancherPrincipal
+from .RateLimiter import RateLimiter
+from .LogFormatting import PAYLOAD_LOGGER, Payload
+from .JsonCodec import JsonCodec, keep_fields
+from .ResponseCache import ResponseCache
 from json.decoder import JSONDecodeError
 
+payload_log = logging.getLogger(PAYLOAD_LOGGER)
+
+# The only fields this app reads from each kind of Rancher object
+PROJECT_FIELDS = ('id', 'name', 'clusterId')
+BINDING_FIELDS = ('id', 'projectId', 'roleTemplateId', 'groupPrincipalId', 'userPrincipalId')
+
+def binding_principal_id(binding: Dict) -> str:
+    return binding.get('groupPrincipalId') or binding.get('userPrincipalId')
+
+def query(path: str, **params) -> str:
+    # Every value percent-encoded, principal IDs like local://u-abc and names with spaces included. None means no filter
+    return path + '?' + urllib.parse.urlencode({ key: value for key, value in params.items() if value is not None },
+                                                quote_via=urllib.parse.quote)
+
 class RancherApi:
-    def __init__(self, address: str, key: str, secret: str):
+    def __init__(self, address: str, key: str, secret: str, session: requests.Session = None, rate_limiter: RateLimiter = None,
+                    codec: JsonCodec = None, response_cache: ResponseCache = None):
         self.address = address
         self.key = key
         self.__secret = secret
+        # Without a session every call goes through requests' module functions and opens a fresh connection
+        self.session = session if session is not None else requests
+        self.rate_limiter = rate_limiter
+        self.codec = codec if codec is not None else JsonCodec()
+        self.response_cache = response_cache
+        self.call_counts = Counter()
+        self._call_counts_lock = threading.Lock()
+        # The counter each thread's requests are also counted in, if any, so a caller can count just its own requests
+        self._request_counters = threading.local()
+        # Cluster name -> ID, clusters outlive any number of projects so each is only looked up once
+        self._cluster_ids = {}
+        self._cluster_ids_lock = threading.Lock()
+
+    @contextmanager
+    def count_requests(self, counter: Counter):
+        # Counts the requests this thread makes in counter as well, until the block ends
+        previous = self.request_counter()
+        self._request_counters.counter = counter
+        try:
+            yield counter
+        finally:
+            self._request_counters.counter = previous
+
+    def request_counter(self) -> Counter:
+        return getattr(self._request_counters, 'counter', None)
+
+    def _before_request(self, method: str):
+        counter = self.request_counter()
+        with self._call_counts_lock:
+            self.call_counts[method] += 1
+            if counter is not None:
+                counter[method] += 1
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
 
     def _get(self, path: str) -> Dict:
         url = self.address + path
-        logging.debug(f"Sending GET request to {url}...")
-        r = requests.get(url, auth = (self.key, self.__secret))
+        if self.response_cache is not None:
+            data = self._get_conditional(url)
+        else:
+            logging.debug("Sending GET request to %s...", url)
+            self._before_request('GET')
+            r = self.session.get(url, auth = (self.key, self.__secret))
+            r.raise_for_status()
+            try:
+                data = self.codec.decode_response(r)
+            except (JSONDecodeError, KeyError) as e: 
+                raise RancherResponseError(url, r.content) from e
+        if payload_log.isEnabledFor(logging.DEBUG):
+            payload_log.debug("GET request returned payload: %s", Payload(data), extra={ 'method': 'GET', 'url': url })
+        return data
+
+    def _get_conditional(self, url: str) -> Dict:
+        # Revalidates a cached body with its ETag/Last-Modified, so an unchanged resource costs headers, not a payload
+        headers = self.response_cache.request_headers(url)
+        logging.debug("Sending %sGET request to %s...", 'conditional ' if headers else '', url)
+        self._before_request('GET')
+        r = self.session.get(url, auth = (self.key, self.__secret), headers = headers)
         r.raise_for_status()
+
+        content = self.response_cache.not_modified(url) if r.status_code == 304 else None
+        if r.status_code == 304 and content is None:
+            # Evicted while the request was out, ask again for the whole thing
+            self._before_request('GET')
+            r = self.session.get(url, auth = (self.key, self.__secret))
+            r.raise_for_status()
+        if content is None:
+            content = r.content
+            self.response_cache.store(url, r.headers, content)
+
         try:
-            data = r.json()
-        except (JSONDecodeError, KeyError) as e: 
-            raise RancherResponseError(url, r.content) from e
-        logging.debug(f"GET request returned payload: {data}")
-        return data
+            return self.codec.loads(content)
+        except (JSONDecodeError, ValueError) as e:
+            raise RancherResponseError(url, content) from e
 
     def _post(self, path: str, body: Dict) -> Dict:
         url = self.address + path
-        logging.debug(f"Sending POST request to {url}...")
-        r = requests.post(url, auth = (self.key, self.__secret), json = body)
+        logging.debug("Sending POST request to %s...", url)
+        self._before_request('POST')
+        r = self.session.post(url, auth = (self.key, self.__secret), **self.codec.request_kwargs(body))
         r.raise_for_status()
         try:
-            json_obj = r.json()
+            json_obj = self.codec.decode_response(r)
         except JSONDecodeError as e:
             raise RancherResponseError(url, r.content) from e
-        logging.debug(f"POST request returned payload: {json_obj}")
+        if payload_log.isEnabledFor(logging.DEBUG):
+            payload_log.debug("POST request returned payload: %s", Payload(json_obj), extra={ 'method': 'POST', 'url': url })
         return json_obj
 
     def _delete(self, path: str) -> Dict:
         url = self.address + path
-        logging.debug(f"Sending DELETE request to {url}...")
-        r = requests.delete(url, auth = (self.key, self.__secret))
+        logging.debug("Sending DELETE request to %s...", url)
+        self._before_request('DELETE')
+        r = self.session.delete(url, auth = (self.key, self.__secret))
         r.raise_for_status()
         try:
-            json_obj = r.json()
+            json_obj = self.codec.decode_response(r)
         except JSONDecodeError as e:
             raise RancherResponseError(url, r.content) from e
-        logging.debug(f"DELETE request returned payload: {json_obj}")
+        if payload_log.isEnabledFor(logging.DEBUG):
+            payload_log.debug("DELETE request returned payload: %s", Payload(json_obj), extra={ 'method': 'DELETE', 'url': url })
         return json_obj
 
-    def get_project(self, name: str) -> Dict:
-        path = '/projects?name=' + name
+    def _get_all(self, path: str, fields: Tuple[str] = None) -> List[Dict]:
+        items = []
+        while path is not None:
+            response = self._get(path)
+            if not isinstance(response.get('data'), list):
+                raise RancherResponseError(self.address + path, response)
+            items.extend(keep_fields(response['data'], fields) if fields is not None else response['data'])
+
+            next_url = (response.get('pagination') or {}).get('next')
+            if next_url is None:
+                path = None
+            elif next_url.startswith(self.address):
+                path = next_url[len(self.address):]
+            else:
+                raise RancherResponseError(self.address + path, response)
+        return items
+
+    def list_projects(self) -> List[Dict]:
+        return self._get_all('/projects?limit=1000', PROJECT_FIELDS)
+
+    def list_project_role_bindings(self) -> List[Dict]:
+        return self._get_all('/projectroletemplatebindings?limit=1000', BINDING_FIELDS)
+
+    def get_project(self, name: str, cluster_id: str = None) -> Dict:
+        # Only the first match is wanted, so only the first is asked for
+        path = query('/projects', name=name, clusterId=cluster_id, limit=1)
         projects = self._get(path)['data']
 
         if not isinstance(projects, list):
             raise RancherResponseError(self.address + path, projects)
-        return next(iter(projects), None)
+        return next(iter(keep_fields(projects, PROJECT_FIELDS)), None)
+
+    def get_project_by_id(self, project_id: str) -> Dict:
+        # A direct lookup, much cheaper for Rancher than a search by name. Rancher answers 403 rather than 404 for
+        # an ID the token can't see, including one from a cluster that's gone, so both mean there's no such project
+        try:
+            project = self._get(f"/projects/{urllib.parse.quote_plus(project_id)}")
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code in (403, 404):
+                return None
+            raise
+        return keep_fields([ project ], PROJECT_FIELDS)[0]
 
     def create_project(self, name: str, cluster: str) -> Dict:
         if name is None or cluster is None:
             raise TypeError("Project and cluster must not be None")
         
-        clusters = self._get(f"/cluster?id={cluster}")['data']
+        cluster_id = self.get_cluster_id(cluster)
+        r = self._post('/projects', { 'name': name, 'clusterId': cluster_id })
+        return r
+
+    def get_cluster_id(self, cluster: str) -> str:
+        with self._cluster_ids_lock:
+            if cluster in self._cluster_ids:
+                return self._cluster_ids[cluster]
+
+        # Misses and errors aren't cached, the cluster may yet be registered
+        path = query('/cluster', id=cluster, limit=1)
+        clusters = self._get(path)['data']
         if len(clusters) < 1:
             raise ValueError("No cluster by that name")
-        
-        cluster = clusters[0]
-        if not 'id' in cluster:
-            raise RancherResponseError(f"{self.address}/cluster?id={cluster}", clusters)
 
-        cluster_id = cluster['id']
-        r = self._post('/projects', { 'name': name, 'clusterId': cluster_id })
-        return r
+        if not 'id' in clusters[0]:
+            raise RancherResponseError(self.address + path, clusters)
+
+        with self._cluster_ids_lock:
+            self._cluster_ids[cluster] = clusters[0]['id']
+        return clusters[0]['id']
 
     def search_principal(self, name: str) -> RancherPrincipal:
         if name is None:
@@ -84,58 +217,26 @@ class RancherApi:
 
         return principal
 
-    def get_project_members(self, project_id: str, rolename: str) -> List[RancherPrincipal]:
-        if project_id is None or rolename is None:
-            raise TypeError("project_id and rolename must not be None")
+    def get_project_bindings(self, project_id: str) -> List[Dict]:
+        # Every role binding in the project, whatever the role, in one paginated read
+        if project_id is None:
+            raise TypeError("project_id must not be None")
+        return self._get_all(query('/projectroletemplatebindings', projectId=project_id, limit=1000), BINDING_FIELDS)
 
-        try:
-            url = f"/projectroletemplatebindings?projectId={project_id}&roleTemplateId={rolename}"
-            prtbs = self._get(url)['data']
-            principals = []
-            for prtb in prtbs:
-                id = prtb['groupPrincipalId'] if prtb['groupPrincipalId'] is not None else prtb['userPrincipalId']
-                url = f"/principals/{urllib.parse.quote_plus(id)}"
-                principal = self._get(url)
-                principals.append(RancherPrincipal(principal))
-        except (KeyError, requests.exceptions.HTTPError) as e:
-            logging.error('Encountered error attempting to retrieve security principal information, my auth token may not have the required access!')
-            raise RancherResponseError(url, None) from e
-
-        return principals
-
-    def add_project_member(self, project_id: str, rolename: str, member: RancherPrincipal) -> Dict:
+    def create_project_binding(self, project_id: str, rolename: str, member: RancherPrincipal) -> Dict:
+        # Doesn't check for an existing binding first; for callers that just listed them
         if project_id is None or member is None or rolename is None:
             raise TypeError("project_id, member, and rolename must not be None")
 
         id_key = 'groupPrincipalId' if member.is_group else 'userPrincipalId'
+        binding = self._post('/projectroletemplatebindings', { 'projectId': project_id, id_key: member.id, 'roleTemplateId': rolename })
+        return keep_fields([ binding ], BINDING_FIELDS)[0]
 
-        existing_member_role_bindings = self._get(f"/projectroletemplatebindings?{id_key}={member.id}&" + 
-                                                    f"projectId={project_id}&" + 
-                                                    f"roleTemplateId={rolename}")['data']
-        if len(existing_member_role_bindings) > 0:
-            return # Already good-to-go
-        
-        resp = self._post('/projectroletemplatebindings', { 
-                                    'projectId': f"{project_id}", 
-                                    id_key: member.id,
-                                    'roleTemplateId': rolename })
-        return resp
-
-    def remove_project_member(self, project_id: str, rolename: str, member: RancherPrincipal) -> Dict:
-        if project_id is None or member is None or rolename is None:
-            raise TypeError("project_id, member, and rolename must not be None")
-
-        id_key = 'groupPrincipalId' if member.is_group else 'userPrincipalId'
-
-        existing_member_role_bindings = self._get(f"/projectroletemplatebindings?{id_key}={member.id}&" + 
-                                                    f"projectId={project_id}&" + 
-                                                    f"roleTemplateId={rolename}")['data']
-        if len(existing_member_role_bindings) == 0:
-            return # Already good-to-go
-        
-        resp = self._delete(f"/projectroletemplatebindings/{existing_member_role_bindings[0]['id']}")
-        return resp
+    def delete_project_binding(self, binding_id: str) -> Dict:
+        if binding_id is None:
+            raise TypeError("binding_id must not be None")
+        return self._delete(f"/projectroletemplatebindings/{urllib.parse.quote_plus(binding_id)}")
 
 class RancherResponseError(Exception):
     def __init__(self, url: str, payload: Dict):
-        super().__init__(f"Unexpected response content from rancher at {url}: {payload}")
\ No newline at end of file
+        super().__init__(f"Unexpected response content from rancher at {url}: {Payload(payload)}")
\ No newline at end of file
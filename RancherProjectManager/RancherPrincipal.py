@@ -10,6 +10,9 @@ class RancherPrincipal:
         except KeyError as e:
             raise ValueError from e
 
+    def to_dict(self) -> Dict:
+        return { 'id': self.id, 'principalType': self.type, 'name': self.name }
+
     def __hash__(self):
         return self.id.__hash__()
 
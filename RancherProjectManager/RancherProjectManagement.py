@@ -1,13 +1,58 @@
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from kubernetes import client, config, watch
+from kubernetes.client.exceptions import ApiException
 from kubernetes.client.models.v1_namespace import V1Namespace
+import functools
 import logging
 import requests
-from typing import List
+import threading
+import time
+import urllib3
+from typing import Any, Callable, Dict, List, Tuple, Union
 import os
-from .RancherApi import RancherApi, RancherResponseError
+from .RancherApi import RancherApi, RancherResponseError, binding_principal_id
+from .RancherPrincipal import RancherPrincipal
+from .ReconcileReport import ReconcileReport
+from .NamespaceRecord import NamespaceRecord
+from .RawNamespaceWatch import RawNamespaceWatch
+from .EventLog import EventRecorder
+from .LogFormatting import PAYLOAD_LOGGER, Payload
+from .WarmCache import WarmCache, PROJECTS, PRINCIPALS, BINDINGS
+from .DriftResync import membership_fingerprint
+from .RateLimiter import RateLimiter
+from .WorkQueue import WorkQueue, HIGH, LOW
+from .NamespacePatcher import NamespacePatcher
+from .ShardCoordinator import ShardCoordinator
+
+payload_log = logging.getLogger(PAYLOAD_LOGGER)
+
+def load_kube_config():
+    if os.getenv('KUBERNETES_SERVICE_HOST'):
+        config.load_incluster_config()
+    else:
+        config.load_kube_config()
+
+def as_record(namespace) -> NamespaceRecord:
+    return namespace if isinstance(namespace, NamespaceRecord) else NamespaceRecord.from_model(namespace)
+
+def is_gone(error: Exception) -> bool:
+    # Rancher answers 403 rather than 404 for a project that was deleted, or that we no longer have access to
+    response = getattr(error, 'response', None)
+    return isinstance(error, requests.HTTPError) and response is not None and response.status_code in (403, 404)
+
+def project_key(cluster_id: str, name: str) -> str:
+    # Warm cache key of a project. Names are only unique within a cluster, and cluster IDs never hold a slash
+    return f'{cluster_id}/{name}'
 
 class RancherProjectManagement:
-    def __init__(self, rancher: RancherApi, project_name_annotation: str, project_id_annotation: str, default_cluster: str, cluster_name_annotation: str, owners_annotation: str, workload_managers_annotation: str):
+    def __init__(self, rancher: RancherApi, project_name_annotation: str, project_id_annotation: str, default_cluster: str, cluster_name_annotation: str, owners_annotation: str, workload_managers_annotation: str,
+                    shard: ShardCoordinator = None, kubeapi: client.CoreV1Api = None, list_page_size: int = 500,
+                    lean_watch: bool = False, cache: WarmCache = None, priority_queue: bool = False, verify_qps: float = 0,
+                    role_workers: int = 1, role_annotations: Dict[str, str] = None, recorder: EventRecorder = None,
+                    namespace_source: RawNamespaceWatch = None, patch_qps: float = 0, patch_burst: int = 10,
+                    patch_workers: int = 4, watch_timeout: int = 0, idle_timeout: float = 0, preprovision_workers: int = 0):
         self.rancher = rancher
         self.project_name_annotation = project_name_annotation
         self.project_id_annotation = project_id_annotation
@@ -15,91 +60,796 @@ class RancherProjectManagement:
         self.cluster_name_annotation = cluster_name_annotation
         self.owners_annotation = owners_annotation
         self.workload_managers_annotation = workload_managers_annotation
-        if os.getenv('KUBERNETES_SERVICE_HOST'):
-            config.load_incluster_config()
-        else:
-            config.load_kube_config()
-        self.kubeapi = client.CoreV1Api()
+        # Annotation -> Rancher role template ID, for every role this controller manages
+        self.role_annotations = { owners_annotation: 'project-owner', workload_managers_annotation: 'workloads-manage' }
+        self.role_annotations.update(role_annotations or {})
+        self.shard = shard
+        self._watcher = None
+        # With watch_timeout, the watch is renewed every watch_timeout seconds from the last resourceVersion seen, and
+        # a connection that's gone idle_timeout seconds without an event or bookmark is dropped and reopened
+        self.watch_timeout = watch_timeout
+        self.idle_timeout = idle_timeout
+        self.watch_reconnects = Counter()
+        self.last_watch_event = None
+        self.last_reconnect_seconds = None
+        self.max_reconnect_seconds = 0.0
+        self._disconnected_at = None
+        self._list_resource_version = None
+        self._stop_watch = False
+        self.list_page_size = list_page_size
+        self.lean_watch = lean_watch
+        # Lists and watches namespaces in place of kubeapi when set, e.g. an EventReplayer
+        self.namespace_source = namespace_source
+        self.recorder = recorder
+        self.cache = cache
+        # With the priority queue, namespaces needing work jump ahead of re-verifications, which run at most verify_qps
+        self.priority_queue = priority_queue
+        self.verify_qps = verify_qps
+        self._queue = None
+        self._worker = None
+        self._worker_error = None
+        self._first_page_queued = False
+        self._seen_wants = {}
+        # Principal lookups and binding changes for one role run up to role_workers at a time
+        self.role_workers = role_workers
+        self._role_pool = None
+        self._role_pool_lock = threading.Lock()
+        # With preprovision_workers, the startup listing is read in full and every missing project created up front,
+        # that many at a time, before any namespace is processed
+        self.preprovision_workers = preprovision_workers
+        # (cluster ID, project name) -> [ lock, threads holding or waiting for it ], for as long as any thread wants it
+        self._project_locks = {}
+        self._project_locks_lock = threading.Lock()
+        # Set once the first page of namespaces has been processed
+        self.ready = threading.Event()
+        self.changes = Counter()
+        self._changes_lock = threading.Lock()
+        # Only populated for the duration of a reconcile_all sweep. Projects are keyed by (cluster ID, name)
+        self._project_index = None
+        self._principal_cache = None
+        self._binding_index = None
+        # Fingerprints of what each managed project role should hold, and the namespace asking for it, for DriftResync
+        self.desired_members = {}
+        self.project_namespaces = {}
+        self._desired_lock = threading.Lock()
+        if kubeapi is None:
+            load_kube_config()
+            kubeapi = client.CoreV1Api()
+        self.kubeapi = kubeapi
+        # With patch_qps, namespace patches go out through a throttled, coalescing patcher instead of one by one inline
+        self.patcher = (NamespacePatcher(kubeapi, RateLimiter(patch_qps, patch_burst), patch_workers, on_patched=self._namespace_patched)
+                        if patch_qps > 0 else None)
+
+    def run(self):
+        while(True):
+            try:
+                self.watch()
+            except ApiException as e:
+                if str(e.status) == '410':
+                    logging.warning('Kubernetes API resources expired - reestablishing watch')
+                    continue
+                else:
+                    logging.exception(f'Kubernetes API fatal error: {e.status}, {e.reason}')
+                    raise
 
     def watch(self):
+        raw_watcher = self._raw_watcher()
+        self._worker_error = None
+        # Cleared before the listing, which covers any resync asked for until now. One asked for during the listing is
+        # left set, for the check after it
+        self._stop_watch = False
+
         # Check 'em all at startup
         logging.info("Checking all namespaces")
-        namespaces = self.kubeapi.list_namespace()
-        for ns in namespaces.items:
-            self.process_namespace(ns)
+        for page in self._startup_pages(raw_watcher):
+            if self.recorder is not None:
+                self.recorder.record_page(page, self.annotation_keys())
+            if self.priority_queue:
+                self._enqueue_page(page)
+                continue
+            for ns in page:
+                self.process_namespace(ns)
+            if not self.ready.is_set():
+                logging.info('First page of namespaces processed, reporting ready')
+                self.ready.set()
+
+        if self._stop_watch:
+            # e.g. a shard rebalance while listing, the caller's loop lists again
+            logging.info('Resync requested during the namespace listing, listing again')
+            return
+
+        if self.priority_queue:
+            # Restarts the worker if it died on an error during a previous watch
+            self._raise_worker_error()
+            self._start_worker()
 
         # Watch for more changes going forward
         logging.info("Watching for additional namespace changes")
-        watcher = watch.Watch()
-        for ns_event in watcher.stream(self.kubeapi.list_namespace):
+        if self.watch_timeout > 0 and self.namespace_source is None:
+            events = self._resumable_events(raw_watcher)
+        elif raw_watcher is not None:
+            self._watcher = raw_watcher
+            events = raw_watcher.stream()
+        else:
+            self._watcher = watch.Watch()
+            events = self._watcher.stream(self.kubeapi.list_namespace)
+        self._raise_worker_error()
+        for ns_event in events:
+            if self._stop_watch:
+                # Also catches a resync asked for before this stream's watcher was in place, which it couldn't stop
+                break
+            if self.recorder is not None:
+                self.recorder.record_event(ns_event, self.annotation_keys())
             try:
-                if ns_event['type'] == 'MODIFIED':
+                if self.priority_queue:
+                    self._enqueue_event(ns_event)
+                elif ns_event['type'] == 'MODIFIED':
                     self.process_namespace(ns_event['object'])
             except (requests.HTTPError, RancherResponseError, ValueError, KeyError) as e:
-                logging.exception("ERROR processing namespace event - raw event: " + str(ns_event))
+                self._log_event_error("ERROR", ns_event)
             except Exception as e:
-                logging.exception("FATAL ERROR processing namespace event - raw event: " + str(ns_event))
+                self._log_event_error("FATAL ERROR", ns_event)
                 raise
+        self._raise_worker_error()
+
+    def _resumable_events(self, raw_watcher: RawNamespaceWatch = None):
+        # Picks up from the listing, and after every reconnect from the last resourceVersion seen, so nothing is missed
+        resource_version = raw_watcher.resource_version if raw_watcher is not None else self._list_resource_version
+        list_namespace = self.kubeapi.list_namespace
+
+        @functools.wraps(list_namespace)
+        def connect(*args, **kwargs):
+            resp = list_namespace(*args, **kwargs)
+            self._watch_connected()
+            return resp
+
+        failures = 0
+        while not self._stop_watch and self._worker_error is None:
+            kwargs = { 'timeout_seconds': self.watch_timeout, 'allow_watch_bookmarks': True }
+            if resource_version is not None:
+                kwargs['resource_version'] = resource_version
+            if self.idle_timeout > 0:
+                # (connect, read): the read timeout is per read, so it only fires once the stream has gone quiet
+                kwargs['_request_timeout'] = (self.idle_timeout, self.idle_timeout)
+            if raw_watcher is not None:
+                raw_watcher.on_connect = self._watch_connected
+                self._watcher = raw_watcher
+                events = raw_watcher.stream(bookmarks=True, **kwargs)
+            else:
+                self._watcher = watch.Watch()
+                events = self._watcher.stream(connect, **kwargs)
+
+            reason = 'timeout'
+            try:
+                for ns_event in events:
+                    self.last_watch_event = time.monotonic()
+                    failures = 0
+                    resource_version = self._watcher.resource_version or resource_version
+                    # Bookmarks, and the blank lines kubernetes.watch.Watch turns into None, only prove the
+                    # connection is alive and move the resourceVersion on
+                    if ns_event is not None and ns_event['type'] != 'BOOKMARK':
+                        yield ns_event
+            except urllib3.exceptions.ReadTimeoutError:
+                reason = 'stale'
+                logging.warning(f'No namespace events or bookmarks for {self.idle_timeout}s, reconnecting the watch')
+            except urllib3.exceptions.HTTPError:
+                reason = 'error'
+                failures += 1
+                logging.warning('Namespace watch connection failed, reconnecting', exc_info=True)
+
+            self._disconnected_at = time.monotonic()
+            if self._stop_watch or self._worker_error is not None:
+                return
+            self.watch_reconnects[reason] += 1
+            if failures > 1:
+                # Straight back after the first failure, backing off if the API server stays unreachable
+                time.sleep(min(30, 2 ** (failures - 2)))
+
+    def _watch_connected(self):
+        now = time.monotonic()
+        self.last_watch_event = now
+        if self._disconnected_at is not None:
+            self.last_reconnect_seconds = now - self._disconnected_at
+            self.max_reconnect_seconds = max(self.max_reconnect_seconds, self.last_reconnect_seconds)
+            self._disconnected_at = None
+
+    def seconds_since_last_watch_event(self) -> float:
+        # Bookmarks and reconnects count as events, None until the watch has started
+        return time.monotonic() - self.last_watch_event if self.last_watch_event is not None else None
+
+    def _enqueue_page(self, namespaces: List[Union[V1Namespace, NamespaceRecord]]):
+        for ns in namespaces:
+            self._enqueue(ns)
+        if not self._first_page_queued:
+            # The worker starts once the whole first page is queued, so it sees that page in priority order
+            self._first_page_queued = True
+            self._start_worker()
+            self._check_ready()
+
+    def _enqueue_event(self, ns_event: Dict):
+        if ns_event['type'] == 'MODIFIED':
+            self._enqueue(ns_event['object'])
+        elif ns_event['type'] == 'DELETED':
+            self._seen_wants.pop(as_record(ns_event['object']).name, None)
+
+    def _enqueue(self, namespace: Union[V1Namespace, NamespaceRecord]):
+        record = as_record(namespace)
+        priority = self._priority(record)
+        if priority is not None:
+            self._queue_or_create().put(record.name, namespace, priority)
+
+    def _priority(self, record: NamespaceRecord) -> int:
+        # None for namespaces we don't manage, HIGH for ones without a project yet or whose wishes changed, LOW otherwise
+        annotations = record.annotations
+        if self.project_name_annotation not in annotations:
+            self._seen_wants.pop(record.name, None)
+            return None
+
+        wants = tuple(annotations.get(key) for key in [ self.project_name_annotation, self.cluster_name_annotation,
+                                                         *self.role_annotations ])
+        previous = self._seen_wants.get(record.name)
+        self._seen_wants[record.name] = wants
+        if self.project_id_annotation not in annotations or (previous is not None and previous != wants):
+            return HIGH
+        return LOW
+
+    def _queue_or_create(self) -> WorkQueue:
+        if self._queue is None:
+            limiter = RateLimiter(self.verify_qps, max(1, int(self.verify_qps))) if self.verify_qps > 0 else None
+            self._queue = WorkQueue(limiter)
+        return self._queue
+
+    def _start_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        self._queue_or_create()
+        self._worker = threading.Thread(target=self._work, name='namespace-worker', daemon=True)
+        self._worker.start()
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            name, namespace, priority = task
+            try:
+                self.process_namespace(namespace)
+            except (requests.HTTPError, RancherResponseError, ApiException, ValueError, KeyError):
+                logging.exception(f'ERROR processing namespace {name}', extra={ 'namespace': name })
+            except Exception as e:
+                # Ends the watch, so watch() raises it just as it would have without the queue
+                logging.exception(f'FATAL ERROR processing namespace {name}', extra={ 'namespace': name })
+                self._worker_error = e
+                if self._watcher is not None:
+                    self._watcher.stop()
+                return
+            finally:
+                self._queue.done(priority)
+                self._check_ready()
+
+    def _raise_worker_error(self):
+        if self._worker_error is not None:
+            raise self._worker_error
+
+    def _check_ready(self):
+        # With the priority queue, ready means the first page is queued and none of the urgent namespaces are left
+        if self._first_page_queued and not self.ready.is_set() and self._queue.pending(HIGH) == 0:
+            logging.info('First page of namespaces queued and its unassigned namespaces processed, reporting ready')
+            self.ready.set()
+
+    def _log_event_error(self, severity: str, ns_event: Dict):
+        try:
+            name = as_record(ns_event['object']).name
+        except Exception:
+            name = None
+        logging.exception("%s processing %s event for namespace %s", severity, ns_event.get('type'), name,
+                            extra={ 'namespace': name, 'event_type': ns_event.get('type') })
+        if payload_log.isEnabledFor(logging.DEBUG):
+            payload_log.debug("Raw namespace event: %s", Payload(ns_event))
+
+    def annotation_keys(self) -> List[str]:
+        return [ self.project_name_annotation, self.project_id_annotation, self.cluster_name_annotation,
+                 *self.role_annotations ]
+
+    def _raw_watcher(self) -> RawNamespaceWatch:
+        if self.namespace_source is not None:
+            return self.namespace_source
+        return RawNamespaceWatch(self.kubeapi, self.annotation_keys()) if self.lean_watch else None
+
+    def _namespace_pages(self, raw_watcher: RawNamespaceWatch = None):
+        _continue = None
+        while True:
+            if raw_watcher is not None:
+                items, _continue = raw_watcher.list_page(self.list_page_size, _continue)
+                yield items
+            else:
+                namespaces = self.kubeapi.list_namespace(limit=self.list_page_size, _continue=_continue)
+                yield namespaces.items
+                _continue = namespaces.metadata._continue if namespaces.metadata is not None else None
+                self._list_resource_version = namespaces.metadata.resource_version if namespaces.metadata is not None else None
+            if not _continue:
+                return
+
+    def _startup_pages(self, raw_watcher: RawNamespaceWatch = None):
+        pages = self._namespace_pages(raw_watcher)
+        if self.preprovision_workers < 1:
+            yield from pages
+            return
+
+        pages = list(pages)
+        index = self.provision_projects([ ns for page in pages for ns in page ], self.preprovision_workers)
+        # Every project the listing can ask for is now in the index, so it's looked up there rather than searched for
+        # one name at a time. Not with the priority queue, whose worker gets to the namespaces after the index is gone
+        if not self.priority_queue:
+            self._project_index = index
+        try:
+            yield from pages
+        finally:
+            self._project_index = None
+
+    def provision_projects(self, namespaces: List[Union[V1Namespace, NamespaceRecord]], max_workers: int = 8) -> Dict[Tuple[str, str], Dict]:
+        # Creates every project the namespaces ask for that doesn't exist yet, max_workers at a time, and returns every
+        # project by (cluster ID, name). Ones that fail to create are left out, to be tried again when their namespaces
+        # are processed
+        index = self._project_index
+        if index is None:
+            index = {}
+            for project in self.rancher.list_projects():
+                index.setdefault((project['clusterId'], project['name']), project)
+
+        missing = {}
+        for ns in namespaces:
+            annotations = as_record(ns).annotations
+            name = annotations.get(self.project_name_annotation)
+            if name is None or (self.shard is not None and not self.shard.owns(name)):
+                continue
+            cluster = annotations.get(self.cluster_name_annotation, self.default_cluster)
+            try:
+                key = (self.rancher.get_cluster_id(cluster), name)
+            except (requests.HTTPError, RancherResponseError, ValueError):
+                logging.exception(f'Failed to look up cluster {cluster} of project {name} ahead of its namespaces')
+                continue
+            if key not in index:
+                missing.setdefault(key, (name, cluster))
+
+        if missing:
+            logging.info(f'Creating {len(missing)} missing projects before processing namespaces')
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                created = list(pool.map(self._try_create_project, missing.values()))
+            index.update((key, project) for key, project in zip(missing, created) if project is not None)
+
+        if self.cache is not None:
+            self.cache.put_many(PROJECTS, [ (project_key(*key), project) for key, project in index.items() ])
+        return index
+
+    def _try_create_project(self, project: Tuple[str, str]) -> Dict:
+        name, cluster = project
+        try:
+            return self._create_project(name, cluster)
+        except (requests.HTTPError, RancherResponseError, ValueError):
+            logging.exception(f'Failed to create project {name} ahead of its namespaces')
+            return None
+
+    def find_or_create_project(self, name: str, cluster: str, create: bool = True) -> Dict:
+        # For callers outside the namespace watch, such as the admission webhook
+        project = self._find_project(name, cluster)
+        if project is None and create:
+            logging.info(f'Project {name} didn\'t exist, creating now')
+            project = self._create_project(name, cluster)
+        return project
+
+    @contextmanager
+    def _project_lock(self, key: Tuple[str, str]):
+        # One thread at a time per project. Reentrant, and forgotten once no thread holds or waits for it
+        with self._project_locks_lock:
+            entry = self._project_locks.setdefault(key, [ threading.RLock(), 0 ])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._project_locks_lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._project_locks[key]
+
+    def _create_project(self, name: str, cluster: str) -> Dict:
+        cluster_id = self.rancher.get_cluster_id(cluster)
+        with self._project_lock((cluster_id, name)):
+            # Always looked up again under the lock: another thread may have created it since the caller looked,
+            # whether it's still creating it or long done
+            project = self._find_project(name, cluster)
+            if project is None:
+                project = self.rancher.create_project(name, cluster)
+                self._count_change('projects_created')
+                self._remember_project(cluster_id, name, project)
+            return project
 
-    def process_namespace(self, namespace: V1Namespace):
-        logging.info(f'Inspecting namespace {namespace.metadata.name}...')
+    def reconcile_all(self, max_workers: int = 16) -> ReconcileReport:
+        report = ReconcileReport()
+        calls_before = Counter(self.rancher.call_counts)
+        changes_before = Counter(self.changes)
+        patch_errors = self.patcher.stats['namespace_patch_errors_total'] if self.patcher is not None else 0
+
+        with report.phase('list_namespaces'):
+            raw_watcher = self._raw_watcher()
+            namespaces = [ ns for page in self._namespace_pages(raw_watcher) for ns in page ]
+        report.namespaces = len(namespaces)
+
+        # Namespaces sharing a project are handled by one worker, so they never race to create it or edit its members
+        by_project = defaultdict(list)
+        for ns in namespaces:
+            by_project[as_record(ns).annotations.get(self.project_name_annotation)].append(ns)
+        unmanaged = by_project.pop(None, [])
+
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                with report.phase('prefetch'):
+                    self._prefetch([ as_record(ns) for group in by_project.values() for ns in group ], pool)
+                with report.phase('reconcile'):
+                    results = list(pool.map(self._reconcile_group, list(by_project.values()) + [ unmanaged ]))
+            report.errors = sum(results)
+            if self.patcher is not None:
+                # The process exits after the report, so the last patches have to have gone out by then
+                with report.phase('patch_namespaces'):
+                    self.patcher.join()
+                report.errors += self.patcher.stats['namespace_patch_errors_total'] - patch_errors
+        finally:
+            self._project_index = None
+            self._principal_cache = None
+            self._binding_index = None
+
+        report.finish(Counter(self.rancher.call_counts) - calls_before, Counter(self.changes) - changes_before)
+        return report
+
+    def _prefetch(self, namespaces: List[NamespaceRecord], pool: ThreadPoolExecutor):
+        # One paginated listing replaces a name search per project
+        index = {}
+        for project in self.rancher.list_projects():
+            index.setdefault((project['clusterId'], project['name']), project)
+        self._project_index = index
+
+        # As does one listing of every role binding, for a binding listing per project
+        bindings = defaultdict(list)
+        for binding in self.rancher.list_project_role_bindings():
+            bindings[binding.get('projectId')].append(binding)
+        self._binding_index = bindings
+
+        names = set()
+        for ns in namespaces:
+            for annotation in self.role_annotations:
+                if annotation in ns.annotations:
+                    names.update(ns.annotations[annotation].split(','))
+        names = sorted(names)
+
+        cache = {}
+        for name, principal in zip(names, pool.map(self._try_search_principal, names)):
+            if principal is not False:
+                cache[name] = principal
+        self._principal_cache = cache
+
+        if self.cache is not None:
+            self.cache.put_many(PROJECTS, [ (project_key(*key), project) for key, project in index.items() ])
+            self.cache.put_many(PRINCIPALS, [ (name, principal.to_dict()) for name, principal in cache.items() if principal is not None ])
+
+    def _try_search_principal(self, name: str):
+        try:
+            return self.rancher.search_principal(name)
+        except (requests.HTTPError, RancherResponseError):
+            # Left out of the cache, so it gets looked up (and its error reported) while reconciling
+            logging.exception(f'Failed to prefetch principal {name}')
+            return False
+
+    def _reconcile_group(self, namespaces: List[V1Namespace]) -> int:
+        errors = 0
+        for ns in namespaces:
+            try:
+                self.process_namespace(ns)
+            except (requests.HTTPError, RancherResponseError, ApiException, ValueError, KeyError):
+                logging.exception(f'ERROR processing namespace {as_record(ns).name}')
+                errors += 1
+        return errors
+
+    def _count_change(self, kind: str, amount: int = 1):
+        with self._changes_lock:
+            self.changes[kind] += amount
+
+    def _find_project(self, name: str, cluster: str, project_id: str = None) -> Dict:
+        # Everything is scoped to the namespace's cluster, every cluster can have a project by the same name
+        cluster_id = self.rancher.get_cluster_id(cluster)
+        if self._project_index is not None:
+            return self._project_index.get((cluster_id, name))
+        if self.cache is not None:
+            hit, project = self.cache.get(PROJECTS, project_key(cluster_id, name))
+            # A namespace carrying another ID may be pointing at the project recreated since it was cached, so that's
+            # looked up below and replaces the entry
+            if hit and (not project_id or project.get('id') == project_id):
+                return project
+
+        # The ID a namespace already carries is checked directly, searching by name only if it's gone or someone else's
+        if project_id:
+            project = self.rancher.get_project_by_id(project_id)
+            if project is not None and project.get('name') == name and project.get('clusterId') == cluster_id:
+                self._remember_project(cluster_id, name, project)
+                return project
+
+        project = self.rancher.get_project(name, cluster_id)
+        if project is not None:
+            self._remember_project(cluster_id, name, project)
+        return project
+
+    def _remember_project(self, cluster_id: str, name: str, project: Dict):
+        if self._project_index is not None:
+            self._project_index[(cluster_id, name)] = project
+        if self.cache is not None:
+            self.cache.put(PROJECTS, project_key(cluster_id, name), project)
+
+    def _forget_project(self, project_id: str):
+        # The project was deleted or taken away, so its next lookup goes back to Rancher rather than the cache
+        with self._desired_lock:
+            recorded = self.project_namespaces.get(project_id)
+        if recorded is not None and self.cache is not None:
+            project_name, _, cluster_id = recorded
+            self.cache.invalidate(PROJECTS, project_key(cluster_id, project_name))
+
+    def _resolve_principal(self, name: str) -> RancherPrincipal:
+        if self._principal_cache is not None and name in self._principal_cache:
+            return self._principal_cache[name]
+        if self.cache is not None:
+            hit, principal = self.cache.get(PRINCIPALS, name)
+            if hit:
+                return RancherPrincipal(principal)
+
+        principal = self.rancher.search_principal(name)
+        # Misses aren't cached, a user or group that doesn't exist yet may well exist next time
+        if principal is not None and self.cache is not None:
+            self.cache.put(PRINCIPALS, name, principal.to_dict())
+        return principal
+
+    def _get_bindings(self, project_id: str, live: bool = False) -> Tuple[List[Dict], bool]:
+        # The project's bindings, and whether they came out of the warm cache. live skips the sweep's listing and the cache
+        if not live and self._binding_index is not None:
+            return self._binding_index.get(project_id, []), False
+        if not live and self.cache is not None:
+            hit, bindings = self.cache.get(BINDINGS, project_id)
+            if hit:
+                return bindings, True
+
+        bindings = self.rancher.get_project_bindings(project_id)
+        self._remember_bindings(project_id, bindings)
+        return bindings, False
+
+    def _remember_bindings(self, project_id: str, bindings: List[Dict]):
+        if self._binding_index is not None:
+            self._binding_index[project_id] = bindings
+        if self.cache is not None:
+            self.cache.put(BINDINGS, project_id, bindings)
+
+    def _record_desired(self, project_id: str, rolename: str, members: List[RancherPrincipal]):
+        # None when some members couldn't be looked up, what the role should hold isn't known so it isn't checked for drift
+        fingerprint = membership_fingerprint(member.id for member in members) if members is not None else None
+        with self._desired_lock:
+            self.desired_members.setdefault(project_id, {})[rolename] = fingerprint
+
+    def desired_snapshot(self) -> Dict[str, Dict[str, str]]:
+        with self._desired_lock:
+            return { project_id: dict(roles) for project_id, roles in self.desired_members.items()
+                     if project_id in self.project_namespaces and
+                        (self.shard is None or self.shard.owns(self.project_namespaces[project_id][0])) }
+
+    def recheck_project(self, project_id: str):
+        # Reconciles the namespace behind a project again, from Rancher rather than the warm cache
+        with self._desired_lock:
+            project_name, namespace, cluster_id = self.project_namespaces[project_id]
+            roles = self.desired_members.pop(project_id, {})
+        if self.cache is not None:
+            self.cache.invalidate(BINDINGS, project_id)
+
+        try:
+            # Read under the project's lock, so an older copy of the namespace can't undo what the watch just did
+            with self._project_lock((cluster_id, project_name)):
+                self.process_namespace(self.kubeapi.read_namespace(namespace))
+        except ApiException as e:
+            if e.status == 404:
+                logging.info(f'Namespace {namespace} for project {project_name} is gone, no longer checking it for drift')
+                with self._desired_lock:
+                    self.project_namespaces.pop(project_id, None)
+                return
+            self._restore_desired(project_id, roles)
+            raise
+        except Exception:
+            self._restore_desired(project_id, roles)
+            raise
+
+    def _restore_desired(self, project_id: str, roles: Dict[str, str]):
+        # Keeps a failed repair on the books, so the next pass tries it again
+        with self._desired_lock:
+            self.desired_members.setdefault(project_id, roles)
+
+    def request_resync(self, *args):
+        # Ending the current watch makes the caller's watch loop relist and re-check every namespace
+        logging.info('Resync requested, restarting namespace watch')
+        self._stop_watch = True
+        if self._watcher is not None:
+            self._watcher.stop()
+
+    def process_namespace(self, namespace: Union[V1Namespace, NamespaceRecord]):
+        record = as_record(namespace)
+        logging.info(f'Inspecting namespace {record.name}...', extra={ 'namespace': record.name })
 
         # We don't care if we don't see our annotation
-        annotations = namespace.metadata.annotations
+        annotations = record.annotations
         if self.project_name_annotation not in annotations:
             return
 
         # Retrive the existing rancher project
         project_name = annotations[self.project_name_annotation]
-        project = self.rancher.get_project(project_name)
+        if self.shard is not None and not self.shard.owns(project_name):
+            logging.debug('Project %s for namespace %s belongs to another shard', project_name, record.name)
+            return
 
-        # Create the rancher project if necessary
-        if project is None:
-            logging.info(f'Namespace {namespace.metadata.name} requested project named {project_name} which didn\'t exist, creating now')
+        # Check if there's a special cluster we're supposed to use
+        cluster = self.default_cluster
+        if self.cluster_name_annotation in annotations:
+            cluster = annotations[self.cluster_name_annotation]
 
-            # Check if there's a special cluster we're supposed to use
-            cluster = self.default_cluster
-            if self.cluster_name_annotation in annotations:
-                cluster = annotations[self.cluster_name_annotation]
+        # One thread at a time per project, so the watch and a drift recheck never edit the same project's members at once
+        cluster_id = self.rancher.get_cluster_id(cluster)
+        with self._project_lock((cluster_id, project_name)):
+            self._assign_namespace(namespace, record, project_name, cluster, cluster_id)
 
-            project = self.rancher.create_project(project_name, cluster)
+    def _assign_namespace(self, namespace: Union[V1Namespace, NamespaceRecord], record: NamespaceRecord, project_name: str,
+                            cluster: str, cluster_id: str):
+        annotations = record.annotations
+        project = self._find_project(project_name, cluster, annotations.get(self.project_id_annotation))
 
-        project_id = project['id']
+        # Create the rancher project if necessary
+        if project is None:
+            logging.info(f'Namespace {record.name} requested project named {project_name} which didn\'t exist, creating now')
+            project = self._create_project(project_name, cluster)
 
-        # Add/remove project owner(s)
-        if self.owners_annotation in annotations:
-            self.handle_project_role(namespace.metadata.name, project_id, 'project-owner', annotations[self.owners_annotation].split(','))
+        project_id = project['id']
+        with self._desired_lock:
+            self.project_namespaces[project_id] = (project_name, record.name, cluster_id)
 
-        # Add/remove workload managers(s)
-        if self.workload_managers_annotation in annotations:
-            self.handle_project_role(namespace.metadata.name, project_id, 'workloads-manage', annotations[self.workload_managers_annotation].split(','))
+        # Add/remove project owner(s), workload managers(s) and whatever other roles are mapped
+        roles = {}
+        for annotation, rolename in self.role_annotations.items():
+            if annotation in annotations:
+                roles.setdefault(rolename, []).extend(annotations[annotation].split(','))
+        if roles:
+            self.handle_project_roles(record.name, project_id, roles)
         
         # We don't need to do anything else if it's already annotated correctly
         if self.project_id_annotation in annotations and annotations[self.project_id_annotation] == project_id:
             return
 
         # Patch the project ID on there
-        logging.info(f'Annotating namespace {namespace.metadata.name} for requested project named {project_name} with its ID {project_id}')
+        logging.info(f'Annotating namespace {record.name} for requested project named {project_name} with its ID {project_id}',
+                        extra={ 'namespace': record.name, 'project_id': project_id })
         annotations[self.project_id_annotation] = project_id
-        self.kubeapi.patch_namespace(namespace.metadata.name, namespace)
+        if isinstance(namespace, NamespaceRecord):
+            # A record only holds our own annotations, so patch in just the one we changed
+            body = { 'metadata': { 'annotations': { self.project_id_annotation: project_id } } }
+        else:
+            body = namespace
+        if self.patcher is not None:
+            # Counted by the patcher once it's gone through
+            self.patcher.patch(record.name, body)
+        else:
+            self.kubeapi.patch_namespace(record.name, body)
+            self._count_change('namespaces_annotated')
+
+    def _namespace_patched(self, name: str):
+        self._count_change('namespaces_annotated')
     
     def handle_project_role(self, namespace: str, project_id: str, rolename: str, members: List[str]):
-        resolved_members = []
-        for member in members:
-            resolved_member = self.rancher.search_principal(member)
-            if resolved_member is None:
-                logging.warning(f'Could not find a user or group in Rancher matching \"{member}\" for namespace {namespace}')
-                continue
-            resolved_members.append(resolved_member)
-        existing_members = self.rancher.get_project_members(project_id, rolename)
-        
-        new_members = set(resolved_members).difference(existing_members)
-        old_members = set(existing_members).difference(resolved_members)
+        self.handle_project_roles(namespace, project_id, { rolename: members })
+
+    def handle_project_roles(self, namespace: str, project_id: str, roles: Dict[str, List[str]]):
+        # One listing of the project's bindings serves every role, which are then diffed by principal ID
+        failures = {}
+        resolved = {}
+        names = list(dict.fromkeys(name for members in roles.values() for name in members))
+        for name, principal, error in self._fan_out(self._resolve_principal, names):
+            if error is not None:
+                failures[name] = error
+            elif principal is None:
+                logging.warning(f'Could not find a user or group in Rancher matching \"{name}\" for namespace {namespace}')
+            else:
+                resolved[name] = principal
+
+        bindings, cached = self._get_bindings(project_id)
+        changes = self._diff_roles(project_id, roles, resolved, failures, bindings)
+        if changes and cached:
+            # A cached snapshot only gets to say nothing needs doing. Bindings may have been added or removed in Rancher
+            # since, so whatever gets written is diffed against Rancher itself
+            bindings, _ = self._get_bindings(project_id, live=True)
+            changes = self._diff_roles(project_id, roles, resolved, failures, bindings)
+        if not changes and not failures:
+            return
+
+        # Forget the snapshot until every change has gone through, a partial failure leaves it unknown
+        if self.cache is not None:
+            self.cache.invalidate(BINDINGS, project_id)
+
+        added = []
+        removed = set()
+        results = self._fan_out(lambda change: change[0](namespace, project_id, change[1], change[2]), changes)
+        for (change, rolename, target), result, error in results:
+            if error is not None:
+                member = str(target) if change == self._add_binding else binding_principal_id(target)
+                failures[f'{rolename} {member}'] = error
+                if is_gone(error):
+                    self._forget_project(project_id)
+            elif change == self._add_binding:
+                added.append(result)
+            else:
+                removed.add(target['id'])
+
+        if failures:
+            for member, error in failures.items():
+                logging.error(f'Failed to update {member} for project {project_id} over namespace {namespace}: {error}',
+                                extra={ 'namespace': namespace, 'project_id': project_id, 'principal': member })
+            raise RoleMemberErrors(namespace, project_id, failures)
+
+        self._remember_bindings(project_id, [ binding for binding in bindings if binding['id'] not in removed ] + added)
+
+    def _diff_roles(self, project_id: str, roles: Dict[str, List[str]], resolved: Dict[str, RancherPrincipal],
+                    failures: Dict[str, Exception], bindings: List[Dict]) -> List[Tuple[Callable, str, Any]]:
+        existing = defaultdict(dict)
+        for binding in bindings:
+            principal_id = binding_principal_id(binding)
+            if principal_id is not None:
+                existing[binding.get('roleTemplateId')][principal_id] = binding
+
+        changes = []
+        for rolename, members in roles.items():
+            wanted = { resolved[name].id: resolved[name] for name in members if name in resolved }
+            lookups_failed = any(name in failures for name in members)
+            self._record_desired(project_id, rolename, None if lookups_failed else wanted.values())
+            current = existing.get(rolename, {})
+            changes.extend((self._add_binding, rolename, member) for member_id, member in wanted.items() if member_id not in current)
+            # An existing member we failed to look up may well be one of the members we want, so leave them all be
+            if not lookups_failed:
+                changes.extend((self._remove_binding, rolename, binding) for member_id, binding in current.items() if member_id not in wanted)
+        return changes
+
+    def _add_binding(self, namespace: str, project_id: str, rolename: str, member: RancherPrincipal) -> Dict:
+        binding = self.rancher.create_project_binding(project_id, rolename, member)
+        self._count_change('members_added')
+        logging.info(f'Added {member.type} {member.name} as an {rolename} for project {project_id} over namespace {namespace}',
+                        extra={ 'namespace': namespace, 'project_id': project_id, 'role': rolename, 'principal': member.id })
+        return binding
+
+    def _remove_binding(self, namespace: str, project_id: str, rolename: str, binding: Dict):
+        self.rancher.delete_project_binding(binding['id'])
+        self._count_change('members_removed')
+        principal_id = binding_principal_id(binding)
+        logging.info(f'Removed {principal_id} as an {rolename} for project {project_id} over namespace {namespace}',
+                        extra={ 'namespace': namespace, 'project_id': project_id, 'role': rolename, 'principal': principal_id })
+
+    def _fan_out(self, fn: Callable[[Any], Any], items: List[Any]) -> List[Tuple[Any, Any, Exception]]:
+        # Runs fn over items, up to role_workers at once, and hands back each item's result or error instead of
+        # stopping at the first failure. Requests are counted as the calling thread's, e.g. a drift resync's
+        counter = self.rancher.request_counter()
+        def attempt(item):
+            with self.rancher.count_requests(counter):
+                try:
+                    return item, fn(item), None
+                except (requests.HTTPError, requests.ConnectionError, RancherResponseError, ValueError, KeyError) as e:
+                    return item, None, e
 
-        for member in new_members:
-            resp = self.rancher.add_project_member(project_id, rolename, member)
-            logging.info(f'Added {member.type} {member.name} as an {rolename} for project {project_id} over namespace {namespace}')
+        if self.role_workers <= 1 or len(items) <= 1:
+            return [ attempt(item) for item in items ]
+        with self._role_pool_lock:
+            if self._role_pool is None:
+                self._role_pool = ThreadPoolExecutor(max_workers=self.role_workers, thread_name_prefix='role-worker')
+        return list(self._role_pool.map(attempt, items))
 
-        for member in old_members:
-            resp = self.rancher.remove_project_member(project_id, rolename, member)
-            logging.info(f'Removed {member.type} {member.name} as an {rolename} for project {project_id} over namespace {namespace}')
\ No newline at end of file
+class RoleMemberErrors(RancherResponseError):
+    # Raised once every member has been tried, if any of them couldn't be looked up, added or removed
+    def __init__(self, namespace: str, project_id: str, failures: Dict[str, Exception]):
+        self.failures = failures
+        details = '; '.join(f'{member}: {error}' for member, error in failures.items())
+        Exception.__init__(self, f"Failed to update {len(failures)} member(s) of project {project_id} for namespace {namespace}: {details}")
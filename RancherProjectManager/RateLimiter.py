@@ -0,0 +1,35 @@
+import threading
+import time
+
+class RateLimiter:
+    def __init__(self, qps: float, burst: int = 1):
+        if qps <= 0 or burst < 1:
+            raise ValueError("qps must be positive and burst must be at least 1")
+        self.qps = qps
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        # Reserve a token (possibly going into debt) under the lock, then sleep off the debt outside it
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.qps)
+            self._last = now
+            self._tokens -= 1
+            wait = -self._tokens / self.qps if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def try_acquire(self) -> float:
+        # Takes a token only if one is free right now, otherwise takes nothing and says how long until one is
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.qps)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.qps
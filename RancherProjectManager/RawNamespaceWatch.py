@@ -0,0 +1,70 @@
+from kubernetes import client
+from kubernetes.client.exceptions import ApiException
+from kubernetes.watch.watch import iter_resp_lines
+from typing import Dict, Iterable, Iterator, List, Tuple
+import json
+from .NamespaceRecord import NamespaceRecord
+
+class RawNamespaceWatch:
+    # Lists and watches namespaces as plain JSON, skipping the kubernetes client's model deserialization
+    def __init__(self, kubeapi: client.CoreV1Api, annotation_keys: Iterable[str] = None):
+        self.kubeapi = kubeapi
+        self.annotation_keys = list(annotation_keys) if annotation_keys is not None else None
+        self.resource_version = None
+        # Called each time a watch request has been answered, before any events arrive
+        self.on_connect = None
+        self._stop = False
+        self._resp = None
+
+    def list_page(self, limit: int, _continue: str = None) -> Tuple[List[NamespaceRecord], str]:
+        resp = self.kubeapi.list_namespace(limit=limit, _continue=_continue, _preload_content=False)
+        try:
+            data = json.loads(resp.data)
+        finally:
+            resp.release_conn()
+        metadata = data.get('metadata') or {}
+        self.resource_version = metadata.get('resourceVersion')
+        return [ NamespaceRecord.from_dict(item, self.annotation_keys) for item in data.get('items') or [] ], metadata.get('continue')
+
+    def stream(self, bookmarks: bool = False, **kwargs) -> Iterator[Dict]:
+        # Like kubernetes.watch.Watch, reconnects from the last seen resourceVersion until stopped, or returns when the
+        # server ends the watch if given timeout_seconds. Other kwargs go to list_namespace as they are
+        self._stop = False
+        kwargs.update({ 'watch': True, '_preload_content': False, 'allow_watch_bookmarks': True })
+        while not self._stop:
+            if self.resource_version is not None:
+                kwargs['resource_version'] = self.resource_version
+            self._resp = self.kubeapi.list_namespace(**kwargs)
+            if self.on_connect is not None:
+                self.on_connect()
+            try:
+                for line in iter_resp_lines(self._resp):
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    if event['type'] == 'ERROR':
+                        status = event['object']
+                        raise ApiException(status=status.get('code'), reason=f"{status.get('reason')}: {status.get('message')}")
+
+                    if event['type'] == 'BOOKMARK':
+                        # Bookmarks only carry a resourceVersion, there's no namespace in them
+                        self.resource_version = event['object']['metadata']['resourceVersion']
+                        if bookmarks:
+                            yield { 'type': 'BOOKMARK', 'object': None }
+                        continue
+
+                    record = NamespaceRecord.from_dict(event['object'], self.annotation_keys)
+                    if record.resource_version is not None:
+                        self.resource_version = record.resource_version
+                    yield { 'type': event['type'], 'object': record }
+                    if self._stop:
+                        break
+            finally:
+                self._resp.close()
+                self._resp.release_conn()
+                self._resp = None
+            if 'timeout_seconds' in kwargs:
+                return
+
+    def stop(self):
+        self._stop = True
@@ -0,0 +1,49 @@
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict
+import time
+
+class ReconcileReport:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.wall_time = None
+        self.phases = {}
+        self.namespaces = 0
+        self.errors = 0
+        self.rancher_calls = Counter()
+        self.changes = Counter()
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - start
+
+    def finish(self, rancher_calls: Dict[str, int], changes: Dict[str, int]):
+        self.wall_time = time.perf_counter() - self.started
+        self.rancher_calls = Counter({ k: v for k, v in rancher_calls.items() if v })
+        self.changes = Counter({ k: v for k, v in changes.items() if v })
+
+    def to_dict(self) -> Dict:
+        return {
+            'wall_time_seconds': round(self.wall_time, 3) if self.wall_time is not None else None,
+            'phase_seconds': { name: round(seconds, 3) for name, seconds in self.phases.items() },
+            'namespaces': self.namespaces,
+            'errors': self.errors,
+            'rancher_calls': dict(self.rancher_calls),
+            'rancher_calls_total': sum(self.rancher_calls.values()),
+            'changes': dict(self.changes),
+            'changes_total': sum(self.changes.values())
+        }
+
+    def __str__(self):
+        lines = [ f'Reconciled {self.namespaces} namespaces in {self.wall_time:.3f}s with {self.errors} errors' ]
+        for name, seconds in self.phases.items():
+            lines.append(f'  phase {name}: {seconds:.3f}s')
+        lines.append(f'  rancher calls: {sum(self.rancher_calls.values())} ' +
+                        ' '.join(f'{k}={v}' for k, v in sorted(self.rancher_calls.items())))
+        lines.append(f'  changes: {sum(self.changes.values())} ' +
+                        ' '.join(f'{k}={v}' for k, v in sorted(self.changes.items())))
+        return '\n'.join(lines)
@@ -0,0 +1,72 @@
+from collections import OrderedDict
+from typing import Dict, Mapping
+import threading
+
+class ResponseCache:
+    # Remembers the body and validators (ETag, Last-Modified) of Rancher GET responses, least recently used first
+    # out once max_bytes of bodies are held, so a repeat GET can be sent conditionally and answered with a 304
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024):
+        if max_bytes <= 0:
+            raise ValueError("max_bytes must be positive")
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def request_headers(self, url: str) -> Dict[str, str]:
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return {}
+            validators, _ = entry
+        headers = {}
+        if 'etag' in validators:
+            headers['If-None-Match'] = validators['etag']
+        if 'last_modified' in validators:
+            headers['If-Modified-Since'] = validators['last_modified']
+        return headers
+
+    def not_modified(self, url: str) -> bytes:
+        # The cached body for a 304, or None if it's been evicted since the request went out
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return None
+            self._entries.move_to_end(url)
+            self.hits += 1
+            self.bytes_saved += len(entry[1])
+            return entry[1]
+
+    def store(self, url: str, response_headers: Mapping[str, str], body: bytes):
+        validators = {}
+        if response_headers.get('ETag'):
+            validators['etag'] = response_headers['ETag']
+        if response_headers.get('Last-Modified'):
+            validators['last_modified'] = response_headers['Last-Modified']
+
+        with self._lock:
+            self.misses += 1
+            old = self._entries.pop(url, None)
+            if old is not None:
+                self.size -= len(old[1])
+            # Without a validator there's nothing to send next time, and a body over budget would evict everything else
+            if not validators or len(body) > self.max_bytes:
+                return
+            self._entries[url] = (validators, body)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def hit_ratio(self) -> float:
+        with self._lock:
+            total = self.hits + self.misses
+            return self.hits / total if total else 0.0
+
+    def __len__(self):
+        return len(self._entries)
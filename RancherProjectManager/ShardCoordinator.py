@@ -0,0 +1,128 @@
+from bisect import bisect
+from datetime import datetime, timedelta, timezone
+from kubernetes import client
+from kubernetes.client.exceptions import ApiException
+from typing import Callable, Iterable, List
+import hashlib
+import logging
+import threading
+import time
+from .LeaderElector import lease_expired
+
+SHARD_GROUP_LABEL = 'rancher-project-mgmt.motus.com/shard-group'
+
+class HashRing:
+    def __init__(self, members: Iterable[str], vnodes: int = 64):
+        self.members = sorted(set(members))
+        self._points = []
+        for member in self.members:
+            for i in range(vnodes):
+                self._points.append((_hash(f'{member}#{i}'), member))
+        self._points.sort()
+        self._keys = [point for point, _ in self._points]
+
+    def owner(self, key: str) -> str:
+        if not self._points:
+            return None
+        i = bisect(self._keys, _hash(key)) % len(self._points)
+        return self._points[i][1]
+
+def _hash(value: str) -> int:
+    # Python's hash() is salted per process, replicas need a hash they all agree on
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+class ShardCoordinator:
+    def __init__(self, coordination_api: client.CoordinationV1Api, namespace: str, group: str, identity: str,
+                    lease_duration: int = 15, renew_interval: float = 5, on_rebalance: Callable[[List[str]], None] = None,
+                    gc_after: float = 300):
+        self.coordination_api = coordination_api
+        self.namespace = namespace
+        self.group = group
+        self.identity = identity
+        self.lease_name = f'{group}-{identity}'
+        self.lease_duration = lease_duration
+        self.renew_interval = renew_interval
+        self.on_rebalance = on_rebalance
+        # Other replicas' leases are deleted once they've been expired this many seconds, so pods that are gone for
+        # good don't leave a lease behind each
+        self.gc_after = gc_after
+        self.ring = HashRing([ identity ])
+        # time.monotonic() of the last renewal of our own lease that went through
+        self._renewed_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.heartbeat()
+        self._thread = threading.Thread(target=self._heartbeat_loop, name='shard-heartbeat', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def owns(self, key: str) -> bool:
+        # Once our lease may have run out the others have taken our keys over, so nothing is ours until it's renewed
+        return self._lease_current() and self.ring.owner(key) == self.identity
+
+    def _lease_current(self) -> bool:
+        return self._renewed_at is not None and time.monotonic() - self._renewed_at < self.lease_duration
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.renew_interval):
+            try:
+                self.heartbeat()
+            except Exception:
+                logging.exception(f'Error refreshing shard membership for {self.group}')
+
+    def heartbeat(self):
+        now = datetime.now(timezone.utc)
+        renewing_at = time.monotonic()
+        lapsed = self._renewed_at is not None and not self._lease_current()
+        self._renew_own_lease(now)
+        self._renewed_at = renewing_at
+
+        leases = self.coordination_api.list_namespaced_lease(self.namespace,
+                    label_selector=f'{SHARD_GROUP_LABEL}={self.group}').items
+        members = { lease.spec.holder_identity for lease in leases if not lease_expired(lease.spec, now) }
+        members.add(self.identity)
+        for lease in leases:
+            if lease.metadata.name != self.lease_name and lease_expired(lease.spec, now - timedelta(seconds=self.gc_after)):
+                self._delete_lease(lease)
+
+        if sorted(members) != self.ring.members or lapsed:
+            # After a lapse, whatever was skipped meanwhile needs picking up just like after a change of members
+            logging.info(f'Shard membership for {self.group} changed to {sorted(members)}, rebalancing')
+            self.ring = HashRing(members)
+            if self.on_rebalance is not None:
+                self.on_rebalance(self.ring.members)
+
+    def _delete_lease(self, lease: client.V1Lease):
+        logging.info(f'Deleting shard lease {lease.metadata.name} of departed member {lease.spec.holder_identity}')
+        # Only as it was listed, a member that came back and renewed it in the meantime keeps it
+        preconditions = client.V1Preconditions(resource_version=lease.metadata.resource_version)
+        try:
+            self.coordination_api.delete_namespaced_lease(lease.metadata.name, self.namespace,
+                                                            body=client.V1DeleteOptions(preconditions=preconditions))
+        except ApiException as e:
+            # Another member got to it first, or it was renewed
+            if e.status not in (404, 409):
+                raise
+
+    def _renew_own_lease(self, now: datetime):
+        try:
+            lease = self.coordination_api.read_namespaced_lease(self.lease_name, self.namespace)
+        except ApiException as e:
+            if e.status != 404:
+                raise
+            lease = client.V1Lease(
+                metadata=client.V1ObjectMeta(name=self.lease_name, namespace=self.namespace,
+                                                labels={ SHARD_GROUP_LABEL: self.group }),
+                spec=client.V1LeaseSpec(holder_identity=self.identity, lease_duration_seconds=self.lease_duration,
+                                        acquire_time=now, renew_time=now))
+            self.coordination_api.create_namespaced_lease(self.namespace, lease)
+            return
+
+        lease.spec.holder_identity = self.identity
+        lease.spec.renew_time = now
+        lease.spec.lease_duration_seconds = self.lease_duration
+        self.coordination_api.replace_namespaced_lease(self.lease_name, self.namespace, lease)
@@ -0,0 +1,94 @@
+from typing import Any, Dict, Iterable, Tuple
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+PROJECTS = 'project'
+PRINCIPALS = 'principal'
+BINDINGS = 'binding'
+
+class WarmCache:
+    # Bump whenever the shape of what's stored changes, so old cache files get thrown away instead of misread
+    SCHEMA_VERSION = 3
+
+    def __init__(self, path: str, scope: str, ttls: Dict[str, float] = None):
+        self.path = path
+        self.scope = scope
+        self.ttls = { PROJECTS: 3600, PRINCIPALS: 3600, BINDINGS: 300 }
+        self.ttls.update(ttls or {})
+        self.hits = 0
+        self.misses = 0
+        self._entries = { kind: {} for kind in self.ttls }
+        self._lock = threading.Lock()
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS entries (kind TEXT, key TEXT, value TEXT, stored_at REAL, PRIMARY KEY (kind, key))')
+        self._check_version()
+        self._load()
+
+    def _check_version(self):
+        meta = dict(self._db.execute('SELECT key, value FROM meta').fetchall())
+        expected = { 'schema_version': str(self.SCHEMA_VERSION), 'scope': self.scope }
+        if meta != expected:
+            if meta:
+                logging.info(f'Discarding warm cache {self.path} written for {meta}, expected {expected}')
+            with self._db:
+                self._db.execute('DELETE FROM entries')
+                self._db.execute('DELETE FROM meta')
+                self._db.executemany('INSERT INTO meta (key, value) VALUES (?, ?)', expected.items())
+
+    def _load(self):
+        now = time.time()
+        loaded = 0
+        for kind, key, value, stored_at in self._db.execute('SELECT kind, key, value, stored_at FROM entries'):
+            if kind in self._entries and now - stored_at < self.ttls[kind]:
+                self._entries[kind][key] = (json.loads(value), stored_at)
+                loaded += 1
+        with self._db:
+            for kind, ttl in self.ttls.items():
+                self._db.execute('DELETE FROM entries WHERE kind = ? AND stored_at < ?', (kind, now - ttl))
+        logging.info(f'Loaded {loaded} entries from warm cache {self.path}')
+
+    def get(self, kind: str, key: str) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._entries[kind].get(key)
+            if entry is not None and time.time() - entry[1] < self.ttls[kind]:
+                self.hits += 1
+                return True, entry[0]
+            # Expired entries are just misses, the caller revalidates against Rancher and puts the fresh value
+            self.misses += 1
+            return False, None
+
+    def put(self, kind: str, key: str, value: Any):
+        stored_at = time.time()
+        encoded = json.dumps(value)
+        with self._lock:
+            self._entries[kind][key] = (value, stored_at)
+            with self._db:
+                self._db.execute('INSERT OR REPLACE INTO entries (kind, key, value, stored_at) VALUES (?, ?, ?, ?)',
+                                    (kind, key, encoded, stored_at))
+
+    def put_many(self, kind: str, items: Iterable[Tuple[str, Any]]):
+        stored_at = time.time()
+        rows = [ (kind, key, json.dumps(value), stored_at, value) for key, value in items ]
+        with self._lock:
+            for _, key, _, _, value in rows:
+                self._entries[kind][key] = (value, stored_at)
+            with self._db:
+                self._db.executemany('INSERT OR REPLACE INTO entries (kind, key, value, stored_at) VALUES (?, ?, ?, ?)',
+                                        [ row[:4] for row in rows ])
+
+    def invalidate(self, kind: str, key: str):
+        with self._lock:
+            self._entries[kind].pop(key, None)
+            with self._db:
+                self._db.execute('DELETE FROM entries WHERE kind = ? AND key = ?', (kind, key))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,83 @@
+from typing import Any, Hashable, Tuple
+import heapq
+import itertools
+import threading
+from .RateLimiter import RateLimiter
+
+HIGH = 0
+LOW = 1
+
+class WorkQueue:
+    # A priority queue holding at most one pending item per key. Re-queueing a key replaces its item and keeps
+    # the more urgent of the two priorities. LOW items are only handed out as fast as low_priority_limiter allows,
+    # and never ahead of a HIGH one
+    def __init__(self, low_priority_limiter: RateLimiter = None):
+        self.low_priority_limiter = low_priority_limiter
+        self._heap = []
+        self._pending = {}
+        self._queued = { HIGH: 0, LOW: 0 }
+        self._active = { HIGH: 0, LOW: 0 }
+        self._seq = itertools.count()
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def put(self, key: Hashable, item: Any, priority: int = LOW):
+        with self._cond:
+            current = self._pending.get(key)
+            if current is not None and current[0] <= priority:
+                self._pending[key] = (current[0], current[1], item)
+                return
+            # Any older heap entry for the key goes stale, get() skips entries that no longer match _pending
+            if current is not None:
+                self._queued[current[0]] -= 1
+            seq = next(self._seq)
+            self._pending[key] = (priority, seq, item)
+            self._queued[priority] += 1
+            heapq.heappush(self._heap, (priority, seq, key))
+            self._cond.notify_all()
+
+    def get(self) -> Tuple[Hashable, Any, int]:
+        # Blocks until an item may be handed out, returns None once the queue is closed
+        with self._cond:
+            while not self._closed:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                priority, seq, key = self._heap[0]
+                pending = self._pending.get(key)
+                if pending is None or pending[1] != seq:
+                    heapq.heappop(self._heap)
+                    continue
+                if priority == LOW and self.low_priority_limiter is not None:
+                    wait = self.low_priority_limiter.try_acquire()
+                    if wait > 0:
+                        # Woken early by put() if something more urgent turns up meanwhile
+                        self._cond.wait(wait)
+                        continue
+                heapq.heappop(self._heap)
+                del self._pending[key]
+                self._queued[priority] -= 1
+                self._active[priority] += 1
+                return key, pending[2], priority
+            return None
+
+    def done(self, priority: int):
+        with self._cond:
+            self._active[priority] -= 1
+            self._cond.notify_all()
+
+    def pending(self, priority: int = None) -> int:
+        # Items queued or being worked on, of one priority or all of them
+        with self._cond:
+            if priority is None:
+                return sum(self._queued.values()) + sum(self._active.values())
+            return self._queued[priority] + self._active[priority]
+
+    def join(self, timeout: float = None) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not any(self._active.values()), timeout)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
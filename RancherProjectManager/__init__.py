@@ -1,3 +1,23 @@
 from .RancherApi import RancherApi, RancherResponseError
 from .RancherPrincipal import RancherPrincipal
-from .RancherProjectManagement import RancherProjectManagement
\ No newline at end of file
+from .RancherProjectManagement import RancherProjectManagement, RoleMemberErrors, load_kube_config
+from .LeaderElector import LeaderElector
+from .ShardCoordinator import ShardCoordinator, HashRing
+from .ReconcileReport import ReconcileReport
+from .RateLimiter import RateLimiter
+from .MultiClusterManager import MultiClusterManager
+from .AdminServer import AdminServer
+from .NamespaceRecord import NamespaceRecord
+from .RawNamespaceWatch import RawNamespaceWatch
+from .LogFormatting import configure_logging, JsonFormatter, Payload, SampleFilter
+from .JsonCodec import JsonCodec, OrjsonCodec, get_codec
+from .WarmCache import WarmCache
+from .Metrics import MetricsRegistry
+from .DriftResync import DriftResync, membership_fingerprint
+from .WorkQueue import WorkQueue
+from .ResponseCache import ResponseCache
+from .EventLog import EventRecorder, EventReplayer, read_events
+from .FakeRancher import FakeRancher
+from .NamespacePatcher import NamespacePatcher
+from .Profiler import Profiler
+from .AdmissionWebhook import AdmissionWebhook, AdmissionClient
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+# Compares decoding a large Rancher project listing with each JSON codec, and the memory the listing
+# holds on to with and without dropping the fields we never read.
+# Run from the repository root: python3 benchmarks/json_codec.py
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from RancherProjectManager import JsonCodec, get_codec
+from RancherProjectManager.JsonCodec import keep_fields
+from RancherProjectManager.RancherApi import PROJECT_FIELDS
+
+def make_listing(projects):
+    return json.dumps({ 'type': 'collection', 'data': [ {
+        'id': f'c-xyz12:p-{i:05d}', 'name': f'project-{i}', 'clusterId': 'c-xyz12', 'type': 'project',
+        'state': 'active', 'created': '2024-01-01T00:00:00Z', 'creatorId': 'user-abc12', 'uuid': f'0000-{i:08d}',
+        'annotations': { 'authz.management.cattle.io/creator-role-bindings': '{"required":["project-owner"]}' },
+        'labels': { 'cattle.io/creator': 'norman' },
+        'links': { rel: f'https://rancher.example.com/v3/projects/c-xyz12:p-{i:05d}/{rel}'
+                   for rel in [ 'self', 'remove', 'update', 'apps', 'secrets', 'namespacedSecrets', 'workloads', 'pods' ] },
+        'actions': { action: f'https://rancher.example.com/v3/projects/c-xyz12:p-{i:05d}?action={action}'
+                     for action in [ 'exportYaml', 'setpodsecuritypolicytemplate', 'enableMonitoring' ] } }
+        for i in range(projects) ] }).encode()
+
+def measure(codec, content, runs):
+    start = time.perf_counter()
+    for _ in range(runs):
+        codec.loads(content)
+    decode = (time.perf_counter() - start) / runs
+
+    tracemalloc.start()
+    full = codec.loads(content)['data']
+    full_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    trimmed = keep_fields(codec.loads(content)['data'], PROJECT_FIELDS)
+    trimmed_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # Both listings are kept alive until they've been measured; check trimming kept every project while they're here
+    if [ project['id'] for project in trimmed ] != [ project['id'] for project in full ]:
+        raise ValueError(f'{codec.name}: trimming fields lost projects')
+    return decode, full_bytes, trimmed_bytes
+
+def main():
+    parser = argparse.ArgumentParser(description='Rancher JSON codec benchmark')
+    parser.add_argument('-p', '--projects', type=int, default=5000, help='Projects in the listing')
+    parser.add_argument('-n', '--runs', type=int, default=10, help='Decodes per codec')
+    args = parser.parse_args()
+
+    content = make_listing(args.projects)
+    codecs = [ JsonCodec() ]
+    auto = get_codec('auto')
+    if auto.name != 'json':
+        codecs.append(auto)
+
+    print(f'{len(content) / 1e6:.1f}MB listing of {args.projects} projects')
+    print(f'{"codec":<8} {"decode ms":>10} {"held MB":>9} {"trimmed MB":>11}')
+    for codec in codecs:
+        decode, full_bytes, trimmed_bytes = measure(codec, content, args.runs)
+        print(f'{codec.name:<8} {decode * 1000:>10.1f} {full_bytes / 1e6:>9.1f} {trimmed_bytes / 1e6:>11.1f}')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+# Measures what RancherApi._get costs per call, excluding the network and JSON decoding, with the old
+# eager f-string payload logging against the current deferred logging.
+# Run from the repository root: python3 benchmarks/logging_overhead.py
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from RancherProjectManager import RancherApi, configure_logging
+
+class StubResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+class StubSession:
+    def __init__(self, data):
+        self.response = StubResponse(data)
+
+    def get(self, url, **kwargs):
+        return self.response
+
+class EagerRancherApi(RancherApi):
+    # RancherApi._get as it was, formatting the whole payload whether or not DEBUG is on
+    def _get(self, path):
+        url = self.address + path
+        logging.debug(f"Sending GET request to {url}...")
+        self._before_request('GET')
+        r = self.session.get(url, auth = (self.key, 'secret'))
+        r.raise_for_status()
+        data = r.json()
+        logging.debug(f"GET request returned payload: {data}")
+        return data
+
+def make_payload(bindings):
+    # A projectroletemplatebindings listing, links and all
+    return { 'type': 'collection', 'data': [ {
+        'id': f'p-abc12:prtb-{i}', 'type': 'projectRoleTemplateBinding', 'projectId': 'c-xyz12:p-abc12',
+        'roleTemplateId': 'project-owner', 'groupPrincipalId': f'azuread_group://{i:08d}', 'userPrincipalId': None,
+        'links': { rel: f'https://rancher.example.com/v3/projectRoleTemplateBindings/p-abc12:prtb-{i}/{rel}'
+                   for rel in [ 'self', 'remove', 'update', 'project', 'roleTemplate' ] },
+        'actions': {}, 'created': '2024-01-01T00:00:00Z', 'creatorId': 'user-abc12' } for i in range(bindings) ] }
+
+def time_calls(api, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        api._get('/projectroletemplatebindings?projectId=c-xyz12:p-abc12')
+    return (time.perf_counter() - start) / calls
+
+def main():
+    parser = argparse.ArgumentParser(description='Rancher payload logging overhead benchmark')
+    parser.add_argument('-b', '--bindings', type=int, default=500, help='Bindings in the stub response')
+    parser.add_argument('-n', '--calls', type=int, default=2000, help='Calls per measurement')
+    args = parser.parse_args()
+
+    session = StubSession(make_payload(args.bindings))
+    eager = EagerRancherApi('https://rancher.example.com/v3', 'key', 'secret', session=session)
+    lazy = RancherApi('https://rancher.example.com/v3', 'key', 'secret', session=session)
+
+    print(f'{"log level":<28} {"eager us/call":>14} {"deferred us/call":>17}')
+    for level, label in [ ('INFO', 'INFO'), ('DEBUG', 'DEBUG, 2000 char limit') ]:
+        # Output goes nowhere, so the DEBUG row only measures formatting, not I/O
+        configure_logging(level, payload_limit=2000)
+        logging.getLogger().handlers[0].stream = open(os.devnull, 'w')
+        print(f'{label:<28} {time_calls(eager, args.calls) * 1e6:>14.1f} {time_calls(lazy, args.calls) * 1e6:>17.1f}')
+
+if __name__ == "__main__":
+    main()
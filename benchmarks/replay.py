@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+# Replays a namespace event recording made with main.py --record-events through the controller, against an in-memory
+# fake Rancher, and reports how it kept up. Run from the repository root:
+#   python3 benchmarks/replay.py events.jsonl --speed 10 --rancher-latency 20
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from RancherProjectManager import EventReplayer, FakeRancher, RancherProjectManagement
+
+def main():
+    parser = argparse.ArgumentParser(description='Replays a recorded namespace event stream against a fake Rancher',
+                                        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('recording', help='JSONL file written by main.py --record-events')
+    parser.add_argument('--speed', type=float, default=1,
+            help='Multiple of the recorded pace to replay events at. 0 replays them as fast as they are processed')
+    parser.add_argument('--rancher-latency', type=float, default=0, metavar='MS',
+            help='Time each fake Rancher request takes')
+    parser.add_argument('--priority-queue', action='store_true', help='Process namespaces through the priority queue')
+    parser.add_argument('--verify-qps', type=float, default=10, help='Re-verification rate with --priority-queue')
+    parser.add_argument('--role-workers', type=int, default=8, help='Role changes made at once per project')
+    parser.add_argument('--role-map', metavar='FILE', default=None,
+            help='JSON object of extra annotation to role template ID mappings, as given to main.py')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args()
+
+    role_annotations = {}
+    if args.role_map is not None:
+        with open(args.role_map, 'r') as role_map_file:
+            role_annotations.update(json.load(role_map_file))
+
+    replayer = EventReplayer(args.recording, args.speed)
+    rancher = FakeRancher(args.rancher_latency / 1000)
+    controller = RancherProjectManagement(rancher, 'rancher-project-mgmt.motus.com/project-name', 'field.cattle.io/projectId',
+                                            'local', 'rancher-project-mgmt.motus.com/cluster-name',
+                                            'rancher-project-mgmt.motus.com/owners',
+                                            'rancher-project-mgmt.motus.com/workload-managers',
+                                            kubeapi=replayer, namespace_source=replayer, priority_queue=args.priority_queue,
+                                            verify_qps=args.verify_qps, role_workers=args.role_workers,
+                                            role_annotations=role_annotations)
+
+    start = time.perf_counter()
+    controller.watch()
+    if controller._queue is not None:
+        controller._queue.join()
+    elapsed = time.perf_counter() - start
+
+    results = {
+        'listed': len(replayer.listing),
+        'events': replayer.events_replayed,
+        'wall_seconds': round(elapsed, 3),
+        'events_per_second': round((len(replayer.listing) + replayer.events_replayed) / elapsed, 1) if elapsed else None,
+        'max_lag_seconds': round(replayer.max_lag, 3),
+        'rancher_requests': dict(rancher.call_counts),
+        'namespace_patches': len(replayer.patches),
+        'changes': dict(controller.changes),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for key, value in results.items():
+        print(f'{key:<20} {value}')
+
+if __name__ == "__main__":
+    main()
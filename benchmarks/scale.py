@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+# Runs the controller over synthetic clusters of 10k, 50k and 100k namespaces against the in-memory fake Rancher: a
+# startup sweep over every namespace, then a burst of churn events. Records peak RSS, memory held per namespace and
+# per event and per-event reconcile latency, writes them as JSON and fails if any exceed benchmarks/scale_thresholds.json.
+# Each size runs in a fresh interpreter so peak RSS is its own. Run from the repository root: python3 benchmarks/scale.py
+import argparse
+import gc
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from RancherProjectManager import EventReplayer, FakeRancher, RancherProjectManagement
+
+PROJECT_NAME = 'rancher-project-mgmt.motus.com/project-name'
+PROJECT_ID = 'field.cattle.io/projectId'
+OWNERS = 'rancher-project-mgmt.motus.com/owners'
+WORKLOAD_MANAGERS = 'rancher-project-mgmt.motus.com/workload-managers'
+
+def owners_for(rng, args):
+    return ','.join(f'group-{g}' for g in rng.sample(range(args.groups), args.owners_per_namespace))
+
+def generate(path, args):
+    # Most namespaces already belong to a project whose owners are in place, as after a restart. The churn events
+    # change owners, add namespaces and delete them, roughly in the proportions seen during a rebuild
+    rng = random.Random(args.seed)
+    project_owners = {}
+    with open(path, 'w') as recording:
+        for i in range(args.size):
+            project = f'project-{i % args.projects}'
+            annotations = { PROJECT_NAME: project, OWNERS: project_owners.setdefault(project, owners_for(rng, args)) }
+            if rng.random() >= args.unassigned:
+                annotations[PROJECT_ID] = f'local:p-{i % args.projects}'
+            recording.write(json.dumps({ 't': 0, 'e': 'LIST', 'n': f'namespace-{i}', 'a': annotations, 'v': str(i) }) + '\n')
+        initial_owners = dict(project_owners)
+        for j in range(args.churn_events):
+            i = rng.randrange(args.size)
+            project = f'project-{i % args.projects}'
+            roll = rng.random()
+            name = f'namespace-{i}'
+            if roll < 0.1:
+                event_type, name = 'MODIFIED', f'namespace-new-{j}'
+                annotations = { PROJECT_NAME: project, OWNERS: project_owners[project] }
+            elif roll < 0.2:
+                event_type, annotations = 'DELETED', { PROJECT_NAME: project }
+            else:
+                project_owners[project] = owners_for(rng, args)
+                event_type = 'MODIFIED'
+                annotations = { PROJECT_NAME: project, PROJECT_ID: f'local:p-{i % args.projects}', OWNERS: project_owners[project] }
+            recording.write(json.dumps({ 't': 0, 'e': event_type, 'n': name, 'a': annotations, 'v': str(args.size + j) }) + '\n')
+
+    return initial_owners
+
+def seed_rancher(initial_owners):
+    # Rancher as it would be had the controller already run once over the starting state
+    rancher = FakeRancher()
+    for project, owners in initial_owners.items():
+        p = project.split('-')[-1]
+        rancher.projects[f'local:p-{p}'] = { 'id': f'local:p-{p}', 'name': project, 'clusterId': 'local' }
+        for n, group in enumerate(owners.split(',')):
+            binding_id = f'p-{p}:prtb-{n}'
+            rancher.add_binding({ 'id': binding_id, 'projectId': f'local:p-{p}', 'roleTemplateId': 'project-owner',
+                                             'groupPrincipalId': None, 'userPrincipalId': f'local://{group}' })
+    return rancher
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_size(args):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'events.jsonl')
+        rancher = seed_rancher(generate(path, args))
+        replayer = EventReplayer(path, speed=0)
+    listing, events = replayer.listing, replayer.events
+
+    controller = RancherProjectManagement(rancher, PROJECT_NAME, PROJECT_ID, 'local', 'rancher-project-mgmt.motus.com/cluster-name',
+                                            OWNERS, WORKLOAD_MANAGERS, kubeapi=replayer, namespace_source=replayer,
+                                            role_workers=args.role_workers)
+    results = { 'namespaces': args.size, 'projects': args.projects, 'groups': args.groups }
+
+    # Startup sweep: everything listed, nothing to watch
+    replayer.events = []
+    gc.collect()
+    rss_before = peak_rss_mb()
+    blocks_before = sys.getallocatedblocks()
+    start = time.perf_counter()
+    controller.watch()
+    sweep = time.perf_counter() - start
+    gc.collect()
+    results['sweep_seconds'] = round(sweep, 3)
+    results['sweep_namespaces_per_second'] = round(len(listing) / sweep, 1)
+    results['sweep_blocks_retained_per_namespace'] = round((sys.getallocatedblocks() - blocks_before) / len(listing), 2)
+    results['sweep_rss_growth_mb'] = round(peak_rss_mb() - rss_before, 1)
+
+    # Steady-state churn: only the events, timed one by one, with allocations traced
+    replayer.listing, replayer.events = [], events
+    timings = []
+    process_namespace = controller.process_namespace
+
+    def timed(namespace):
+        start = time.perf_counter()
+        try:
+            process_namespace(namespace)
+        finally:
+            timings.append(time.perf_counter() - start)
+    controller.process_namespace = timed
+
+    gc.collect()
+    tracemalloc.start()
+    traced_before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    controller.watch()
+    churn = time.perf_counter() - start
+    gc.collect()
+    traced_after, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings.sort()
+    results['churn_events'] = len(events)
+    results['churn_seconds'] = round(churn, 3)
+    results['churn_retained_bytes_per_event'] = round((traced_after - traced_before) / len(events), 1)
+    results['churn_peak_bytes_per_event'] = round((traced_peak - traced_before) / len(events), 1)
+    results['reconcile_p50_ms'] = round(statistics.median(timings) * 1000, 3)
+    results['reconcile_p99_ms'] = round(timings[int(len(timings) * 0.99)] * 1000, 3)
+    results['peak_rss_mb'] = round(peak_rss_mb(), 1)
+    results['rancher_requests'] = dict(rancher.call_counts)
+    results['changes'] = dict(controller.changes)
+    return results
+
+def check(results, thresholds):
+    # A threshold is the most a figure may reach; figures without one aren't checked
+    failures = []
+    for name, limit in thresholds.get(str(results['namespaces']), {}).items():
+        if results.get(name) is not None and results[name] > limit:
+            failures.append(f'{name} {results[name]} > {limit}')
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description='Scale and memory benchmark over synthetic clusters',
+                                        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--sizes', default='10000,50000,100000', help='Comma-separated namespace counts to run')
+    parser.add_argument('--projects', type=int, default=0, help='Projects the namespaces are spread over. 0 means one per 20 namespaces')
+    parser.add_argument('--groups', type=int, default=500, help='Distinct owner groups')
+    parser.add_argument('--owners-per-namespace', type=int, default=2, help='Owner groups on each namespace')
+    parser.add_argument('--unassigned', type=float, default=0.01, help='Share of namespaces not yet annotated with a project ID')
+    parser.add_argument('--churn-events', type=int, default=5000, help='Events in the steady-state phase')
+    parser.add_argument('--role-workers', type=int, default=1, help='Role changes made at once per project')
+    parser.add_argument('--seed', type=int, default=1, help='Seed for the synthetic cluster')
+    parser.add_argument('--output', default='scale-results.json', help='Where to write the results')
+    parser.add_argument('--thresholds', default=os.path.join(ROOT, 'benchmarks', 'scale_thresholds.json'),
+            help='JSON of the most each figure may reach, by namespace count')
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.size is not None:
+        # One size, in a child process of our own
+        args.projects = args.projects or max(1, args.size // 20)
+        print(json.dumps(run_size(args)))
+        return
+
+    with open(args.thresholds, 'r') as thresholds_file:
+        thresholds = json.load(thresholds_file)
+    runs = []
+    failed = False
+    for size in [ int(size) for size in args.sizes.split(',') ]:
+        child = subprocess.run([ sys.executable, os.path.abspath(__file__), *sys.argv[1:], '--size', str(size) ],
+                                cwd=ROOT, stdout=subprocess.PIPE, check=True)
+        results = json.loads(child.stdout)
+        results['failures'] = check(results, thresholds)
+        failed = failed or bool(results['failures'])
+        runs.append(results)
+        print(f"{size:>7} namespaces: sweep {results['sweep_seconds']}s, churn p99 {results['reconcile_p99_ms']}ms, "
+              f"peak RSS {results['peak_rss_mb']}MB, {results['churn_retained_bytes_per_event']} bytes kept per event"
+              + (f" FAILED: {'; '.join(results['failures'])}" if results['failures'] else ''))
+
+    with open(args.output, 'w') as output:
+        json.dump({ 'python': sys.version.split()[0], 'runs': runs, 'thresholds': thresholds }, output, indent=2)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+# Measures how long main.py takes to answer -h or reject bad arguments, and how long the package
+# itself takes to import. Run from the repository root: python3 benchmarks/startup.py
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = {
+    'help': [ sys.executable, 'main.py', '-h' ],
+    'missing-args': [ sys.executable, 'main.py' ],
+    'import-package': [ sys.executable, '-c', 'import RancherProjectManager' ],
+    'interpreter-only': [ sys.executable, '-c', 'pass' ],
+}
+
+def time_command(command, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup time benchmark for main.py')
+    parser.add_argument('-n', '--runs', type=int, default=10, help='Runs per case')
+    args = parser.parse_args()
+
+    print(f'{"case":<18} {"median ms":>10} {"min ms":>10} {"max ms":>10}')
+    for name, command in CASES.items():
+        timings = time_command(command, args.runs)
+        print(f'{name:<18} {statistics.median(timings) * 1000:>10.1f} {min(timings) * 1000:>10.1f} {max(timings) * 1000:>10.1f}')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+# Compares the per-event cost of turning a namespace watch event into a V1Namespace model (what
+# kubernetes.watch.Watch does) against projecting it into a NamespaceRecord (what --lean-watch does).
+# Run from the repository root: python3 benchmarks/watch_decode.py
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from kubernetes import client
+from RancherProjectManager import NamespaceRecord
+
+ANNOTATION_KEYS = [ 'rancher-project-mgmt.motus.com/project-name', 'field.cattle.io/projectId',
+                    'rancher-project-mgmt.motus.com/cluster-name', 'rancher-project-mgmt.motus.com/owners',
+                    'rancher-project-mgmt.motus.com/workload-managers' ]
+
+def make_event(i):
+    # Roughly what a Rancher-managed namespace looks like, managed fields and all
+    return json.dumps({ 'type': 'MODIFIED', 'object': {
+        'apiVersion': 'v1', 'kind': 'Namespace',
+        'metadata': {
+            'name': f'namespace-{i}', 'uid': f'5b0c6a9e-0000-4000-8000-{i:012d}', 'resourceVersion': str(100000 + i),
+            'creationTimestamp': '2024-01-01T00:00:00Z',
+            'labels': { 'kubernetes.io/metadata.name': f'namespace-{i}', 'field.cattle.io/projectId': 'p-abc12' },
+            'annotations': {
+                'rancher-project-mgmt.motus.com/project-name': f'project-{i % 50}',
+                'rancher-project-mgmt.motus.com/owners': 'developers,operators',
+                'field.cattle.io/projectId': 'c-xyz12:p-abc12',
+                'cattle.io/status': json.dumps({ 'Conditions': [ { 'Type': 'ResourceQuotaInit', 'Status': 'True' } ] * 3 }),
+                'lifecycle.cattle.io/create.namespace-auth': 'true',
+                'kubectl.kubernetes.io/last-applied-configuration': 'x' * 600 },
+            'finalizers': [ 'controller.cattle.io/namespace-auth' ],
+            'managedFields': [ { 'manager': f'manager-{j}', 'operation': 'Update', 'apiVersion': 'v1',
+                                 'time': '2024-01-01T00:00:00Z', 'fieldsType': 'FieldsV1',
+                                 'fieldsV1': { 'f:metadata': { 'f:annotations': { '.': {}, 'f:cattle.io/status': {} } } } }
+                               for j in range(4) ] },
+        'spec': { 'finalizers': [ 'kubernetes' ] },
+        'status': { 'phase': 'Active' } } })
+
+def model_decode(api_client, line):
+    js = json.loads(line)
+    return api_client.deserialize(json.dumps(js['object']), 'V1Namespace', 'application/json')
+
+def lean_decode(api_client, line):
+    return NamespaceRecord.from_dict(json.loads(line)['object'], ANNOTATION_KEYS)
+
+def measure(decode, api_client, lines):
+    start = time.process_time()
+    for line in lines:
+        decode(api_client, line)
+    cpu = (time.process_time() - start) / len(lines)
+
+    # Memory held by the decoded objects, as if they were all queued up waiting to be processed
+    tracemalloc.start()
+    kept = [ decode(api_client, line) for line in lines ]
+    retained = tracemalloc.get_traced_memory()[0] / len(lines)
+    tracemalloc.stop()
+    del kept
+    return cpu, retained
+
+def main():
+    parser = argparse.ArgumentParser(description='Namespace watch event decode benchmark')
+    parser.add_argument('-n', '--events', type=int, default=5000, help='Events to decode')
+    args = parser.parse_args()
+
+    api_client = client.ApiClient()
+    lines = [ make_event(i) for i in range(args.events) ]
+    print(f'{"path":<8} {"us/event":>10} {"bytes/object":>14}')
+    for name, decode in [ ('model', model_decode), ('lean', lean_decode) ]:
+        cpu, retained = measure(decode, api_client, lines)
+        print(f'{name:<8} {cpu * 1e6:>10.1f} {retained:>14.0f}')
+
+if __name__ == "__main__":
+    main()
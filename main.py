@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 
-from RancherProjectManager import *
+# Only light stdlib modules up here. The kubernetes client alone takes the better part of two seconds to
+# import, so it (along with requests and our own package) is pulled in by main() once the arguments check out
 import argparse
+from collections import Counter
+import json
 import logging
-from kubernetes.client.exceptions import ApiException
+import os
+import socket
+import sys
 
 def main():
-    logging.basicConfig(level=logging.INFO)
-
     parser = argparse.ArgumentParser(description='Watches and annotates namespaces to assign them to Rancher projects',
                                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('-a', '--rancher-addr', required=True,
@@ -35,34 +38,315 @@ def main():
             default='rancher-project-mgmt.motus.com/workload-managers',
             help='The annotation that holds a comma-separated list of groups or usernames, who will be granted Manage Workloads on the project for a namespace')
 
+    parser.add_argument('--role-annotation', metavar='ANNOTATION=ROLE_TEMPLATE_ID', action='append', default=[],
+            help='Grant the groups or usernames listed in this namespace annotation the given Rancher role template on its project. Repeatable')
+    parser.add_argument('--role-map', metavar='FILE', default=None,
+            help='JSON file holding an object of annotation: role template ID pairs, like --role-annotation. Flags win over the file')
+
+    parser.add_argument('--leader-elect', action='store_true',
+            help='Only act while holding a Kubernetes Lease, so extra replicas wait on standby instead of duplicating work')
+    parser.add_argument('--shard', action='store_true',
+            help='Split projects between all running replicas by consistent hashing of the project name, rebalancing as replicas come and go')
+    parser.add_argument('--lease-name', default='rancher-project-manager',
+            help='Name of the leader election Lease, or the prefix of the per-replica Leases in sharded mode')
+    parser.add_argument('--lease-namespace', default=os.getenv('POD_NAMESPACE', 'kube-system'),
+            help='Namespace holding the coordination Leases')
+    parser.add_argument('--identity', default=os.getenv('POD_NAME', socket.gethostname()),
+            help='Unique name of this replica, used as the Lease holder identity')
+    parser.add_argument('--multi-cluster', metavar='KUBECONFIG', default=None,
+            help='Watch every context of this kubeconfig file, or of every kubeconfig file in this directory, from one process')
+    parser.add_argument('--cluster-map', metavar='CONTEXT=CLUSTER_ID', action='append', default=[],
+            help='With --multi-cluster, the Rancher cluster ID new projects are created in for a kube context. Defaults to the context name. Repeatable')
+    parser.add_argument('--rancher-qps', type=float, default=0,
+            help='Maximum sustained requests per second sent to Rancher, shared by every watched cluster. 0 disables the limit')
+    parser.add_argument('--rancher-burst', type=int, default=10,
+            help='Number of Rancher requests allowed in a burst above --rancher-qps')
+    parser.add_argument('--rancher-connections', type=int, default=10,
+            help='Size of the pooled keep-alive connections to Rancher')
+    parser.add_argument('--role-workers', type=int, default=8,
+            help='Number of owner lookups and role binding changes for one namespace sent to Rancher at the same time')
+    parser.add_argument('--preprovision-projects', type=int, default=0, metavar='WORKERS',
+            help='At startup, list every namespace first and create all missing projects up front, this many at a time, before processing any. 0 creates them one by one as namespaces are processed')
+    parser.add_argument('--rancher-response-cache', type=float, default=0, metavar='MB',
+            help='Keep up to this many megabytes of Rancher responses and re-request them conditionally (ETag/Last-Modified). 0 disables it')
+    parser.add_argument('--kube-qps', type=float, default=0,
+            help='Most namespace patches sent to Kubernetes per second, with repeat patches to one namespace merged. 0 sends them inline, unthrottled')
+    parser.add_argument('--kube-burst', type=int, default=10,
+            help='Namespace patches allowed at once above --kube-qps')
+    parser.add_argument('--kube-patch-workers', type=int, default=4,
+            help='Namespace patches in flight at once with --kube-qps')
+    parser.add_argument('--json-codec', default='auto', choices=['auto', 'json', 'orjson'],
+            help='JSON library for Rancher requests and responses. auto uses orjson when it is installed')
+    parser.add_argument('--lean-watch', action='store_true',
+            help='Read namespace lists and watch events as raw JSON, keeping only the fields and annotations this controller uses')
+    parser.add_argument('--watch-timeout', type=int, default=300,
+            help='Seconds after which the API server ends each namespace watch, which is then resumed from where it left off. 0 keeps one watch open for as long as it lasts')
+    parser.add_argument('--watch-idle-timeout', type=float, default=120,
+            help='Reconnect a namespace watch that has sent no events or bookmarks for this many seconds. Needs --watch-timeout, 0 disables it')
+    parser.add_argument('--priority-queue', action='store_true',
+            help='Process namespaces without a project yet, or whose annotations changed, ahead of re-checking ones already done')
+    parser.add_argument('--verify-qps', type=float, default=10,
+            help='With --priority-queue, the most already-done namespaces re-checked per second. 0 removes the cap')
+    parser.add_argument('--cache-file', default=None,
+            help='SQLite file caching project IDs, principals and role bindings across restarts. Put it on a persistent volume')
+    parser.add_argument('--cache-project-ttl', type=float, default=3600,
+            help='Seconds a cached project lookup is trusted before it is checked against Rancher again')
+    parser.add_argument('--cache-principal-ttl', type=float, default=3600,
+            help='Seconds a cached user or group lookup is trusted before it is checked against Rancher again')
+    parser.add_argument('--cache-binding-ttl', type=float, default=300,
+            help='Seconds a cached list of project members is trusted before it is checked against Rancher again')
+    parser.add_argument('--resync-interval', type=float, default=0,
+            help='Seconds between checks of every managed project\'s members against Rancher, correcting any drift. 0 disables them')
+    parser.add_argument('--resync-min-interval', type=float, default=60,
+            help='Shortest interval the drift resync speeds up to while it keeps finding drift')
+    parser.add_argument('--resync-max-interval', type=float, default=3600,
+            help='Longest interval the drift resync backs off to while it finds none')
+    parser.add_argument('--webhook-port', type=int, default=0,
+            help='Port serving a mutating admission webhook that sets the project ID on namespaces as they are created. 0 disables it')
+    parser.add_argument('--webhook-cert', default=None,
+            help='TLS certificate for the admission webhook. The API server only calls webhooks over HTTPS')
+    parser.add_argument('--webhook-key', default=None,
+            help='Private key of --webhook-cert')
+    parser.add_argument('--webhook-refresh-interval', type=float, default=300,
+            help='Seconds between reloads of the admission webhook\'s index of Rancher projects')
+    parser.add_argument('--profiling', action='store_true',
+            help='Serve on-demand CPU profiles at /debug/profile and heap growth at /debug/heap on the admin port')
+    parser.add_argument('--record-events', metavar='FILE', default=None,
+            help='Append every namespace listed or watched to this JSONL file, for replaying with benchmarks/replay.py')
+    parser.add_argument('--record-anonymize', action='store_true',
+            help='Replace namespace names and annotation values with hashes in the --record-events file')
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+            help='Minimum level of log messages to print')
+    parser.add_argument('--log-format', default='text', choices=['text', 'json'],
+            help='Print log messages as plain text or as one JSON object per line')
+    parser.add_argument('--log-payload-limit', type=int, default=2000,
+            help='Truncate Rancher payloads in DEBUG logs to this many characters. 0 logs them whole')
+    parser.add_argument('--log-payload-sample', type=int, default=1,
+            help='Only log one in this many Rancher payloads at DEBUG level')
+    parser.add_argument('--admin-port', type=int, default=0,
+            help='Port serving /healthz, /readyz and /metrics, unauthenticated on every interface. 0 disables it')
+
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND',
+            help='Optional. Without a command, watches namespaces until stopped')
+    reconcile_all = subparsers.add_parser('reconcile-all',
+            help='Check every namespace once, in parallel, print a timing report and exit',
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    reconcile_all.add_argument('--workers', type=int, default=16,
+            help='Number of projects reconciled at the same time')
+    reconcile_all.add_argument('--json', action='store_true',
+            help='Print the report as JSON instead of text')
+
     args = parser.parse_args()
+    if args.command == 'reconcile-all' and (args.leader_elect or args.shard or args.multi_cluster):
+        parser.error('reconcile-all cannot be combined with --leader-elect, --shard or --multi-cluster')
+    if args.leader_elect and args.shard:
+        parser.error('--leader-elect and --shard are mutually exclusive')
+    if args.resync_interval and not 0 < args.resync_min_interval <= args.resync_interval <= args.resync_max_interval:
+        parser.error('--resync-interval must lie between --resync-min-interval and --resync-max-interval')
+    if args.profiling and not args.admin_port:
+        parser.error('--profiling needs --admin-port')
+    if args.record_events and args.multi_cluster:
+        parser.error('--record-events cannot be combined with --multi-cluster')
+    if args.record_anonymize and not args.record_events:
+        parser.error('--record-anonymize needs --record-events')
+    if args.webhook_port and args.multi_cluster:
+        parser.error('--webhook-port cannot be combined with --multi-cluster')
+    if bool(args.webhook_cert) != bool(args.webhook_key):
+        parser.error('--webhook-cert and --webhook-key go together')
+    if args.webhook_refresh_interval <= 0:
+        parser.error('--webhook-refresh-interval must be positive')
+    if args.watch_idle_timeout and not args.watch_timeout:
+        parser.error('--watch-idle-timeout needs --watch-timeout')
+    if args.kube_burst < 1 or args.kube_patch_workers < 1:
+        parser.error('--kube-burst and --kube-patch-workers must be at least 1')
+    if args.role_workers < 1:
+        parser.error('--role-workers must be at least 1')
+    if args.preprovision_projects < 0:
+        parser.error('--preprovision-projects must not be negative')
+    if args.log_payload_sample < 1:
+        parser.error('--log-payload-sample must be at least 1')
+    try:
+        cluster_map = dict(mapping.split('=', 1) for mapping in args.cluster_map)
+    except ValueError:
+        parser.error('--cluster-map entries must look like CONTEXT=CLUSTER_ID')
+    role_annotations = {}
+    if args.role_map is not None:
+        try:
+            with open(args.role_map, 'r') as role_map_file:
+                role_annotations.update(json.load(role_map_file))
+        except (OSError, ValueError) as e:
+            parser.error(f'Could not read --role-map {args.role_map}: {e}')
+    try:
+        role_annotations.update(mapping.split('=', 1) for mapping in args.role_annotation)
+    except ValueError:
+        parser.error('--role-annotation entries must look like ANNOTATION=ROLE_TEMPLATE_ID')
     
+    rancher_key_file = None
     if args.rancher_secret is None:
         rancher_key_file = '/var/rancher-project-mgmt/rancher-secret'
-        logging.info(f'Loading rancher API key from {rancher_key_file}')
         secret_file_handle = open(rancher_key_file, "r")
         args.rancher_secret = secret_file_handle.read()
         secret_file_handle.close()
 
+    import requests
+    from kubernetes import client
+    from RancherProjectManager import (AdminServer, AdmissionWebhook, DriftResync, EventRecorder, LeaderElector, MetricsRegistry,
+                                        MultiClusterManager, Profiler, RancherApi, RancherProjectManagement, RateLimiter,
+                                        ResponseCache, ShardCoordinator, WarmCache, configure_logging, get_codec,
+                                        load_kube_config)
+    from RancherProjectManager.AdmissionWebhook import METRICS as ADMISSION_METRICS
+    from RancherProjectManager.DriftResync import METRICS as RESYNC_METRICS
+    from RancherProjectManager.NamespacePatcher import METRICS as PATCH_METRICS
+
+    configure_logging(args.log_level, args.log_format == 'json', args.log_payload_limit, args.log_payload_sample)
+    if rancher_key_file is not None:
+        logging.info(f'Loaded rancher API key from {rancher_key_file}')
     logging.info('Starting up...')
-    rancher = RancherApi(args.rancher_addr, args.rancher_key, args.rancher_secret)
-    projectManager = RancherProjectManagement(rancher,
+
+    session = requests.Session()
+    connections = max(args.rancher_connections, getattr(args, 'workers', 0), args.role_workers)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=connections, pool_maxsize=connections)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    rate_limiter = RateLimiter(args.rancher_qps, args.rancher_burst) if args.rancher_qps > 0 else None
+    codec = get_codec(args.json_codec)
+    logging.info(f'Using {codec.name} to encode and decode Rancher JSON')
+    response_cache = ResponseCache(int(args.rancher_response_cache * 1024 * 1024)) if args.rancher_response_cache > 0 else None
+    rancher = RancherApi(args.rancher_addr, args.rancher_key, args.rancher_secret, session=session, rate_limiter=rate_limiter,
+                            codec=codec, response_cache=response_cache)
+
+    cache = None
+    if args.cache_file is not None:
+        cache = WarmCache(args.cache_file, args.rancher_addr, { 'project': args.cache_project_ttl,
+                                                                'principal': args.cache_principal_ttl,
+                                                                'binding': args.cache_binding_ttl })
+
+    recorder = EventRecorder(args.record_events, args.record_anonymize) if args.record_events else None
+
+    def make_controller(kubeapi=None, default_cluster=args.default_cluster):
+        return RancherProjectManagement(rancher,
                             args.project_name_annotation,
                             args.project_id_annotation,
-                            args.default_cluster,
+                            default_cluster,
                             args.cluster_name_annotation,
                             args.owners_annotation,
-                            args.workload_managers_annotation)
-    while(True):
-        try: 
-            projectManager.watch()
-        except ApiException as e:
-            if str(e.status) == '410':
-                logging.warning('Kubernetes API resources expired - reestablishing watch')
-                continue
-            else:
-                logging.exception(f'Kubernetes API fatal error: {e.status}, {e.reason}')
-                raise
+                            args.workload_managers_annotation,
+                            kubeapi=kubeapi,
+                            lean_watch=args.lean_watch,
+                            cache=cache,
+                            priority_queue=args.priority_queue,
+                            verify_qps=args.verify_qps,
+                            role_workers=args.role_workers,
+                            role_annotations=role_annotations,
+                            recorder=recorder,
+                            patch_qps=args.kube_qps,
+                            patch_burst=args.kube_burst,
+                            patch_workers=args.kube_patch_workers,
+                            watch_timeout=args.watch_timeout,
+                            idle_timeout=args.watch_idle_timeout,
+                            preprovision_workers=args.preprovision_projects)
+
+    if args.command == 'reconcile-all':
+        report = make_controller().reconcile_all(args.workers)
+        print(json.dumps(report.to_dict(), indent=2) if args.json else report)
+        sys.exit(1 if report.errors else 0)
+
+    if args.multi_cluster:
+        projectManager = MultiClusterManager(make_controller, args.multi_cluster, cluster_map)
+        controllers = list(projectManager.controllers.values())
+        if args.leader_elect or args.shard:
+            # Leases live in the cluster we're running in, not the watched ones
+            load_kube_config()
+    else:
+        projectManager = make_controller()
+        controllers = [ projectManager ]
+
+    elector = None
+    if args.leader_elect:
+        elector = LeaderElector(client.CoordinationV1Api(), args.lease_namespace, args.lease_name, args.identity,
+                                on_lost=lambda: os._exit(1))
+
+    resync = None
+    if args.resync_interval:
+        # One for every cluster, so each pass reads Rancher's bindings just once
+        resync = DriftResync(controllers, args.resync_interval, args.resync_min_interval, args.resync_max_interval)
+
+    metrics = MetricsRegistry()
+    metrics.register('rancher_requests_total', 'counter', 'Requests sent to Rancher',
+                        lambda: dict(rancher.call_counts), label='method')
+    metrics.register('changes_total', 'counter', 'Changes made to Rancher projects and namespaces',
+                        lambda: dict(sum((c.changes for c in controllers), Counter())), label='kind')
+    if cache is not None:
+        metrics.register('cache_hits_total', 'counter', 'Warm cache lookups answered from the cache', lambda: cache.hits)
+        metrics.register('cache_misses_total', 'counter', 'Warm cache lookups that went to Rancher', lambda: cache.misses)
+    if response_cache is not None:
+        metrics.register('response_cache_hits_total', 'counter', 'Rancher GETs answered 304 Not Modified from the response cache',
+                            lambda: response_cache.hits)
+        metrics.register('response_cache_misses_total', 'counter', 'Rancher GETs that returned a whole payload',
+                            lambda: response_cache.misses)
+        metrics.register('response_cache_hit_ratio', 'gauge', 'Share of Rancher GETs answered from the response cache',
+                            response_cache.hit_ratio)
+        metrics.register('response_cache_bytes_saved_total', 'counter', 'Payload bytes not downloaded thanks to 304s',
+                            lambda: response_cache.bytes_saved)
+        metrics.register('response_cache_bytes', 'gauge', 'Bytes of response bodies held', lambda: response_cache.size)
+        metrics.register('response_cache_evictions_total', 'counter', 'Responses dropped to stay within the memory budget',
+                            lambda: response_cache.evictions)
+    if resync is not None:
+        for name, kind, description in RESYNC_METRICS:
+            metrics.register(name, kind, description, lambda name=name: resync.stats[name])
+
+    def slowest(values):
+        values = [ value for value in values if value is not None ]
+        return max(values) if values else None
+    metrics.register('watch_seconds_since_last_event', 'gauge', 'Time since any namespace watch last received an event or bookmark',
+                        lambda: slowest(c.seconds_since_last_watch_event() for c in controllers))
+    metrics.register('watch_reconnects_total', 'counter', 'Namespace watch reconnects, by why the last connection ended',
+                        lambda: dict(sum((c.watch_reconnects for c in controllers), Counter())), label='reason')
+    metrics.register('watch_reconnect_seconds', 'gauge', 'Time the namespace watch was down during its last reconnect',
+                        lambda: slowest(c.last_reconnect_seconds for c in controllers))
+    metrics.register('watch_reconnect_max_seconds', 'gauge', 'Longest time the namespace watch has been down reconnecting',
+                        lambda: max(c.max_reconnect_seconds for c in controllers))
+
+    patchers = [ controller.patcher for controller in controllers if controller.patcher is not None ]
+    if patchers:
+        for name, kind, description in PATCH_METRICS:
+            combine = max if name == 'namespace_patch_max_seconds' else sum
+            metrics.register(name, kind, description, lambda name=name, combine=combine: combine(p.stats[name] for p in patchers))
+
+    webhook = None
+    if args.webhook_port:
+        # Every replica answers reviews, standbys and other shards included, but only the leader creates projects
+        webhook = AdmissionWebhook(projectManager, args.webhook_port, args.webhook_cert, args.webhook_key,
+                                    args.webhook_refresh_interval, can_create=lambda: elector is None or elector.is_leader)
+        for name, kind, description in ADMISSION_METRICS:
+            metrics.register(name, kind, description, lambda name=name: webhook.stats[name])
+
+    if args.admin_port:
+        # A standby replica has nothing to process, it's ready as soon as it's waiting on the lease
+        admin = AdminServer(args.admin_port, ready_check=lambda: (elector is not None and not elector.is_leader) or
+                                                                 all(c.ready.is_set() for c in controllers))
+        admin.add_route('/metrics', metrics.handle)
+        if args.profiling:
+            profiler = Profiler()
+            admin.add_route('/debug/profile', profiler.handle_cpu)
+            admin.add_route('/debug/heap', profiler.handle_heap)
+        admin.start()
+
+    if elector is None and args.shard:
+        # Before the webhook starts, so it never sees a controller without its shard and creates another shard's project
+        shard = ShardCoordinator(client.CoordinationV1Api(), args.lease_namespace, args.lease_name, args.identity,
+                                on_rebalance=projectManager.request_resync)
+        shard.start()
+        for controller in controllers:
+            controller.shard = shard
+    if webhook is not None:
+        webhook.start()
+    if elector is not None:
+        elector.acquire()
+
+    if resync is not None:
+        resync.start()
+    projectManager.run()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,56 @@
+import unittest
+import logging
+import urllib.error
+import urllib.request
+from RancherProjectManager import *
+
+class TestAdminServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.INFO, filename='/dev/null')
+
+    def setUp(self):
+        self.ready = False
+        self.sut = AdminServer(0, ready_check=lambda: self.ready, host='127.0.0.1')
+        self.sut.start()
+        self.addCleanup(self.sut.stop)
+
+    def get(self, path):
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{self.sut.port}{path}') as r:
+                return r.status, r.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def test_healthz_always_ok(self):
+        self.assertEqual((200, b'ok'), self.get('/healthz'))
+
+    def test_readyz_follows_ready_check(self):
+        self.assertEqual(503, self.get('/readyz')[0])
+
+        self.ready = True
+
+        self.assertEqual((200, b'ready'), self.get('/readyz'))
+
+    def test_unknown_path_404s(self):
+        self.assertEqual(404, self.get('/nope')[0])
+
+    def test_custom_route_gets_query(self):
+        self.sut.add_route('/echo', lambda query: (200, 'text/plain', query['word'][0].encode()))
+
+        self.assertEqual((200, b'hello'), self.get('/echo?word=hello'))
+
+    def test_custom_route_extra_headers(self):
+        self.sut.add_route('/file', lambda query: (200, 'text/plain', b'data', { 'Content-Disposition': 'attachment; filename="x.txt"' }))
+
+        with urllib.request.urlopen(f'http://127.0.0.1:{self.sut.port}/file') as r:
+            self.assertEqual('attachment; filename="x.txt"', r.headers['Content-Disposition'])
+            self.assertEqual(b'data', r.read())
+
+    def test_handler_error_500s(self):
+        self.sut.add_route('/broken', lambda query: 1 / 0)
+
+        self.assertEqual(500, self.get('/broken')[0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import base64
+import json
+import unittest
+import logging
+import requests
+from unittest.mock import MagicMock
+from RancherProjectManager import *
+
+PROJECT_NAME = 'rancher-project-mgmt.motus.com/project-name'
+PROJECT_ID = 'field.cattle.io/projectId'
+CLUSTER_NAME = 'rancher-project-mgmt.motus.com/cluster-name'
+
+def make_review(annotations, operation='CREATE', dry_run=False):
+    return { 'apiVersion': 'admission.k8s.io/v1', 'kind': 'AdmissionReview',
+             'request': { 'uid': 'uid-1', 'kind': { 'group': '', 'version': 'v1', 'kind': 'Namespace' }, 'operation': operation,
+                          'name': 'ns1', 'dryRun': dry_run, 'object': { 'metadata': { 'name': 'ns1', 'annotations': annotations } } } }
+
+def decode_patch(response):
+    return json.loads(base64.b64decode(response['response']['patch']))
+
+class TestAdmissionWebhook(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.INFO, filename='/dev/null')
+
+    def setUp(self):
+        self.rancher = FakeRancher()
+        self.rancher.projects['local:p-1'] = { 'id': 'local:p-1', 'name': 'proj1', 'clusterId': 'local' }
+        self.controller = RancherProjectManagement(self.rancher, PROJECT_NAME, PROJECT_ID, 'local', CLUSTER_NAME,
+                                                    'owners', 'workload-managers', kubeapi=MagicMock())
+        self.sut = AdmissionWebhook(self.controller, port=0, host='127.0.0.1')
+        self.sut.refresh()
+        # The one-off cluster lookup, out of the way of the request counts
+        self.rancher.get_cluster_id('local')
+        self.rancher.call_counts.clear()
+
+    def test_injects_project_id_from_index(self):
+        response = self.sut.review(make_review({ PROJECT_NAME: 'proj1' }))
+
+        self.assertEqual({ 'uid': 'uid-1', 'allowed': True, 'patchType': 'JSONPatch', 'patch': response['response']['patch'] },
+                            response['response'])
+        self.assertEqual([ { 'op': 'add', 'path': '/metadata/annotations/field.cattle.io~1projectId', 'value': 'local:p-1' } ],
+                            decode_patch(response))
+        self.assertEqual(0, sum(self.rancher.call_counts.values()))
+
+    def test_correct_project_id_is_left_alone(self):
+        response = self.sut.review(make_review({ PROJECT_NAME: 'proj1', PROJECT_ID: 'local:p-1' }, operation='UPDATE'))
+
+        self.assertEqual({ 'uid': 'uid-1', 'allowed': True }, response['response'])
+
+    def test_unmanaged_namespaces_and_deletes_are_left_alone(self):
+        self.assertNotIn('patch', self.sut.review(make_review({ 'other': 'x' }))['response'])
+        self.assertNotIn('patch', self.sut.review(make_review(None))['response'])
+        self.assertNotIn('patch', self.sut.review(make_review({ PROJECT_NAME: 'proj1' }, operation='DELETE'))['response'])
+
+    def test_missing_project_is_created_once_in_its_cluster(self):
+        self.sut.review(make_review({ PROJECT_NAME: 'proj2', CLUSTER_NAME: 'c-2' }))
+        response = self.sut.review(make_review({ PROJECT_NAME: 'proj2', CLUSTER_NAME: 'c-2' }))
+
+        project = next(project for project in self.rancher.projects.values() if project['name'] == 'proj2')
+        self.assertEqual('c-2', project['clusterId'])
+        self.assertEqual(project['id'], decode_patch(response)[0]['value'])
+        self.assertEqual(1, self.controller.changes['projects_created'])
+        self.assertEqual(1, self.sut.stats['admission_index_misses_total'])
+
+    def test_same_name_in_another_cluster_is_another_project(self):
+        response = self.sut.review(make_review({ PROJECT_NAME: 'proj1', CLUSTER_NAME: 'c-2' }))
+
+        project = next(project for project in self.rancher.projects.values() if project['clusterId'] == 'c-2')
+        self.assertEqual('proj1', project['name'])
+        self.assertEqual(project['id'], decode_patch(response)[0]['value'])
+
+    def test_dry_run_creates_nothing(self):
+        response = self.sut.review(make_review({ PROJECT_NAME: 'proj2' }, dry_run=True))
+
+        self.assertNotIn('patch', response['response'])
+        self.assertEqual(1, len(self.rancher.projects))
+
+    def test_standby_looks_projects_up_without_creating_them(self):
+        self.sut.can_create = lambda: False
+        self.rancher.projects['c-2:p-2'] = { 'id': 'c-2:p-2', 'name': 'proj2', 'clusterId': 'c-2' }
+
+        existing = self.sut.review(make_review({ PROJECT_NAME: 'proj2', CLUSTER_NAME: 'c-2' }))
+        missing = self.sut.review(make_review({ PROJECT_NAME: 'proj3' }))
+
+        self.assertEqual('c-2:p-2', decode_patch(existing)[0]['value'])
+        self.assertNotIn('patch', missing['response'])
+        self.assertEqual(2, len(self.rancher.projects))
+
+    def test_rancher_errors_let_the_namespace_through(self):
+        self.rancher.get_project = MagicMock(side_effect=requests.HTTPError('503 Server Error'))
+
+        response = self.sut.review(make_review({ PROJECT_NAME: 'proj2' }))
+
+        self.assertEqual({ 'uid': 'uid-1', 'allowed': True }, response['response'])
+        self.assertEqual(1, self.sut.stats['admission_errors_total'])
+
+    def test_refresh_replaces_index(self):
+        self.rancher.projects = { 'local:p-9': { 'id': 'local:p-9', 'name': 'proj1', 'clusterId': 'local' } }
+
+        self.sut.refresh()
+
+        self.assertEqual({ ('local', 'proj1'): 'local:p-9' }, self.sut.index)
+
+    def test_serves_reviews_to_stand_in_client(self):
+        self.sut.start()
+        self.addCleanup(self.sut.stop)
+        client = AdmissionClient(f'http://127.0.0.1:{self.sut.port}/mutate')
+
+        namespace = client.review_namespace('ns1', { PROJECT_NAME: 'proj1' })
+
+        self.assertEqual({ PROJECT_NAME: 'proj1', PROJECT_ID: 'local:p-1' }, namespace['metadata']['annotations'])
+        self.assertEqual(400, requests.post(client.url, data=b'[]').status_code)
+        self.assertEqual(404, requests.post(f'http://127.0.0.1:{self.sut.port}/validate', json=make_review({})).status_code)
+
+if __name__ == '__main__':
+    unittest.main()
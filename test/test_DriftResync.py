@@ -0,0 +1,145 @@
+import threading
+import unittest
+import logging
+import requests
+from collections import Counter
+from unittest.mock import MagicMock
+from RancherProjectManager import *
+
+class TestMembershipFingerprint(unittest.TestCase):
+    def test_ignores_order_and_duplicates(self):
+        self.assertEqual(membership_fingerprint(['a', 'b']), membership_fingerprint(['b', 'a', 'b']))
+
+    def test_differs_by_member(self):
+        self.assertNotEqual(membership_fingerprint(['a', 'b']), membership_fingerprint(['a']))
+        self.assertNotEqual(membership_fingerprint(['ab']), membership_fingerprint(['a', 'b']))
+
+class TestDriftResync(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.INFO, filename='/dev/null')
+
+    def setUp(self):
+        self.controller = MagicMock()
+        self.controller.rancher.call_counts = Counter()
+        self.controller.rancher.list_project_role_bindings = MagicMock(return_value=[
+            { 'projectId': 'c-1:p-1', 'roleTemplateId': 'project-owner', 'userPrincipalId': 'local://jdoe', 'groupPrincipalId': None },
+            { 'projectId': 'c-1:p-2', 'roleTemplateId': 'project-owner', 'groupPrincipalId': 'ldap://admins' }
+        ])
+        self.controller.desired_snapshot = MagicMock(return_value={
+            'c-1:p-1': { 'project-owner': membership_fingerprint(['local://jdoe']) },
+            'c-1:p-2': { 'project-owner': membership_fingerprint(['ldap://admins', 'local://jdoe']) },
+            'c-1:p-3': { 'workloads-manage': membership_fingerprint(['local://jdoe']) }
+        })
+        self.sut = DriftResync([ self.controller ], interval=600, min_interval=60, max_interval=3600, spread=0)
+
+    def test_rechecks_only_drifted_projects(self):
+        drifted = self.sut.run_once()
+
+        self.assertEqual(2, drifted)
+        self.assertEqual([ (('c-1:p-2',),), (('c-1:p-3',),) ], self.controller.recheck_project.call_args_list)
+        self.assertEqual(3, self.sut.stats['resync_projects_checked_total'])
+        self.assertEqual(2, self.sut.stats['resync_drift_found_total'])
+        self.assertEqual(2, self.sut.stats['resync_repairs_total'])
+        self.assertEqual(1, self.sut.stats['resync_runs_total'])
+
+    def test_one_bindings_listing_serves_every_cluster(self):
+        other = MagicMock()
+        other.desired_snapshot = MagicMock(return_value={
+            'c-2:p-1': { 'project-owner': membership_fingerprint(['local://jdoe']) }
+        })
+        # Still listing its namespaces
+        starting = MagicMock()
+        starting.ready.is_set = MagicMock(return_value=False)
+        self.sut = DriftResync([ self.controller, other, starting ], interval=600, min_interval=60, max_interval=3600, spread=0)
+
+        self.assertEqual(3, self.sut.run_once())
+
+        self.controller.rancher.list_project_role_bindings.assert_called_once()
+        other.rancher.list_project_role_bindings.assert_not_called()
+        other.recheck_project.assert_called_once_with('c-2:p-1')
+        self.assertEqual(2, self.controller.recheck_project.call_count)
+        starting.desired_snapshot.assert_not_called()
+
+    def test_no_drift_backs_off(self):
+        self.controller.desired_snapshot = MagicMock(return_value={
+            'c-1:p-1': { 'project-owner': membership_fingerprint(['local://jdoe']) }
+        })
+
+        self.assertEqual(0, self.sut.run_once())
+        self.assertEqual(900, self.sut.interval)
+        self.sut.interval = 3000
+        self.sut.run_once()
+        self.assertEqual(3600, self.sut.stats['resync_interval_seconds'])
+        self.controller.recheck_project.assert_not_called()
+
+    def test_drift_speeds_up(self):
+        self.sut.run_once()
+        self.assertEqual(300, self.sut.interval)
+        self.sut.interval = 100
+        self.sut.run_once()
+        self.assertEqual(60, self.sut.interval)
+
+    def test_counts_repair_errors_and_carries_on(self):
+        self.controller.recheck_project = MagicMock(side_effect=[ RancherResponseError('url', None), None ])
+
+        self.sut.run_once()
+
+        self.assertEqual(1, self.sut.stats['resync_repair_errors_total'])
+        self.assertEqual(1, self.sut.stats['resync_repairs_total'])
+
+    def test_counts_only_its_own_rancher_requests(self):
+        rancher = FakeRancher()
+        self.sut.rancher = rancher
+        def recheck(project_id):
+            rancher.get_project_bindings(project_id)
+            # Someone else's request, e.g. the watch's, made meanwhile
+            other = threading.Thread(target=rancher.list_projects)
+            other.start()
+            other.join(5)
+        self.controller.recheck_project = MagicMock(side_effect=recheck)
+
+        self.sut.run_once()
+
+        # The bindings listing and one read per drifted project
+        self.assertEqual(4, self.sut.stats['resync_rancher_requests_total'])
+        self.assertEqual(7, rancher.call_counts['GET'])
+
+    def test_roles_with_failed_lookups_are_not_drift(self):
+        self.controller.desired_snapshot = MagicMock(return_value={
+            'c-1:p-1': { 'project-owner': membership_fingerprint(['local://jdoe']) },
+            'c-1:p-3': { 'workloads-manage': None }
+        })
+
+        self.assertEqual(0, self.sut.run_once())
+        self.assertEqual(1, self.sut.stats['resync_projects_checked_total'])
+        self.assertEqual(900, self.sut.interval)
+
+    def test_loop_carries_on_after_any_error(self):
+        self.controller.rancher.list_project_role_bindings = MagicMock(side_effect=[
+            requests.Timeout('read timed out'), RuntimeError('boom'), [] ])
+        # Three passes straight away, then stop
+        self.sut._next_delay = MagicMock(side_effect=[ 0, 0, 0, 60 ])
+        self.sut._stop.wait = MagicMock(side_effect=lambda delay: delay > 0)
+
+        self.sut._loop()
+
+        self.assertEqual(3, self.controller.rancher.list_project_role_bindings.call_count)
+        self.assertEqual(2, self.sut.stats['resync_errors_total'])
+        self.assertEqual(1, self.sut.stats['resync_runs_total'])
+
+    def test_delay_is_jittered_around_interval(self):
+        delays = { self.sut._next_delay() for _ in range(20) }
+
+        self.assertGreater(len(delays), 1)
+        for delay in delays:
+            self.assertTrue(540 <= delay <= 660)
+
+    def test_rejects_interval_outside_bounds(self):
+        with self.assertRaises(ValueError):
+            DriftResync([ self.controller ], interval=10, min_interval=60)
+        with self.assertRaises(ValueError):
+            DriftResync([])
+
+if __name__ == '__main__':
+    unittest.main()
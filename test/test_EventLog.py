@@ -0,0 +1,140 @@
+from kubernetes.client.models.v1_namespace import V1Namespace
+from kubernetes.client.models.v1_object_meta import V1ObjectMeta
+import json
+import os
+import tempfile
+import unittest
+import logging
+from unittest.mock import patch
+from RancherProjectManager import *
+
+PROJECT_NAME = 'rancher-project-mgmt.motus.com/project-name'
+PROJECT_ID = 'field.cattle.io/projectId'
+OWNERS = 'rancher-project-mgmt.motus.com/owners'
+
+def make_controller(replayer, rancher, **kwargs):
+    return RancherProjectManagement(rancher, PROJECT_NAME, PROJECT_ID, 'local', 'rancher-project-mgmt.motus.com/cluster-name',
+                                    OWNERS, 'rancher-project-mgmt.motus.com/workload-managers',
+                                    kubeapi=replayer, namespace_source=replayer, **kwargs)
+
+class TestEventRecorder(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.INFO, filename='/dev/null')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'events.jsonl')
+
+    def record(self, anonymize=False):
+        sut = EventRecorder(self.path, anonymize, salt=b'salt')
+        sut.record_page([ NamespaceRecord('ns1', { PROJECT_NAME: 'proj1', 'other': 'x' }, '1') ], [ PROJECT_NAME, OWNERS ])
+        sut.record_event({ 'type': 'MODIFIED', 'object': NamespaceRecord('ns2', { PROJECT_NAME: 'proj1', OWNERS: 'jdoe,devs' }, '2') },
+                            [ PROJECT_NAME, OWNERS ])
+        sut.close()
+        return list(read_events(self.path))
+
+    def test_records_list_and_watch_events_with_only_the_given_annotations(self):
+        events = self.record()
+
+        self.assertEqual([ 'LIST', 'MODIFIED' ], [ event_type for _, event_type, _ in events ])
+        self.assertEqual(NamespaceRecord('ns1', { PROJECT_NAME: 'proj1' }, '1'), events[0][2])
+        self.assertEqual(NamespaceRecord('ns2', { PROJECT_NAME: 'proj1', OWNERS: 'jdoe,devs' }, '2'), events[1][2])
+        self.assertLessEqual(events[0][0], events[1][0])
+
+    def test_records_models_too(self):
+        sut = EventRecorder(self.path)
+        sut.record_event({ 'type': 'ADDED', 'object': V1Namespace(metadata=V1ObjectMeta(name='ns1', annotations=None)) })
+        sut.close()
+
+        self.assertEqual(NamespaceRecord('ns1', {}, None), next(read_events(self.path))[2])
+
+    def test_anonymize_hashes_consistently_and_keeps_list_structure(self):
+        events = self.record(anonymize=True)
+
+        with open(self.path) as recording:
+            self.assertNotIn('jdoe', recording.read())
+        first, second = events[0][2], events[1][2]
+        self.assertNotEqual('ns1', first.name)
+        self.assertEqual(first.annotations[PROJECT_NAME], second.annotations[PROJECT_NAME])
+        self.assertEqual(2, len(second.annotations[OWNERS].split(',')))
+
+class TestEventReplayer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.INFO, filename='/dev/null')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'events.jsonl')
+
+    def write(self, *entries):
+        with open(self.path, 'w') as recording:
+            for entry in entries:
+                recording.write(json.dumps(entry) + '\n')
+
+    def test_lists_in_pages_then_streams_events(self):
+        self.write(*[ { 't': 0, 'e': 'LIST', 'n': f'ns{i}', 'a': {}, 'v': str(i) } for i in range(3) ],
+                   { 't': 1, 'e': 'MODIFIED', 'n': 'ns0', 'a': { PROJECT_NAME: 'proj1' }, 'v': '4' },
+                   { 't': 2, 'e': 'LIST', 'n': 'ns1', 'a': {}, 'v': '5' })
+        sut = EventReplayer(self.path, speed=0)
+
+        page, _continue = sut.list_page(2)
+        self.assertEqual([ 'ns0', 'ns1' ], [ ns.name for ns in page ])
+        page, _continue = sut.list_page(2, _continue)
+        self.assertEqual([ 'ns2' ], [ ns.name for ns in page ])
+        self.assertIsNone(_continue)
+
+        events = list(sut.stream())
+        self.assertEqual([ ('MODIFIED', 'ns0'), ('MODIFIED', 'ns1') ], [ (e['type'], e['object'].name) for e in events ])
+        self.assertEqual('5', sut.resource_version)
+        self.assertEqual(2, sut.events_replayed)
+
+    @patch('RancherProjectManager.EventLog.time.sleep')
+    def test_paces_events_by_speed(self, sleep):
+        self.write({ 't': 0, 'e': 'ADDED', 'n': 'ns0', 'a': {}, 'v': '1' },
+                   { 't': 10, 'e': 'MODIFIED', 'n': 'ns0', 'a': {}, 'v': '2' })
+
+        list(EventReplayer(self.path, speed=5).stream())
+
+        sleep.assert_called_once()
+        self.assertAlmostEqual(2, sleep.call_args[0][0], places=1)
+
+    def test_stream_resumes_after_stop(self):
+        self.write(*[ { 't': 0, 'e': 'MODIFIED', 'n': f'ns{i}', 'a': {}, 'v': str(i) } for i in range(3) ])
+        sut = EventReplayer(self.path, speed=0)
+
+        for event in sut.stream():
+            sut.stop()
+
+        self.assertEqual([ 'ns1', 'ns2' ], [ e['object'].name for e in sut.stream() ])
+
+    def test_replay_through_controller_against_fake_rancher(self):
+        self.write({ 't': 0, 'e': 'LIST', 'n': 'ns1', 'a': { PROJECT_NAME: 'proj1', OWNERS: 'jdoe' }, 'v': '1' },
+                   { 't': 0.5, 'e': 'MODIFIED', 'n': 'ns2', 'a': { PROJECT_NAME: 'proj1', OWNERS: 'jdoe,devs' }, 'v': '2' })
+        replayer = EventReplayer(self.path, speed=0)
+        rancher = FakeRancher()
+
+        make_controller(replayer, rancher).watch()
+
+        self.assertEqual([ 'proj1' ], [ project['name'] for project in rancher.projects.values() ])
+        self.assertEqual({ 'local://jdoe', 'local://devs' }, { b['userPrincipalId'] for b in rancher.bindings.values() })
+        self.assertEqual([ 'ns1', 'ns2' ], [ name for name, _ in replayer.patches ])
+        # What's patched in isn't written back into the recording
+        self.assertNotIn(PROJECT_ID, replayer.listing[0].annotations)
+
+    def test_controller_records_what_it_sees(self):
+        self.write({ 't': 0, 'e': 'LIST', 'n': 'ns1', 'a': { PROJECT_NAME: 'proj1' }, 'v': '1' },
+                   { 't': 0.5, 'e': 'DELETED', 'n': 'ns1', 'a': { PROJECT_NAME: 'proj1' }, 'v': '2' })
+        recorded = self.path + '.out'
+        recorder = EventRecorder(recorded)
+
+        make_controller(EventReplayer(self.path, speed=0), FakeRancher(), recorder=recorder).watch()
+        recorder.close()
+
+        self.assertEqual([ ('LIST', 'ns1'), ('DELETED', 'ns1') ], [ (e, r.name) for _, e, r in read_events(recorded) ])
+
+if __name__ == '__main__':
+    unittest.main()
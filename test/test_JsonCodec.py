@@ -0,0 +1,70 @@
+import unittest
+from io import BytesIO
+from unittest.mock import MagicMock, patch
+import requests
+from RancherProjectManager import *
+from RancherProjectManager.JsonCodec import keep_fields
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def make_response(content):
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = BytesIO(content)
+    return response
+
+class TestJsonCodec(unittest.TestCase):
+    def test_stdlib_uses_requests(self):
+        sut = JsonCodec()
+
+        self.assertEqual({ 'a': 1 }, sut.decode_response(make_response(b'{"a": 1}')))
+        self.assertEqual({ 'json': { 'a': 1 } }, sut.request_kwargs({ 'a': 1 }))
+
+    def test_unknown_codec_throws_err(self):
+        with self.assertRaises(ValueError):
+            get_codec('yaml')
+
+    def test_auto_falls_back_to_stdlib(self):
+        with patch.dict('sys.modules', { 'orjson': None }):
+            self.assertEqual('json', get_codec('auto').name)
+
+    def test_keep_fields(self):
+        items = [ { 'id': 'p-1', 'name': 'a', 'links': { 'self': 'x' } }, { 'id': 'p-2' } ]
+
+        self.assertEqual([ { 'id': 'p-1', 'name': 'a' }, { 'id': 'p-2' } ], keep_fields(items, ('id', 'name')))
+
+@unittest.skipIf(orjson is None, 'orjson is not installed')
+class TestOrjsonCodec(unittest.TestCase):
+    def test_round_trips(self):
+        sut = get_codec('auto')
+
+        self.assertEqual('orjson', sut.name)
+        self.assertEqual({ 'a': [1, 2] }, sut.decode_response(make_response(b'{"a": [1, 2]}')))
+        kwargs = sut.request_kwargs({ 'a': None })
+        self.assertEqual(b'{"a":null}', kwargs['data'])
+        self.assertEqual('application/json', kwargs['headers']['Content-Type'])
+
+    def test_invalid_json_becomes_rancher_response_error(self):
+        session = MagicMock()
+        session.get = MagicMock(return_value=make_response(b'not json'))
+        sut = RancherApi('myaddress', 'mykey', 'mysecret', session=session, codec=OrjsonCodec())
+
+        with self.assertRaises(RancherResponseError):
+            sut._get('mypath')
+
+    def test_rancher_api_posts_encoded_body(self):
+        session = MagicMock()
+        session.post = MagicMock(return_value=make_response(b'{"id": "p-1"}'))
+        sut = RancherApi('myaddress', 'mykey', 'mysecret', session=session, codec=OrjsonCodec())
+
+        response = sut._post('/projects', { 'name': 'my project' })
+
+        self.assertEqual({ 'id': 'p-1' }, response)
+        session.post.assert_called_once_with('myaddress/projects', auth = ('mykey', 'mysecret'),
+                                             data = b'{"name":"my project"}', headers = { 'Content-Type': 'application/json' })
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta, timezone
+from kubernetes import client
+from kubernetes.client.exceptions import ApiException
+import time
+import unittest
+import logging
+from unittest.mock import MagicMock
+from RancherProjectManager import *
+
+def make_lease(holder, renewed_ago, duration=15):
+    renew_time = datetime.now(timezone.utc) - timedelta(seconds=renewed_ago)
+    return client.V1Lease(metadata=client.V1ObjectMeta(name='mylease', resource_version='7'),
+                          spec=client.V1LeaseSpec(holder_identity=holder, lease_duration_seconds=duration,
+                                                  renew_time=renew_time, lease_transitions=2))
+
+class TestLeaderElector(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.INFO, filename='/dev/null')
+
+    def setUp(self):
+        self.api = MagicMock()
+        self.sut = LeaderElector(self.api, 'kube-system', 'mylease', 'pod-a')
+
+class TestTryAcquireOrRenew(TestLeaderElector):
+    def test_missing_lease_creates_it(self):
+        self.api.read_namespaced_lease = MagicMock(side_effect=ApiException(status=404))
+
+        self.assertTrue(self.sut.try_acquire_or_renew())
+
+        self.api.create_namespaced_lease.assert_called_once()
+        lease = self.api.create_namespaced_lease.call_args[0][1]
+        self.assertEqual('pod-a', lease.spec.holder_identity)
+
+    def test_create_conflict_loses(self):
+        self.api.read_namespaced_lease = MagicMock(side_effect=ApiException(status=404))
+        self.api.create_namespaced_lease = MagicMock(side_effect=ApiException(status=409))
+
+        self.assertFalse(self.sut.try_acquire_or_renew())
+
+    def test_held_by_other_and_fresh_does_nothing(self):
+        self.api.read_namespaced_lease = MagicMock(return_value=make_lease('pod-b', 1))
+
+        self.assertFalse(self.sut.try_acquire_or_renew())
+
+        self.api.replace_namespaced_lease.assert_not_called()
+
+    def test_held_by_other_and_expired_takes_over(self):
+        lease = make_lease('pod-b', 60)
+        self.api.read_namespaced_lease = MagicMock(return_value=lease)
+
+        self.assertTrue(self.sut.try_acquire_or_renew())
+
+        self.api.replace_namespaced_lease.assert_called_once_with('mylease', 'kube-system', lease, _request_timeout=None)
+        self.assertEqual('pod-a', lease.spec.holder_identity)
+        self.assertEqual(3, lease.spec.lease_transitions)
+
+    def test_held_by_self_renews(self):
+        lease = make_lease('pod-a', 5)
+        old_renew_time = lease.spec.renew_time
+        self.api.read_namespaced_lease = MagicMock(return_value=lease)
+
+        self.assertTrue(self.sut.try_acquire_or_renew())
+
+        self.api.replace_namespaced_lease.assert_called_once()
+        self.assertGreater(lease.spec.renew_time, old_renew_time)
+        self.assertEqual(2, lease.spec.lease_transitions)
+
+    def test_replace_conflict_loses(self):
+        self.api.read_namespaced_lease = MagicMock(return_value=make_lease('pod-b', 60))
+        self.api.replace_namespaced_lease = MagicMock(side_effect=ApiException(status=409))
+
+        self.assertFalse(self.sut.try_acquire_or_renew())
+
+    def test_requests_time_out_by_deadline(self):
+        self.api.read_namespaced_lease = MagicMock(return_value=make_lease('pod-a', 5))
+
+        self.sut.try_acquire_or_renew(time.monotonic() + 8)
+
+        self.assertAlmostEqual(8, self.api.read_namespaced_lease.call_args[1]['_request_timeout'], delta=1)
+        self.assertAlmostEqual(8, self.api.replace_namespaced_lease.call_args[1]['_request_timeout'], delta=1)
+
+    def test_other_errors_raise(self):
+        self.api.read_namespaced_lease = MagicMock(side_effect=ApiException(status=403))
+
+        with self.assertRaises(ApiException):
+            self.sut.try_acquire_or_renew()
+
+class TestRenewLoop(TestLeaderElector):
+    def setUp(self):
+        super().setUp()
+        self.lost = MagicMock()
+        self.sut = LeaderElector(self.api, 'kube-system', 'mylease', 'pod-a', lease_duration=2, renew_interval=0.01,
+                                    renew_deadline=0.2, on_lost=self.lost)
+        self.sut.is_leader = True
+
+    def test_steps_down_at_once_when_another_replica_holds_the_lease(self):
+        self.api.read_namespaced_lease = MagicMock(return_value=make_lease('pod-b', 0, duration=2))
+        start = time.monotonic()
+
+        self.sut._renew_loop()
+
+        self.assertLess(time.monotonic() - start, 0.2)
+        self.assertFalse(self.sut.is_leader)
+        self.lost.assert_called_once()
+
+    def test_steps_down_at_renew_deadline_when_renewals_fail(self):
+        self.api.read_namespaced_lease = MagicMock(side_effect=ApiException(status=500))
+        start = time.monotonic()
+
+        self.sut._renew_loop()
+
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertFalse(self.sut.is_leader)
+        self.lost.assert_called_once()
+
+class TestConstructor(TestLeaderElector):
+    def test_renew_slower_than_duration_throws_err(self):
+        with self.assertRaises(ValueError):
+            LeaderElector(self.api, 'kube-system', 'mylease', 'pod-a', lease_duration=5, renew_interval=10)
+
+    def test_renew_deadline_past_duration_throws_err(self):
+        with self.assertRaises(ValueError):
+            LeaderElector(self.api, 'kube-system', 'mylease', 'pod-a', lease_duration=15, renew_interval=5, renew_deadline=15)
+
+if __name__ == '__main__':
+    unittest.main()
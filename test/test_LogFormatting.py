@@ -0,0 +1,87 @@
+import json
+import logging
+import unittest
+from unittest.mock import MagicMock
+from RancherProjectManager import *
+
+class TestPayload(unittest.TestCase):
+    def tearDown(self):
+        Payload.max_chars = 2000
+
+    def test_renders_json(self):
+        self.assertEqual('{"data": [1, 2]}', str(Payload({ 'data': [1, 2] })))
+
+    def test_truncates_long_payloads(self):
+        Payload.max_chars = 10
+
+        text = str(Payload({ 'data': list(range(1000)) }))
+
+        self.assertEqual('{"data": [... (truncated)', text)
+
+    def test_truncates_bytes(self):
+        Payload.max_chars = 3
+
+        self.assertEqual('abc... (truncated)', str(Payload(b'abcdef')))
+
+    def test_zero_limit_renders_whole(self):
+        Payload.max_chars = 0
+
+        self.assertEqual(json.dumps(list(range(1000))), str(Payload(list(range(1000)))))
+
+    def test_not_rendered_unless_formatted(self):
+        data = MagicMock()
+        logging.getLogger('test.payloads').debug('payload %s', Payload(data))
+
+        data.__str__.assert_not_called()
+
+class TestSampleFilter(unittest.TestCase):
+    def test_passes_one_in_rate(self):
+        sut = SampleFilter(3)
+
+        results = [ sut.filter(None) for _ in range(7) ]
+
+        self.assertEqual([ True, False, False, True, False, False, True ], results)
+
+    def test_invalid_rate_throws_err(self):
+        with self.assertRaises(ValueError):
+            SampleFilter(0)
+
+class TestJsonFormatter(unittest.TestCase):
+    def test_formats_message_and_extras(self):
+        record = logging.LogRecord('mylogger', logging.INFO, 'file.py', 1, 'Hello %s', ('world',), None)
+        record.namespace = 'mynamespace'
+
+        entry = json.loads(JsonFormatter().format(record))
+
+        self.assertEqual('Hello world', entry['message'])
+        self.assertEqual('INFO', entry['level'])
+        self.assertEqual('mylogger', entry['logger'])
+        self.assertEqual('mynamespace', entry['namespace'])
+        self.assertNotIn('args', entry)
+
+    def test_includes_exception(self):
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            record = logging.LogRecord('mylogger', logging.ERROR, 'file.py', 1, 'failed', (), __import__('sys').exc_info())
+
+        entry = json.loads(JsonFormatter().format(record))
+
+        self.assertIn('ValueError: boom', entry['exception'])
+
+class TestRancherApiPayloadLogging(unittest.TestCase):
+    def test_payload_not_rendered_when_debug_off(self):
+        data = MagicMock()
+        response = MagicMock()
+        response.json = MagicMock(return_value=data)
+        session = MagicMock()
+        session.get = MagicMock(return_value=response)
+        logging.getLogger().setLevel(logging.INFO)
+
+        RancherApi('myaddress', 'mykey', 'mysecret', session=session)._get('mypath')
+
+        data.__str__.assert_not_called()
+        data.__iter__.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
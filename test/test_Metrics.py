@@ -0,0 +1,47 @@
+import unittest
+from RancherProjectManager import *
+
+class TestMetricsRegistry(unittest.TestCase):
+    def test_renders_prometheus_text(self):
+        sut = MetricsRegistry(prefix='rpm')
+        sut.register('requests_total', 'counter', 'Requests sent', lambda: { 'GET': 3, 'POST': 1 }, label='method')
+        sut.register('interval_seconds', 'gauge', 'Current interval', lambda: 1.5)
+
+        self.assertEqual('# HELP rpm_requests_total Requests sent\n'
+                         '# TYPE rpm_requests_total counter\n'
+                         'rpm_requests_total{method="GET"} 3\n'
+                         'rpm_requests_total{method="POST"} 1\n'
+                         '# HELP rpm_interval_seconds Current interval\n'
+                         '# TYPE rpm_interval_seconds gauge\n'
+                         'rpm_interval_seconds 1.5\n', sut.render())
+
+    def test_reads_values_at_render_time(self):
+        values = { 'count': 1 }
+        sut = MetricsRegistry(prefix='rpm')
+        sut.register('count', 'counter', 'A count', lambda: values['count'])
+        values['count'] = 5
+
+        self.assertIn('rpm_count 5\n', sut.render())
+
+    def test_escapes_label_values(self):
+        sut = MetricsRegistry(prefix='rpm')
+        sut.register('things', 'gauge', 'Things', lambda: { 'a"b': 1 }, label='name')
+
+        self.assertIn('rpm_things{name="a\\"b"} 1\n', sut.render())
+
+    def test_handle_serves_text(self):
+        sut = MetricsRegistry(prefix='rpm')
+        sut.register('count', 'counter', 'A count', lambda: 1)
+
+        status, content_type, body = sut.handle({})
+
+        self.assertEqual(200, status)
+        self.assertTrue(content_type.startswith('text/plain'))
+        self.assertIn(b'rpm_count 1\n', body)
+
+    def test_rejects_unknown_type(self):
+        with self.assertRaises(ValueError):
+            MetricsRegistry().register('x', 'histogram', 'X', lambda: 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+from kubernetes import config
+import os
+import tempfile
+import unittest
+import logging
+from unittest.mock import MagicMock, call, patch
+from RancherProjectManager import *
+from RancherProjectManager.MultiClusterManager import discover_contexts
+
+class TestMultiClusterManager(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.INFO, filename='/dev/null')
+
+    def setUp(self):
+        self.list_contexts = patch.object(config, 'list_kube_config_contexts').start()
+        self.new_client = patch.object(config, 'new_client_from_config').start()
+        self.addCleanup(patch.stopall)
+
+    def test_builds_one_controller_per_context(self):
+        self.list_contexts.return_value = ([ { 'name': 'east' }, { 'name': 'west' } ], None)
+        factory = MagicMock(side_effect=lambda kubeapi, cluster: MagicMock(cluster=cluster))
+
+        sut = MultiClusterManager(factory, '/my/kubeconfig', { 'east': 'c-east1' })
+
+        self.assertEqual(['east', 'west'], list(sut.controllers.keys()))
+        self.assertEqual('c-east1', sut.controllers['east'].cluster)
+        self.assertEqual('west', sut.controllers['west'].cluster)
+        self.new_client.assert_has_calls([call(config_file='/my/kubeconfig', context='east'),
+                                          call(config_file='/my/kubeconfig', context='west')])
+
+    def test_no_contexts_throws_err(self):
+        self.list_contexts.return_value = ([], None)
+
+        with self.assertRaises(ValueError):
+            MultiClusterManager(MagicMock(), '/my/kubeconfig')
+
+    def test_directory_reads_every_file_and_skips_duplicates(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name in [ 'a.yaml', 'b.yaml', '.hidden' ]:
+                open(os.path.join(directory, name), 'w').close()
+            self.list_contexts.side_effect = lambda config_file: {
+                os.path.join(directory, 'a.yaml'): ([ { 'name': 'east' } ], None),
+                os.path.join(directory, 'b.yaml'): ([ { 'name': 'east' }, { 'name': 'west' } ], None)
+            }[config_file]
+
+            contexts = discover_contexts(directory)
+
+            self.assertEqual([ (os.path.join(directory, 'a.yaml'), 'east'),
+                               (os.path.join(directory, 'b.yaml'), 'west') ], contexts)
+
+    def test_request_resync_reaches_every_controller(self):
+        self.list_contexts.return_value = ([ { 'name': 'east' }, { 'name': 'west' } ], None)
+        sut = MultiClusterManager(MagicMock(side_effect=lambda kubeapi, cluster: MagicMock()), '/my/kubeconfig')
+
+        sut.request_resync()
+
+        for controller in sut.controllers.values():
+            controller.request_resync.assert_called_once()
+
+    def test_failed_cluster_retries(self):
+        self.list_contexts.return_value = ([ { 'name': 'east' } ], None)
+        sut = MultiClusterManager(MagicMock(), '/my/kubeconfig', retry_delay=0)
+        controller = MagicMock()
+        controller.run = MagicMock(side_effect=[ RuntimeError('boom'), SystemExit ])
+
+        with self.assertRaises(SystemExit):
+            sut._run_cluster('east', controller)
+
+        self.assertEqual(2, controller.run.call_count)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import threading
+import unittest
+import logging
+from kubernetes.client.exceptions import ApiException
+from unittest.mock import MagicMock
+from RancherProjectManager import *
+
+def annotation_patch(key, value):
+    return { 'metadata': { 'annotations': { key: value } } }
+
+class TestNamespacePatcher(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.INFO, filename='/dev/null')
+
+    def setUp(self):
+        self.kubeapi = MagicMock()
+        self.sut = NamespacePatcher(self.kubeapi, workers=2)
+        self.addCleanup(self.sut.close)
+
+    def test_sends_patches(self):
+        self.sut.patch('ns1', annotation_patch('a', '1'))
+        self.sut.patch('ns2', annotation_patch('a', '2'))
+
+        self.assertTrue(self.sut.join(5))
+        self.assertEqual(2, self.kubeapi.patch_namespace.call_count)
+        self.kubeapi.patch_namespace.assert_any_call('ns1', annotation_patch('a', '1'))
+        self.assertEqual(2, self.sut.stats['namespace_patches_total'])
+        self.assertEqual(0, self.sut.pending())
+
+    def test_coalesces_waiting_patches_to_one_namespace(self):
+        # Holds the only worker on ns1, so both ns2 patches are still waiting when the second arrives
+        release = threading.Event()
+        self.kubeapi.patch_namespace.side_effect = lambda name, body: release.wait(5) if name == 'ns1' else None
+        sut = NamespacePatcher(self.kubeapi, workers=1)
+        self.addCleanup(sut.close)
+
+        sut.patch('ns1', annotation_patch('a', '1'))
+        sut.patch('ns2', annotation_patch('a', '1'))
+        sut.patch('ns2', annotation_patch('b', '2'))
+        release.set()
+
+        self.assertTrue(sut.join(5))
+        self.assertEqual(2, self.kubeapi.patch_namespace.call_count)
+        self.kubeapi.patch_namespace.assert_called_with('ns2', { 'metadata': { 'annotations': { 'a': '1', 'b': '2' } } })
+        self.assertEqual(1, sut.stats['namespace_patches_coalesced_total'])
+
+    def test_whole_objects_replace_rather_than_merge(self):
+        release = threading.Event()
+        self.kubeapi.patch_namespace.side_effect = lambda name, body: release.wait(5) if name == 'ns1' else None
+        sut = NamespacePatcher(self.kubeapi, workers=1)
+        self.addCleanup(sut.close)
+        first, second = MagicMock(), MagicMock()
+
+        sut.patch('ns1', {})
+        sut.patch('ns2', first)
+        sut.patch('ns2', second)
+        release.set()
+
+        self.assertTrue(sut.join(5))
+        self.kubeapi.patch_namespace.assert_called_with('ns2', second)
+
+    def test_throttled_by_rate_limiter(self):
+        limiter = MagicMock()
+        limiter.acquire = MagicMock(side_effect=[ 0.0, 0.25 ])
+        sut = NamespacePatcher(self.kubeapi, limiter, workers=1)
+        self.addCleanup(sut.close)
+
+        sut.patch('ns1', {})
+        sut.patch('ns2', {})
+
+        self.assertTrue(sut.join(5))
+        self.assertEqual(2, limiter.acquire.call_count)
+        self.assertEqual(1, sut.stats['namespace_patches_throttled_total'])
+        self.assertEqual(0.25, sut.stats['namespace_patch_throttled_seconds_total'])
+
+    def test_errors_are_counted_and_workers_carry_on(self):
+        self.kubeapi.patch_namespace.side_effect = [ ApiException(status=500), ApiException(status=404), RuntimeError('boom'), None ]
+        sut = NamespacePatcher(self.kubeapi, workers=1, max_retries=0)
+        self.addCleanup(sut.close)
+
+        for name in [ 'ns1', 'ns2', 'ns3', 'ns4' ]:
+            sut.patch(name, {})
+
+        self.assertTrue(sut.join(5))
+        self.assertEqual(4, sut.stats['namespace_patches_total'])
+        # A namespace deleted before its patch went out isn't an error
+        self.assertEqual(2, sut.stats['namespace_patch_errors_total'])
+
+    def test_failed_patches_are_retried_with_backoff(self):
+        self.kubeapi.patch_namespace.side_effect = [ ApiException(status=503), RuntimeError('connection reset'), None,
+                                                     ApiException(status=422) ]
+        patched = []
+        sut = NamespacePatcher(self.kubeapi, workers=1, retry_delay=0.01, on_patched=patched.append)
+        self.addCleanup(sut.close)
+
+        sut.patch('ns1', annotation_patch('a', '1'))
+        self.assertTrue(sut.join(5))
+        sut.patch('ns2', annotation_patch('a', '1'))
+        self.assertTrue(sut.join(5))
+
+        self.assertEqual(4, self.kubeapi.patch_namespace.call_count)
+        self.assertEqual(2, sut.stats['namespace_patch_retries_total'])
+        # Rejected outright, retrying wouldn't help
+        self.assertEqual(1, sut.stats['namespace_patch_errors_total'])
+        self.assertEqual([ 'ns1' ], patched)
+
+    def test_retry_goes_out_with_newer_patch(self):
+        retrying = threading.Event()
+        def patch_namespace(name, body):
+            if not retrying.is_set():
+                retrying.set()
+                raise ApiException(status=500)
+        self.kubeapi.patch_namespace.side_effect = patch_namespace
+        sut = NamespacePatcher(self.kubeapi, workers=1, retry_delay=0.2)
+        self.addCleanup(sut.close)
+
+        sut.patch('ns1', annotation_patch('a', '1'))
+        retrying.wait(5)
+        sut.patch('ns1', annotation_patch('b', '2'))
+
+        self.assertTrue(sut.join(5))
+        self.kubeapi.patch_namespace.assert_called_with('ns1', { 'metadata': { 'annotations': { 'a': '1', 'b': '2' } } })
+
+    def test_rejects_no_workers(self):
+        with self.assertRaises(ValueError):
+            NamespacePatcher(self.kubeapi, workers=0)
+
+if __name__ == '__main__':
+    unittest.main()
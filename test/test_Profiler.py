@@ -0,0 +1,65 @@
+import threading
+import tracemalloc
+import unittest
+import logging
+from RancherProjectManager import *
+
+def busy_focus(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+class TestProfiler(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.INFO, filename='/dev/null')
+
+    def setUp(self):
+        self.sut = Profiler(focus=[ busy_focus ], interval=0.001)
+
+    def test_cpu_profile_attributes_samples_to_focus_functions(self):
+        stop = threading.Event()
+        worker = threading.Thread(target=busy_focus, args=(stop,), name='busy')
+        worker.start()
+        try:
+            stacks, rounds = self.sut.cpu_profile(0.1)
+        finally:
+            stop.set()
+            worker.join()
+
+        self.assertGreater(rounds, 0)
+        self.assertTrue(any(stack.startswith('busy;') and 'busy_focus' in stack for stack in stacks))
+        report = self.sut.summarize(stacks, rounds, 0.1)
+        self.assertIn('busy_focus', report.split('Busiest stacks')[0])
+
+    def test_default_focus_covers_controller_and_rancher_api(self):
+        focus = set(Profiler().focus.values())
+
+        self.assertIn('RancherProjectManagement.process_namespace', focus)
+        self.assertIn('RancherProjectManagement.handle_project_role', focus)
+        self.assertIn('RancherApi.get_project_bindings', focus)
+
+    def test_heap_diff_leaves_tracing_as_it_found_it(self):
+        report = self.sut.heap_diff(0.01)
+
+        self.assertTrue(report.startswith('Heap grew by'))
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_handle_cpu_returns_attachment(self):
+        status, content_type, body, headers = self.sut.handle_cpu({ 'seconds': [ '0.01' ], 'format': [ 'collapsed' ] })
+
+        self.assertEqual(200, status)
+        self.assertRegex(headers['Content-Disposition'], r'attachment; filename=".*-cpu-profile.folded"')
+
+    def test_rejects_bad_durations(self):
+        self.assertEqual(400, self.sut.handle_cpu({ 'seconds': [ 'soon' ] })[0])
+        self.assertEqual(400, self.sut.handle_heap({ 'seconds': [ '3600' ] })[0])
+
+    def test_one_capture_at_a_time(self):
+        self.sut._capturing.acquire()
+        try:
+            self.assertEqual(409, self.sut.handle_heap({ 'seconds': [ '1' ] })[0])
+        finally:
+            self.sut._capturing.release()
+
+if __name__ == '__main__':
+    unittest.main()
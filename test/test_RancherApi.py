@@ -1,9 +1,12 @@
+import threading
 import unittest
+from collections import Counter
 from unittest.mock import MagicMock, call
 from io import BytesIO
 import requests
 import logging
 from RancherProjectManager import *
+from RancherProjectManager.RancherApi import binding_principal_id
 
 class TestRancherApi(unittest.TestCase):
     @classmethod
@@ -50,6 +53,95 @@ class Test_Get(TestRancherApi):
         with self.assertRaises(RancherResponseError):
             response = self.sut._get("mypath")
 
+    def test_uses_session_and_rate_limiter_when_given(self):
+        happy_response = requests.Response()
+        happy_response.status_code = 200
+        happy_response.raw = BytesIO(b"{\"data\":\"mydata\"}")
+        session = MagicMock()
+        session.get = MagicMock(return_value=happy_response)
+        limiter = MagicMock()
+        self.sut = RancherApi('myaddress', 'mykey', 'mysecret', session=session, rate_limiter=limiter)
+
+        response = self.sut._get('mypath')
+
+        self.assertEqual('mydata', response['data'])
+        session.get.assert_called_once_with('myaddressmypath', auth = ("mykey", "mysecret"))
+        limiter.acquire.assert_called_once()
+        requests.get.assert_not_called()
+
+class TestCountRequests(TestRancherApi):
+    def test_counts_only_this_threads_requests_in_the_block(self):
+        counted = Counter()
+
+        with self.sut.count_requests(counted):
+            self.sut._before_request('GET')
+            other = threading.Thread(target=self.sut._before_request, args=('GET',))
+            other.start()
+            other.join(5)
+        self.sut._before_request('POST')
+
+        self.assertEqual({ 'GET': 1 }, counted)
+        self.assertEqual({ 'GET': 2, 'POST': 1 }, self.sut.call_counts)
+        self.assertIsNone(self.sut.request_counter())
+
+class Test_GetConditional(TestRancherApi):
+    def setUp(self):
+        super().setUp()
+        self.sut.response_cache = ResponseCache()
+
+    def make_response(self, status_code, body=b'', headers=None):
+        response = requests.Response()
+        response.status_code = status_code
+        response.raw = BytesIO(body)
+        response.headers.update(headers or {})
+        return response
+
+    def test_revalidates_and_serves_cached_body_on_304(self):
+        requests.get = MagicMock(side_effect=[
+            self.make_response(200, b'{"data":"mydata"}', { 'ETag': '"v1"' }),
+            self.make_response(304)
+        ])
+
+        first = self.sut._get('mypath')
+        second = self.sut._get('mypath')
+
+        self.assertEqual('mydata', first['data'])
+        self.assertEqual('mydata', second['data'])
+        requests.get.assert_has_calls([
+            call('myaddressmypath', auth = ("mykey", "mysecret"), headers = {}),
+            call('myaddressmypath', auth = ("mykey", "mysecret"), headers = { 'If-None-Match': '"v1"' })
+        ])
+        self.assertEqual(1, self.sut.response_cache.hits)
+
+    def test_changed_resource_replaces_cached_body(self):
+        requests.get = MagicMock(side_effect=[
+            self.make_response(200, b'{"data":"old"}', { 'ETag': '"v1"' }),
+            self.make_response(200, b'{"data":"new"}', { 'ETag': '"v2"' })
+        ])
+
+        self.sut._get('mypath')
+        response = self.sut._get('mypath')
+
+        self.assertEqual('new', response['data'])
+        self.assertEqual({ 'If-None-Match': '"v2"' }, self.sut.response_cache.request_headers('myaddressmypath'))
+
+    def test_304_after_eviction_asks_again(self):
+        # Validators went out with the request, but the body is gone by the time the 304 comes back
+        self.sut.response_cache.request_headers = MagicMock(return_value={ 'If-None-Match': '"v1"' })
+        requests.get = MagicMock(side_effect=[ self.make_response(304), self.make_response(200, b'{"data":"new"}') ])
+
+        response = self.sut._get('mypath')
+
+        self.assertEqual('new', response['data'])
+        self.assertEqual(2, requests.get.call_count)
+        self.assertEqual(2, self.sut.call_counts['GET'])
+
+    def test_bad_json_raises_err(self):
+        requests.get = MagicMock(return_value=self.make_response(200, b'not json', { 'ETag': '"v1"' }))
+
+        with self.assertRaises(RancherResponseError):
+            self.sut._get('mypath')
+
 class Test_Post(TestRancherApi):
     def test_returns_data(self):
         happy_response = requests.Response()
@@ -124,6 +216,59 @@ class Test_Delete(TestRancherApi):
         with self.assertRaises(RancherResponseError):
             response = self.sut._delete("mypath")
 
+class TestListProjects(TestRancherApi):
+    def test_follows_pagination(self):
+        self.sut._get = MagicMock()
+        self.sut._get.side_effect = lambda x: {
+            '/projects?limit=1000':
+                { 'data': [ { 'id': 'p-1' } ], 'pagination': { 'next': 'myaddress/projects?limit=1000&marker=p-1' } },
+            '/projects?limit=1000&marker=p-1':
+                { 'data': [ { 'id': 'p-2' } ], 'pagination': { 'next': None } }
+            }[x]
+
+        response = self.sut.list_projects()
+
+        self.assertEqual([ { 'id': 'p-1' }, { 'id': 'p-2' } ], response)
+        self.assertEqual(2, self.sut._get.call_count)
+
+    def test_not_list_raises_err(self):
+        self.sut._get = MagicMock(return_value={ 'data': { 'id': 'p-1' } })
+
+        with self.assertRaises(RancherResponseError):
+            self.sut.list_projects()
+
+    def test_next_link_elsewhere_raises_err(self):
+        self.sut._get = MagicMock(return_value={ 'data': [], 'pagination': { 'next': 'https://elsewhere/projects' } })
+
+        with self.assertRaises(RancherResponseError):
+            self.sut.list_projects()
+
+    def test_counts_calls(self):
+        happy_response = requests.Response()
+        happy_response.status_code = 200
+        happy_response.raw = BytesIO(b"{\"data\":[]}")
+        requests.get = MagicMock(return_value=happy_response)
+
+        self.sut.list_projects()
+
+        self.assertEqual(1, self.sut.call_counts['GET'])
+
+class TestListProjectRoleBindings(TestRancherApi):
+    def test_follows_pagination_and_drops_unused_fields(self):
+        self.sut._get = MagicMock()
+        self.sut._get.side_effect = lambda x: {
+            '/projectroletemplatebindings?limit=1000':
+                { 'data': [ { 'id': 'b-1', 'projectId': 'c-1:p-1', 'links': {} } ],
+                  'pagination': { 'next': 'myaddress/projectroletemplatebindings?limit=1000&marker=b-1' } },
+            '/projectroletemplatebindings?limit=1000&marker=b-1':
+                { 'data': [ { 'id': 'b-2', 'projectId': 'c-1:p-2', 'userPrincipalId': 'local://u-1' } ] }
+            }[x]
+
+        response = self.sut.list_project_role_bindings()
+
+        self.assertEqual([ { 'id': 'b-1', 'projectId': 'c-1:p-1' },
+                           { 'id': 'b-2', 'projectId': 'c-1:p-2', 'userPrincipalId': 'local://u-1' } ], response)
+
 class TestGetProject(TestRancherApi):
     def test_calls_get_with_project_arg(self):
         project = { 'name': 'My Project', 'id': 'p-asd123' }
@@ -136,7 +281,28 @@ class TestGetProject(TestRancherApi):
 
         self.assertEqual(project, retVal)
         requests.get.assert_called_once()
-        requests.get.assert_called_with('myaddress/projects?name=My Project', auth = ("mykey", "mysecret"))
+        requests.get.assert_called_with('myaddress/projects?name=My%20Project&limit=1', auth = ("mykey", "mysecret"))
+
+    def test_scopes_to_cluster_and_encodes_name(self):
+        project_response = requests.Response()
+        project_response.status_code = 200
+        project_response.json = lambda: { 'data': [] }
+        requests.get = MagicMock(return_value=project_response)
+
+        self.assertIsNone(self.sut.get_project('R&D/tools', cluster_id='c-1'))
+
+        requests.get.assert_called_once_with('myaddress/projects?name=R%26D%2Ftools&clusterId=c-1&limit=1', auth = ("mykey", "mysecret"))
+
+    def test_drops_unused_fields(self):
+        project = { 'name': 'My Project', 'id': 'p-asd123', 'clusterId': 'c-1', 'links': { 'self': 'x' }, 'actions': {} }
+        project_response = requests.Response()
+        project_response.status_code = 200
+        project_response.json = lambda: { 'data': [ project ] }
+        requests.get = MagicMock(return_value=project_response)
+
+        retVal = self.sut.get_project('My Project')
+
+        self.assertEqual({ 'name': 'My Project', 'id': 'p-asd123', 'clusterId': 'c-1' }, retVal)
 
     def test_no_match_returns_none(self):
         empty_response = requests.Response()
@@ -148,7 +314,7 @@ class TestGetProject(TestRancherApi):
 
         self.assertEqual(None, retVal)
         requests.get.assert_called_once()
-        requests.get.assert_called_with('myaddress/projects?name=My Project', auth = ("mykey", "mysecret"))
+        requests.get.assert_called_with('myaddress/projects?name=My%20Project&limit=1', auth = ("mykey", "mysecret"))
 
     def test_multiple_match_returns_first(self):
         project = { 'name': 'My Project', 'id': 'p-asd123' }
@@ -162,7 +328,7 @@ class TestGetProject(TestRancherApi):
 
         self.assertEqual(project2, retVal)
         requests.get.assert_called_once()
-        requests.get.assert_called_with('myaddress/projects?name=My Project', auth = ("mykey", "mysecret"))
+        requests.get.assert_called_with('myaddress/projects?name=My%20Project&limit=1', auth = ("mykey", "mysecret"))
 
     def test_not_list_raises_err(self):
         project = { 'name': 'My Project', 'id': 'p-asd123' }
@@ -175,7 +341,41 @@ class TestGetProject(TestRancherApi):
             response = self.sut.get_project('My Project')
 
         requests.get.assert_called_once()
-        requests.get.assert_called_with('myaddress/projects?name=My Project', auth = ("mykey", "mysecret"))
+        requests.get.assert_called_with('myaddress/projects?name=My%20Project&limit=1', auth = ("mykey", "mysecret"))
+
+class TestGetProjectById(TestRancherApi):
+    def test_gets_project_directly(self):
+        project_response = requests.Response()
+        project_response.status_code = 200
+        project_response.json = lambda: { 'name': 'My Project', 'id': 'c-1:p-asd123', 'clusterId': 'c-1', 'links': {} }
+        requests.get = MagicMock(return_value=project_response)
+
+        retVal = self.sut.get_project_by_id('c-1:p-asd123')
+
+        self.assertEqual({ 'name': 'My Project', 'id': 'c-1:p-asd123', 'clusterId': 'c-1' }, retVal)
+        requests.get.assert_called_once_with('myaddress/projects/c-1%3Ap-asd123', auth = ("mykey", "mysecret"))
+
+    def test_missing_returns_none(self):
+        missing_response = requests.Response()
+        missing_response.status_code = 404
+        requests.get = MagicMock(return_value=missing_response)
+
+        self.assertIsNone(self.sut.get_project_by_id('c-1:p-asd123'))
+
+    def test_forbidden_returns_none(self):
+        denied_response = requests.Response()
+        denied_response.status_code = 403
+        requests.get = MagicMock(return_value=denied_response)
+
+        self.assertIsNone(self.sut.get_project_by_id('c-1:p-asd123'))
+
+    def test_other_errors_raise(self):
+        failed_response = requests.Response()
+        failed_response.status_code = 500
+        requests.get = MagicMock(return_value=failed_response)
+
+        with self.assertRaises(requests.HTTPError):
+            self.sut.get_project_by_id('c-1:p-asd123')
 
 class TestCreateProject(TestRancherApi):
     def test_none_name_raises_err(self):
@@ -209,7 +409,7 @@ class TestCreateProject(TestRancherApi):
             response = self.sut.create_project('My Project', 'My nonexistant cluster')
 
         requests.get.assert_called_once()
-        requests.get.assert_called_with('myaddress/cluster?id=My nonexistant cluster', auth = ("mykey", "mysecret"))
+        requests.get.assert_called_with('myaddress/cluster?id=My%20nonexistant%20cluster&limit=1', auth = ("mykey", "mysecret"))
         requests.post.assert_not_called()
 
     def test_cluster_malformed_raises_err(self):
@@ -223,7 +423,7 @@ class TestCreateProject(TestRancherApi):
             response = self.sut.create_project('My Project', 'My cluster')
 
         requests.get.assert_called_once()
-        requests.get.assert_called_with('myaddress/cluster?id=My cluster', auth = ("mykey", "mysecret"))
+        requests.get.assert_called_with('myaddress/cluster?id=My%20cluster&limit=1', auth = ("mykey", "mysecret"))
         requests.post.assert_not_called()
 
     def test_permission_denied_raises_err(self):
@@ -239,7 +439,7 @@ class TestCreateProject(TestRancherApi):
             response = self.sut.create_project('My Project', 'My cluster')
 
         requests.get.assert_called_once()
-        requests.get.assert_called_with('myaddress/cluster?id=My cluster', auth = ("mykey", "mysecret"))
+        requests.get.assert_called_with('myaddress/cluster?id=My%20cluster&limit=1', auth = ("mykey", "mysecret"))
         requests.post.assert_called_once()
         requests.post.assert_called_with('myaddress/projects', auth = ("mykey", "mysecret"),
                                             json = { 'name': 'My Project', 'clusterId': 'c-137' })
@@ -257,7 +457,7 @@ class TestCreateProject(TestRancherApi):
             response = self.sut.create_project('My Project', 'My cluster')
 
         requests.get.assert_called_once()
-        requests.get.assert_called_with('myaddress/cluster?id=My cluster', auth = ("mykey", "mysecret"))
+        requests.get.assert_called_with('myaddress/cluster?id=My%20cluster&limit=1', auth = ("mykey", "mysecret"))
         requests.post.assert_called_once()
         requests.post.assert_called_with('myaddress/projects', auth = ("mykey", "mysecret"),
                                             json = { 'name': 'My Project', 'clusterId': 'c-137' })
@@ -275,13 +475,43 @@ class TestCreateProject(TestRancherApi):
         response = self.sut.create_project('My Project', 'My cluster')
 
         requests.get.assert_called_once()
-        requests.get.assert_called_with('myaddress/cluster?id=My cluster', auth = ("mykey", "mysecret"))
+        requests.get.assert_called_with('myaddress/cluster?id=My%20cluster&limit=1', auth = ("mykey", "mysecret"))
         requests.post.assert_called_once()
         requests.post.assert_called_with('myaddress/projects', auth = ("mykey", "mysecret"),
                                             json = { 'name': 'My Project', 'clusterId': 'c-137' })
 
         self.assertEqual(response['id'], 'p-123abc')
 
+    def test_looks_up_each_cluster_once(self):
+        cluster_response = requests.Response()
+        cluster_response.status_code = 200
+        cluster_response.json = lambda: { 'data': [ { "id": "c-137" } ] }
+        project_response = requests.Response()
+        project_response.status_code = 200
+        project_response.json = lambda: { "id": "p-123abc" }
+        requests.get = MagicMock(return_value=cluster_response)
+        requests.post = MagicMock(return_value=project_response)
+
+        self.sut.create_project('My Project', 'My cluster')
+        self.sut.create_project('My Other Project', 'My cluster')
+
+        requests.get.assert_called_once_with('myaddress/cluster?id=My%20cluster&limit=1', auth = ("mykey", "mysecret"))
+        requests.post.assert_called_with('myaddress/projects', auth = ("mykey", "mysecret"),
+                                            json = { 'name': 'My Other Project', 'clusterId': 'c-137' })
+
+    def test_missing_cluster_is_looked_up_again(self):
+        empty_response = requests.Response()
+        empty_response.status_code = 200
+        empty_response.json = lambda: { 'data': [] }
+        requests.get = MagicMock(return_value=empty_response)
+        requests.post = MagicMock()
+
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                self.sut.create_project('My Project', 'My cluster')
+
+        self.assertEqual(2, requests.get.call_count)
+
 class TestSearchPrincipal(TestRancherApi):
     def test_retrieve_user(self):
         self.sut._post = MagicMock(return_value={ 'data': [
@@ -322,186 +552,41 @@ class TestSearchPrincipal(TestRancherApi):
 
         self.sut._post.assert_not_called()
 
-class TestGetProjectMembers(TestRancherApi):
-    def test_gets_members(self):
-        self.sut._get = MagicMock()
-        self.sut._get.side_effect = lambda x: {
-            '/projectroletemplatebindings?projectId=p-abc123&roleTemplateId=my-role':
-                { 'data': [ { 'groupPrincipalId': 'developers', 'userPrincipalId': None },
-                            { 'groupPrincipalId': None, 'userPrincipalId': 'jdoe' }]},
-            '/principals/jdoe':
-                { 'id': 'jdoe', 'name': 'Jane Doe', 'principalType': 'user' },
-            '/principals/developers':
-                { 'id': 'developers', 'name': 'Developers', 'principalType': 'group' }
-            }[x]
-
-        response = self.sut.get_project_members('p-abc123', 'my-role')
+class TestGetProjectBindings(TestRancherApi):
+    def test_lists_every_role_at_once(self):
+        self.sut._get = MagicMock(return_value={ 'data': [
+            { 'id': 'p-abc123:b-1', 'roleTemplateId': 'project-owner', 'userPrincipalId': 'local://jdoe', 'links': {} },
+            { 'id': 'p-abc123:b-2', 'roleTemplateId': 'read-only', 'groupPrincipalId': 'ldap://devs' }
+        ] })
 
-        self.assertEqual(3, self.sut._get.call_count)
-        self.sut._get.assert_has_calls([
-            call('/projectroletemplatebindings?projectId=p-abc123&roleTemplateId=my-role'),
-            call('/principals/developers'),
-            call('/principals/jdoe')])
-        self.assertEqual(2, len(response))
-        self.assertEqual('developers', response[0].id)
-        self.assertEqual('Developers', response[0].name)
-        self.assertEqual('group', response[0].type)
-        self.assertEqual(True, response[0].is_group)
-        self.assertEqual('jdoe', response[1].id)
-        self.assertEqual('Jane Doe', response[1].name)
-        self.assertEqual('user', response[1].type)
-        self.assertEqual(False, response[1].is_group)
+        response = self.sut.get_project_bindings('p-abc123')
 
-    def test_no_members_returns_empty_list(self):
-        self.sut._get = MagicMock(return_value={ 'data': []})
-
-        response = self.sut.get_project_members('p-abc123', 'my-role')
-
-        self.sut._get.assert_called_once()
-        self.sut._get.assert_called_with('/projectroletemplatebindings?projectId=p-abc123&roleTemplateId=my-role')
-        self.assertEqual(0, len(response))
-
-    def test_malformed_member_throws_err(self):
-        self.sut._get = MagicMock(return_value={ 'data': [{ 'bad data': 'bad value' }]})
-
-        with self.assertRaises(RancherResponseError):
-            response = self.sut.get_project_members('p-abc123', 'my-role')
+        self.sut._get.assert_called_once_with('/projectroletemplatebindings?projectId=p-abc123&limit=1000')
+        self.assertEqual([ 'local://jdoe', 'ldap://devs' ], [ binding_principal_id(binding) for binding in response ])
+        self.assertNotIn('links', response[0])
 
-        self.sut._get.assert_called_once()
-        self.sut._get.assert_called_with('/projectroletemplatebindings?projectId=p-abc123&roleTemplateId=my-role')
-    
-    def test_none_project_throws_err(self):
+class TestCreateProjectBinding(TestRancherApi):
+    def test_posts_without_checking_first(self):
         self.sut._get = MagicMock()
-
-        with self.assertRaises(TypeError):
-            response = self.sut.get_project_members(None, 'my-role')
-
-        with self.assertRaises(TypeError):
-            response = self.sut.get_project_members('p-abc123', None)
-
-        self.sut._get.assert_not_called()
-
-class TestAddProjectMember(TestRancherApi):
-    def test_add_new_member_checks_and_adds(self):
-        resp = { 'data', 'value' }
-        self.sut._get = MagicMock(return_value={ 'data': [] })
-        self.sut._post = MagicMock(return_value=resp)
-        jane = RancherPrincipal({ 'id': 'jdoe', 'name': 'Jane Doe', 'principalType': 'user' })
-
-        response = self.sut.add_project_member('p-abc123', 'my-role', jane)
-
-        self.sut._get.assert_called_once()
-        self.sut._get.assert_called_with('/projectroletemplatebindings?userPrincipalId=jdoe&projectId=p-abc123&roleTemplateId=my-role')
-        self.sut._post.assert_called_once()
-        self.sut._post.assert_called_with('/projectroletemplatebindings', {
-                                'projectId': 'p-abc123', 
-                                'userPrincipalId': 'jdoe',
-                                'roleTemplateId': 'my-role' })
-        self.assertEqual(resp, response)
-
-    def test_add_new_group_member_checks_and_adds(self):
-        resp = { 'data', 'value' }
-        self.sut._get = MagicMock(return_value={ 'data': [] })
-        self.sut._post = MagicMock(return_value=resp)
+        self.sut._post = MagicMock(return_value={ 'id': 'p-abc123:b-1', 'roleTemplateId': 'my-role', 'groupPrincipalId': 'developers', 'type': 'x' })
         devs = RancherPrincipal({ 'id': 'developers', 'name': 'Developers', 'principalType': 'group' })
 
-        response = self.sut.add_project_member('p-abc123', 'my-role', devs)
+        response = self.sut.create_project_binding('p-abc123', 'my-role', devs)
 
-        self.sut._get.assert_called_once()
-        self.sut._get.assert_called_with('/projectroletemplatebindings?groupPrincipalId=developers&projectId=p-abc123&roleTemplateId=my-role')
-        self.sut._post.assert_called_once()
-        self.sut._post.assert_called_with('/projectroletemplatebindings', {
-                                'projectId': 'p-abc123', 
+        self.sut._get.assert_not_called()
+        self.sut._post.assert_called_once_with('/projectroletemplatebindings', {
+                                'projectId': 'p-abc123',
                                 'groupPrincipalId': 'developers',
                                 'roleTemplateId': 'my-role' })
-        self.assertEqual(resp, response)
-
-    def test_member_already_present_does_nothing(self):
-        self.sut._get = MagicMock(return_value={ 'data': [ { 'userPrincipalId': 'jdoe' } ] })
-        self.sut._post = MagicMock()
-        jane = RancherPrincipal({ 'id': 'jdoe', 'name': 'Jane Doe', 'principalType': 'user' })
-
-        response = self.sut.add_project_member('p-abc123', 'my-role', jane)
-
-        self.sut._get.assert_called_once()
-        self.sut._get.assert_called_with('/projectroletemplatebindings?userPrincipalId=jdoe&projectId=p-abc123&roleTemplateId=my-role')
-        self.sut._post.assert_not_called()
-
-    def test_args_none_throws_err(self):
-        self.sut._get = MagicMock()
-        self.sut._post = MagicMock()
-        jane = RancherPrincipal({ 'id': 'jdoe', 'name': 'Jane Doe', 'principalType': 'user' })
-
-        with self.assertRaises(TypeError):
-            response = self.sut.add_project_member(None, 'my-role', jane)
-
-        with self.assertRaises(TypeError):
-            response = self.sut.add_project_member('p-123abc', None, jane)
-
-        with self.assertRaises(TypeError):
-            response = self.sut.add_project_member('p-123abc', 'my-role', None)
-        
-        self.sut._get.assert_not_called()
-        self.sut._post.assert_not_called()
-
-        
-class TestRemoveProjectMember(TestRancherApi):
-    def test_remove_member_checks_and_removes(self):
-        resp = { 'data', 'value' }
-        self.sut._get = MagicMock(return_value={ 'data': [ { 'id': 'ptrb-xyz' } ] })
-        self.sut._delete = MagicMock(return_value=resp)
-        jane = RancherPrincipal({ 'id': 'jdoe', 'name': 'Jane Doe', 'principalType': 'user' })
-
-        response = self.sut.remove_project_member('p-abc123', 'my-role', jane)
-
-        self.sut._get.assert_called_once()
-        self.sut._get.assert_called_with('/projectroletemplatebindings?userPrincipalId=jdoe&projectId=p-abc123&roleTemplateId=my-role')
-        self.sut._delete.assert_called_once()
-        self.sut._delete.assert_called_with('/projectroletemplatebindings/ptrb-xyz')
-        self.assertEqual(resp, response)
-
-    def test_remove_group_member_checks_and_removes(self):
-        resp = { 'data', 'value' }
-        self.sut._get = MagicMock(return_value={ 'data': [ { 'id': 'ptrb-xyz' } ] })
-        self.sut._delete = MagicMock(return_value=resp)
-        devs = RancherPrincipal({ 'id': 'developers', 'name': 'Developers', 'principalType': 'group' })
-
-        response = self.sut.remove_project_member('p-abc123', 'my-role', devs)
-
-        self.sut._get.assert_called_once()
-        self.sut._get.assert_called_with('/projectroletemplatebindings?groupPrincipalId=developers&projectId=p-abc123&roleTemplateId=my-role')
-        self.sut._delete.assert_called_once()
-        self.sut._delete.assert_called_with('/projectroletemplatebindings/ptrb-xyz')
-        self.assertEqual(resp, response)
-
-    def test_member_not_present_does_nothing(self):
-        self.sut._get = MagicMock(return_value={ 'data': [] })
-        self.sut._delete = MagicMock()
-        jane = RancherPrincipal({ 'id': 'jdoe', 'name': 'Jane Doe', 'principalType': 'user' })
-
-        response = self.sut.remove_project_member('p-abc123', 'my-role', jane)
+        self.assertEqual({ 'id': 'p-abc123:b-1', 'roleTemplateId': 'my-role', 'groupPrincipalId': 'developers' }, response)
 
-        self.sut._get.assert_called_once()
-        self.sut._get.assert_called_with('/projectroletemplatebindings?userPrincipalId=jdoe&projectId=p-abc123&roleTemplateId=my-role')
-        self.sut._delete.assert_not_called()
+class TestDeleteProjectBinding(TestRancherApi):
+    def test_deletes_by_id(self):
+        self.sut._delete = MagicMock(return_value={})
 
-    def test_args_none_throws_err(self):
-        self.sut._get = MagicMock()
-        self.sut._delete = MagicMock()
-        jane = RancherPrincipal({ 'id': 'jdoe', 'name': 'Jane Doe', 'principalType': 'user' })
-
-        with self.assertRaises(TypeError):
-            response = self.sut.remove_project_member(None, 'my-role', jane)
-
-        with self.assertRaises(TypeError):
-            response = self.sut.remove_project_member('p-123abc', None, jane)
-
-        with self.assertRaises(TypeError):
-            response = self.sut.remove_project_member('p-123abc', 'my-role', None)
-        
-        self.sut._get.assert_not_called()
-        self.sut._delete.assert_not_called()
+        self.sut.delete_project_binding('p-abc123:b-1')
 
+        self.sut._delete.assert_called_once_with('/projectroletemplatebindings/p-abc123%3Ab-1')
 
 if __name__ == '__main__':
     unittest.main()
@@ -2,10 +2,23 @@ from kubernetes import config, watch
 from kubernetes.client.models.v1_namespace import V1Namespace
 from kubernetes.client.models.v1_object_meta import V1ObjectMeta
 from kubernetes.client.models.v1_namespace_list import V1NamespaceList
+from kubernetes.client.models.v1_list_meta import V1ListMeta
+from kubernetes.client.exceptions import ApiException
+import threading
+import time
 import unittest
+import urllib3
 import logging
-from unittest.mock import MagicMock, call
+import requests
+from unittest.mock import MagicMock, call, patch
+from collections import Counter
 from RancherProjectManager import *
+from RancherProjectManager.RancherProjectManagement import as_record
+from RancherProjectManager.WorkQueue import HIGH, LOW
+
+def make_binding(binding_id, rolename, principal, project_id='p-123abc'):
+    id_key = 'groupPrincipalId' if principal.is_group else 'userPrincipalId'
+    return { 'id': binding_id, 'projectId': project_id, 'roleTemplateId': rolename, id_key: principal.id }
 
 class TestRancherProjectManagement(unittest.TestCase):
     @classmethod
@@ -16,6 +29,7 @@ class TestRancherProjectManagement(unittest.TestCase):
         config.load_kube_config = MagicMock()
         watch.Watch = MagicMock()
         self.rancherMock = MagicMock()
+        self.rancherMock.get_cluster_id = MagicMock(side_effect=lambda cluster: f'c-{cluster}')
         self.sut = RancherProjectManagement(self.rancherMock,
                 'project-name-annotation',
                 'project-id-annotation',
@@ -46,7 +60,7 @@ class TestProcessNamespace(TestRancherProjectManagement):
         self.sut.process_namespace(namespace)
 
         self.rancherMock.get_project.assert_called_once()
-        self.rancherMock.get_project.assert_called_with('my project')
+        self.rancherMock.get_project.assert_called_with('my project', 'c-default-cluster')
         self.rancherMock.create_project.assert_not_called()
         self.sut.kubeapi.patch_namespace.assert_not_called()
 
@@ -59,7 +73,7 @@ class TestProcessNamespace(TestRancherProjectManagement):
         self.sut.process_namespace(namespace)
 
         self.rancherMock.get_project.assert_called_once()
-        self.rancherMock.get_project.assert_called_with('my project')
+        self.rancherMock.get_project.assert_called_with('my project', 'c-default-cluster')
         self.rancherMock.create_project.assert_not_called()
         self.sut.kubeapi.patch_namespace.assert_called_once()
         self.sut.kubeapi.patch_namespace.assert_called_with('mynamespace', namespace)
@@ -86,8 +100,9 @@ class TestProcessNamespace(TestRancherProjectManagement):
 
         self.sut.process_namespace(namespace)
 
-        self.rancherMock.get_project.assert_called_once()
-        self.rancherMock.get_project.assert_called_with('my project')
+        # Once by the namespace, then again under the project's lock before creating
+        self.assertEqual(2, self.rancherMock.get_project.call_count)
+        self.rancherMock.get_project.assert_called_with('my project', 'c-default-cluster')
         self.rancherMock.create_project.assert_called_once()
         self.rancherMock.create_project.assert_called_with('my project', 'default-cluster')
         self.sut.kubeapi.patch_namespace.assert_called_once()
@@ -105,13 +120,64 @@ class TestProcessNamespace(TestRancherProjectManagement):
         self.sut.process_namespace(namespace)
 
         self.rancherMock.get_project.assert_called_once()
-        self.rancherMock.get_project.assert_called_with('my project')
+        self.rancherMock.get_project.assert_called_with('my project', 'c-default-cluster')
         self.rancherMock.create_project.assert_not_called()
         self.sut.kubeapi.patch_namespace.assert_called_once()
         self.sut.kubeapi.patch_namespace.assert_called_with('mynamespace', namespace)
 
         self.assertEqual(namespace.metadata.annotations['project-id-annotation'], 'p-123abc')
 
+    def test_pid_annotation_checked_by_id_skips_name_search(self):
+        namespace = V1Namespace(metadata=V1ObjectMeta(name='mynamespace', annotations={
+            'project-name-annotation': 'my project',
+            'project-id-annotation': 'p-123abc'
+        }))
+        self.rancherMock.get_project_by_id = MagicMock(return_value={ 'id': 'p-123abc', 'name': 'my project', 'clusterId': 'c-default-cluster' })
+
+        self.sut.process_namespace(namespace)
+
+        self.rancherMock.get_project_by_id.assert_called_once_with('p-123abc')
+        self.rancherMock.get_project.assert_not_called()
+        self.sut.kubeapi.patch_namespace.assert_not_called()
+
+    def test_pid_of_other_project_falls_back_to_name_search(self):
+        namespace = V1Namespace(metadata=V1ObjectMeta(name='mynamespace', annotations={
+            'project-name-annotation': 'my project',
+            'project-id-annotation': 'p-987xyz'
+        }))
+        self.rancherMock.get_project_by_id = MagicMock(return_value={ 'id': 'p-987xyz', 'name': 'other project' })
+        self.rancherMock.get_project = MagicMock(return_value={ 'id': 'p-123abc' })
+
+        self.sut.process_namespace(namespace)
+
+        self.rancherMock.get_project.assert_called_once_with('my project', 'c-default-cluster')
+        self.assertEqual(namespace.metadata.annotations['project-id-annotation'], 'p-123abc')
+
+    def test_pid_of_deleted_project_falls_back_to_name_search(self):
+        namespace = V1Namespace(metadata=V1ObjectMeta(name='mynamespace', annotations={
+            'project-name-annotation': 'my project',
+            'project-id-annotation': 'p-987xyz'
+        }))
+        self.rancherMock.get_project_by_id = MagicMock(return_value=None)
+        self.rancherMock.get_project = MagicMock(return_value=None)
+        self.rancherMock.create_project = MagicMock(return_value={ 'id': 'p-123abc' })
+
+        self.sut.process_namespace(namespace)
+
+        self.rancherMock.get_project.assert_called_with('my project', 'c-default-cluster')
+        self.rancherMock.create_project.assert_called_once_with('my project', 'default-cluster')
+        self.assertEqual(namespace.metadata.annotations['project-id-annotation'], 'p-123abc')
+
+    def test_no_pid_annotation_skips_id_lookup(self):
+        namespace = V1Namespace(metadata=V1ObjectMeta(name='mynamespace', annotations={
+            'project-name-annotation': 'my project'
+        }))
+        self.rancherMock.get_project = MagicMock(return_value={ 'id': 'p-123abc' })
+
+        self.sut.process_namespace(namespace)
+
+        self.rancherMock.get_project_by_id.assert_not_called()
+
     def test_special_cluster_creates_project_in_special_cluster(self):
         namespace = V1Namespace(metadata=V1ObjectMeta(name='mynamespace', annotations={
             'project-name-annotation': 'my project',
@@ -122,8 +188,9 @@ class TestProcessNamespace(TestRancherProjectManagement):
 
         self.sut.process_namespace(namespace)
 
-        self.rancherMock.get_project.assert_called_once()
-        self.rancherMock.get_project.assert_called_with('my project')
+        # Once by the namespace, then again under the project's lock before creating
+        self.assertEqual(2, self.rancherMock.get_project.call_count)
+        self.rancherMock.get_project.assert_called_with('my project', 'c-my-other-cluster')
         self.rancherMock.create_project.assert_called_once()
         self.rancherMock.create_project.assert_called_with('my project', 'my-other-cluster')
         self.sut.kubeapi.patch_namespace.assert_called_once()
@@ -137,13 +204,13 @@ class TestProcessNamespace(TestRancherProjectManagement):
             'project-id-annotation': 'p-123abc'
         }))
         self.rancherMock.get_project = MagicMock(return_value={ 'id': 'p-123abc' })
-        self.sut.handle_project_role = MagicMock()
+        self.sut.handle_project_roles = MagicMock()
 
         self.sut.process_namespace(namespace)
 
         self.rancherMock.get_project.assert_called_once()
-        self.rancherMock.get_project.assert_called_with('my project')
-        self.sut.handle_project_role.assert_not_called()
+        self.rancherMock.get_project.assert_called_with('my project', 'c-default-cluster')
+        self.sut.handle_project_roles.assert_not_called()
 
     def test_owner_annotations_handles_owners(self):
         namespace = V1Namespace(metadata=V1ObjectMeta(name='mynamespace', annotations={
@@ -152,13 +219,13 @@ class TestProcessNamespace(TestRancherProjectManagement):
             'owners-annotation': 'jdoe,ssmith'
         }))
         self.rancherMock.get_project = MagicMock(return_value={ 'id': 'p-123abc' })
-        self.sut.handle_project_role = MagicMock()
+        self.sut.handle_project_roles = MagicMock()
 
         self.sut.process_namespace(namespace)
 
         self.rancherMock.get_project.assert_called_once()
-        self.rancherMock.get_project.assert_called_with('my project')
-        self.sut.handle_project_role.assert_called_with('mynamespace', 'p-123abc', 'project-owner', ['jdoe','ssmith'])
+        self.rancherMock.get_project.assert_called_with('my project', 'c-default-cluster')
+        self.sut.handle_project_roles.assert_called_with('mynamespace', 'p-123abc', { 'project-owner': ['jdoe','ssmith'] })
 
     def test_workloaders_annotations_handles_workloaders(self):
         namespace = V1Namespace(metadata=V1ObjectMeta(name='mynamespace', annotations={
@@ -167,29 +234,88 @@ class TestProcessNamespace(TestRancherProjectManagement):
             'workloaders-annotation': 'jdoe,ssmith'
         }))
         self.rancherMock.get_project = MagicMock(return_value={ 'id': 'p-123abc' })
-        self.sut.handle_project_role = MagicMock()
+        self.sut.handle_project_roles = MagicMock()
 
         self.sut.process_namespace(namespace)
 
         self.rancherMock.get_project.assert_called_once()
-        self.rancherMock.get_project.assert_called_with('my project')
-        self.sut.handle_project_role.assert_called_with('mynamespace', 'p-123abc', 'workloads-manage', ['jdoe','ssmith'])
+        self.rancherMock.get_project.assert_called_with('my project', 'c-default-cluster')
+        self.sut.handle_project_roles.assert_called_with('mynamespace', 'p-123abc', { 'workloads-manage': ['jdoe','ssmith'] })
+
+    def test_mapped_annotations_handled_together(self):
+        namespace = V1Namespace(metadata=V1ObjectMeta(name='mynamespace', annotations={
+            'project-name-annotation': 'my project',
+            'project-id-annotation': 'p-123abc',
+            'owners-annotation': 'jdoe',
+            'workloaders-annotation': 'ssmith',
+            'viewers-annotation': 'auditors',
+            'unmapped-annotation': 'someone'
+        }))
+        self.sut.role_annotations['viewers-annotation'] = 'read-only'
+        self.rancherMock.get_project = MagicMock(return_value={ 'id': 'p-123abc' })
+        self.sut.handle_project_roles = MagicMock()
+
+        self.sut.process_namespace(namespace)
+
+        self.sut.handle_project_roles.assert_called_once_with('mynamespace', 'p-123abc', {
+            'project-owner': ['jdoe'], 'workloads-manage': ['ssmith'], 'read-only': ['auditors'] })
+
+    def test_project_owned_by_other_shard_skips(self):
+        namespace = V1Namespace(metadata=V1ObjectMeta(name='mynamespace', annotations={
+            'project-name-annotation': 'my project'
+        }))
+        self.sut.shard = MagicMock()
+        self.sut.shard.owns = MagicMock(return_value=False)
+
+        self.sut.process_namespace(namespace)
+
+        self.sut.shard.owns.assert_called_with('my project')
+        self.rancherMock.get_project.assert_not_called()
+        self.sut.kubeapi.patch_namespace.assert_not_called()
+
+    def test_project_owned_by_this_shard_processes(self):
+        namespace = V1Namespace(metadata=V1ObjectMeta(name='mynamespace', annotations={
+            'project-name-annotation': 'my project'
+        }))
+        self.sut.shard = MagicMock()
+        self.sut.shard.owns = MagicMock(return_value=True)
+        self.rancherMock.get_project = MagicMock(return_value={ 'id': 'p-123abc' })
+
+        self.sut.process_namespace(namespace)
+
+        self.rancherMock.get_project.assert_called_with('my project', 'c-default-cluster')
+        self.sut.kubeapi.patch_namespace.assert_called_once()
+
+    def test_record_patches_only_project_id_annotation(self):
+        namespace = NamespaceRecord('mynamespace', { 'project-name-annotation': 'my project' }, '12')
+        self.rancherMock.get_project = MagicMock(return_value={ 'id': 'p-123abc' })
+
+        self.sut.process_namespace(namespace)
+
+        self.sut.kubeapi.patch_namespace.assert_called_once_with('mynamespace',
+                { 'metadata': { 'annotations': { 'project-id-annotation': 'p-123abc' } } })
+
+    def test_record_without_annotations_noop(self):
+        self.sut.process_namespace(NamespaceRecord('mynamespace', {}))
+
+        self.rancherMock.get_project.assert_not_called()
+        self.sut.kubeapi.patch_namespace.assert_not_called()
 
 class TestHandleProjectRole(TestRancherProjectManagement):
     def test_new_owner_adds_owner(self):
         jane = RancherPrincipal({ 'id': 'jdoe', 'name': 'Jane Doe', 'principalType': 'user' })
-        self.rancherMock.get_project_members = MagicMock(return_value=[])
+        self.rancherMock.get_project_bindings = MagicMock(return_value=[])
         self.rancherMock.search_principal = MagicMock(return_value=jane)
-        self.rancherMock.add_project_member = MagicMock()
+        self.rancherMock.create_project_binding = MagicMock()
 
         self.sut.handle_project_role('mynamespace', 'p-123abc', 'my-role', ['jdoe'])
 
-        self.rancherMock.get_project_members.assert_called_once()
-        self.rancherMock.get_project_members.assert_called_with('p-123abc', 'my-role')
+        self.rancherMock.get_project_bindings.assert_called_once()
+        self.rancherMock.get_project_bindings.assert_called_with('p-123abc')
         self.rancherMock.search_principal.assert_called_once()
         self.rancherMock.search_principal.assert_called_with('jdoe')
-        self.rancherMock.add_project_member.assert_called_once()
-        self.rancherMock.add_project_member.assert_called_with('p-123abc', 'my-role', jane)
+        self.rancherMock.create_project_binding.assert_called_once()
+        self.rancherMock.create_project_binding.assert_called_with('p-123abc', 'my-role', jane)
 
 
     def test_second_owner_adds_new(self):
@@ -197,17 +323,17 @@ class TestHandleProjectRole(TestRancherProjectManagement):
         alex = RancherPrincipal({ 'id': 'aaardvark', 'name': 'Alex Aardvark', 'principalType': 'user' })
         self.rancherMock.search_principal = MagicMock()
         self.rancherMock.search_principal.side_effect = lambda x: jane if x == 'jdoe' else alex if x == 'aaardvark' else None
-        self.rancherMock.get_project_members = MagicMock(return_value=[ jane ])
-        self.rancherMock.add_project_member = MagicMock()
+        self.rancherMock.get_project_bindings = MagicMock(return_value=[ make_binding('b-1', 'my-role', jane) ])
+        self.rancherMock.create_project_binding = MagicMock()
 
         self.sut.handle_project_role('mynamespace', 'p-123abc', 'my-role', [ 'jdoe', 'aaardvark' ])
 
-        self.rancherMock.get_project_members.assert_called_once()
-        self.rancherMock.get_project_members.assert_called_with('p-123abc', 'my-role')
+        self.rancherMock.get_project_bindings.assert_called_once()
+        self.rancherMock.get_project_bindings.assert_called_with('p-123abc')
         self.assertEqual(self.rancherMock.search_principal.call_count, 2)
         self.rancherMock.search_principal.assert_has_calls([call('jdoe'), call('aaardvark')])
-        self.rancherMock.add_project_member.assert_called_once()
-        self.rancherMock.add_project_member.assert_called_with('p-123abc', 'my-role', alex)
+        self.rancherMock.create_project_binding.assert_called_once()
+        self.rancherMock.create_project_binding.assert_called_with('p-123abc', 'my-role', alex)
 
     def test_change_second_member_add_new_and_remove_old(self):
         jane = RancherPrincipal({ 'id': 'jdoe', 'name': 'Jane Doe', 'principalType': 'user' })
@@ -215,37 +341,532 @@ class TestHandleProjectRole(TestRancherProjectManagement):
         sally = RancherPrincipal({ 'id': 'ssmith', 'name': 'Sally Smith', 'principalType': 'user' })
         self.rancherMock.search_principal = MagicMock()
         self.rancherMock.search_principal.side_effect = lambda x: sally if x == 'ssmith' else alex if x == 'aaardvark' else None
-        self.rancherMock.get_project_members = MagicMock(return_value=[ alex, jane ])
-        self.rancherMock.add_project_member = MagicMock()
-        self.rancherMock.remove_project_member = MagicMock()
+        self.rancherMock.get_project_bindings = MagicMock(return_value=[ make_binding('b-1', 'my-role', alex), make_binding('b-2', 'my-role', jane) ])
+        self.rancherMock.create_project_binding = MagicMock()
+        self.rancherMock.delete_project_binding = MagicMock()
 
         self.sut.handle_project_role('mynamespace', 'p-123abc', 'my-role', ['ssmith', 'aaardvark'])
 
-        self.rancherMock.get_project_members.assert_called_once()
-        self.rancherMock.get_project_members.assert_called_with('p-123abc', 'my-role')
+        self.rancherMock.get_project_bindings.assert_called_once()
+        self.rancherMock.get_project_bindings.assert_called_with('p-123abc')
         self.assertEqual(self.rancherMock.search_principal.call_count, 2)
         self.rancherMock.search_principal.assert_has_calls([call('ssmith'), call('aaardvark')])
-        self.rancherMock.add_project_member.assert_called_once()
-        self.rancherMock.add_project_member.assert_called_with('p-123abc', 'my-role', sally)
-        self.rancherMock.remove_project_member.assert_called_once()
-        self.rancherMock.remove_project_member.assert_called_with('p-123abc', 'my-role', jane)
+        self.rancherMock.create_project_binding.assert_called_once()
+        self.rancherMock.create_project_binding.assert_called_with('p-123abc', 'my-role', sally)
+        self.rancherMock.delete_project_binding.assert_called_once()
+        self.rancherMock.delete_project_binding.assert_called_with('b-2')
 
     def test_unknown_owner_skips(self):
         jane = RancherPrincipal({ 'id': 'jdoe', 'name': 'Jane Doe', 'principalType': 'user' })
         self.rancherMock.search_principal = MagicMock()
         self.rancherMock.search_principal.side_effect = lambda x: jane if x == 'jdoe' else None
-        self.rancherMock.get_project_members = MagicMock(return_value=[ jane ])
-        self.rancherMock.add_project_member = MagicMock()
-        self.rancherMock.remove_project_member = MagicMock()
+        self.rancherMock.get_project_bindings = MagicMock(return_value=[ make_binding('b-1', 'my-role', jane) ])
+        self.rancherMock.create_project_binding = MagicMock()
+        self.rancherMock.delete_project_binding = MagicMock()
 
         self.sut.handle_project_role('mynamespace', 'p-123abc', 'my-role', ['jdoe', 'aaardvark'])
 
-        self.rancherMock.get_project_members.assert_called_once()
-        self.rancherMock.get_project_members.assert_called_with('p-123abc', 'my-role')
+        self.rancherMock.get_project_bindings.assert_called_once()
+        self.rancherMock.get_project_bindings.assert_called_with('p-123abc')
         self.assertEqual(self.rancherMock.search_principal.call_count, 2)
         self.rancherMock.search_principal.assert_has_calls([call('jdoe'), call('aaardvark')])
-        self.rancherMock.add_project_member.assert_not_called()
-        self.rancherMock.remove_project_member.assert_not_called()
+        self.rancherMock.create_project_binding.assert_not_called()
+        self.rancherMock.delete_project_binding.assert_not_called()
+
+class TestHandleProjectRoles(TestRancherProjectManagement):
+    def setUp(self):
+        super().setUp()
+        self.jane = RancherPrincipal({ 'id': 'jdoe', 'name': 'Jane Doe', 'principalType': 'user' })
+        self.devs = RancherPrincipal({ 'id': 'ldap://devs', 'name': 'Developers', 'principalType': 'group' })
+        self.rancherMock.search_principal = MagicMock(side_effect=lambda x: { 'jdoe': self.jane, 'devs': self.devs }.get(x))
+
+    def test_one_binding_listing_for_every_role(self):
+        self.rancherMock.get_project_bindings = MagicMock(return_value=[
+            make_binding('b-1', 'project-owner', self.jane),
+            make_binding('b-2', 'read-only', self.jane),
+            make_binding('b-3', 'unmanaged-role', self.jane)
+        ])
+
+        self.sut.handle_project_roles('mynamespace', 'p-123abc', {
+            'project-owner': ['jdoe'], 'read-only': ['devs'], 'workloads-manage': ['devs', 'jdoe'] })
+
+        self.rancherMock.get_project_bindings.assert_called_once_with('p-123abc')
+        self.assertEqual(2, self.rancherMock.search_principal.call_count)
+        self.rancherMock.create_project_binding.assert_has_calls([
+            call('p-123abc', 'read-only', self.devs),
+            call('p-123abc', 'workloads-manage', self.devs),
+            call('p-123abc', 'workloads-manage', self.jane) ], any_order=True)
+        self.assertEqual(3, self.rancherMock.create_project_binding.call_count)
+        self.rancherMock.delete_project_binding.assert_called_once_with('b-2')
+
+    def test_nothing_to_change_makes_no_writes(self):
+        self.rancherMock.get_project_bindings = MagicMock(return_value=[
+            make_binding('b-1', 'project-owner', self.jane), make_binding('b-2', 'read-only', self.devs) ])
+
+        self.sut.handle_project_roles('mynamespace', 'p-123abc', { 'project-owner': ['jdoe'], 'read-only': ['devs'] })
+
+        self.rancherMock.create_project_binding.assert_not_called()
+        self.rancherMock.delete_project_binding.assert_not_called()
+
+    def test_sweep_uses_prefetched_bindings(self):
+        self.sut._binding_index = { 'p-123abc': [ make_binding('b-1', 'project-owner', self.jane) ] }
+        self.rancherMock.create_project_binding = MagicMock(return_value=make_binding('b-2', 'project-owner', self.devs))
+
+        self.sut.handle_project_roles('mynamespace', 'p-123abc', { 'project-owner': ['jdoe', 'devs'] })
+        self.sut.handle_project_roles('mynamespace2', 'p-123abc', { 'project-owner': ['jdoe', 'devs'] })
+
+        self.rancherMock.get_project_bindings.assert_not_called()
+        self.rancherMock.create_project_binding.assert_called_once_with('p-123abc', 'project-owner', self.devs)
+        self.assertEqual([ 'b-1', 'b-2' ], [ binding['id'] for binding in self.sut._binding_index['p-123abc'] ])
+
+class TestHandleProjectRoleFanOut(TestRancherProjectManagement):
+    def setUp(self):
+        super().setUp()
+        self.sut.role_workers = 4
+        self.groups = { f'group{i}': RancherPrincipal({ 'id': f'ldap://group{i}', 'name': f'Group {i}', 'principalType': 'group' })
+                        for i in range(4) }
+        self.rancherMock.search_principal = MagicMock(side_effect=lambda name: self.groups.get(name))
+        self.rancherMock.get_project_bindings = MagicMock(return_value=[])
+
+    def test_adds_members_concurrently(self):
+        barrier = threading.Barrier(4, timeout=5)
+        self.rancherMock.create_project_binding = MagicMock(side_effect=lambda *args: barrier.wait())
+
+        self.sut.handle_project_role('mynamespace', 'p-123abc', 'my-role', list(self.groups))
+
+        self.assertEqual(4, self.rancherMock.create_project_binding.call_count)
+        self.assertEqual(4, self.sut.changes['members_added'])
+
+    def test_partial_failure_tries_everyone_then_reports_each(self):
+        def add(project_id, rolename, member):
+            if member.id in ('ldap://group1', 'ldap://group3'):
+                raise RancherResponseError('url', None)
+        self.rancherMock.create_project_binding = MagicMock(side_effect=add)
+
+        with self.assertRaises(RoleMemberErrors) as raised:
+            self.sut.handle_project_role('mynamespace', 'p-123abc', 'my-role', list(self.groups))
+
+        self.assertEqual(4, self.rancherMock.create_project_binding.call_count)
+        self.assertEqual(2, self.sut.changes['members_added'])
+        self.assertEqual({ f"my-role {self.groups['group1']}", f"my-role {self.groups['group3']}" }, set(raised.exception.failures))
+
+    def test_failed_lookup_keeps_existing_members(self):
+        jane = RancherPrincipal({ 'id': 'jdoe', 'name': 'Jane Doe', 'principalType': 'user' })
+        self.rancherMock.search_principal = MagicMock(side_effect=lambda name: self.groups['group0'] if name == 'group0'
+                                                        else (_ for _ in ()).throw(RancherResponseError('url', None)))
+        self.rancherMock.get_project_bindings = MagicMock(return_value=[ make_binding('b-1', 'my-role', jane) ])
+
+        with self.assertRaises(RoleMemberErrors) as raised:
+            self.sut.handle_project_role('mynamespace', 'p-123abc', 'my-role', [ 'group0', 'jdoe' ])
+
+        self.rancherMock.create_project_binding.assert_called_once_with('p-123abc', 'my-role', self.groups['group0'])
+        self.rancherMock.delete_project_binding.assert_not_called()
+        self.assertEqual([ 'jdoe' ], list(raised.exception.failures))
+
+class TestWarmCache(TestRancherProjectManagement):
+    def setUp(self):
+        super().setUp()
+        self.sut.cache = MagicMock()
+        self.entries = {}
+        self.sut.cache.get.side_effect = lambda kind, key: ((kind, key) in self.entries, self.entries.get((kind, key)))
+        self.sut.cache.put.side_effect = lambda kind, key, value: self.entries.__setitem__((kind, key), value)
+        self.sut.cache.invalidate.side_effect = lambda kind, key: self.entries.pop((kind, key), None)
+
+    def test_cached_project_skips_lookup(self):
+        self.entries[('project', 'c-default-cluster/my project')] = { 'id': 'p-123abc' }
+        namespace = V1Namespace(metadata=V1ObjectMeta(name='mynamespace', annotations={
+            'project-name-annotation': 'my project'
+        }))
+
+        self.sut.process_namespace(namespace)
+
+        self.rancherMock.get_project.assert_not_called()
+        self.sut.kubeapi.patch_namespace.assert_called_once_with('mynamespace', namespace)
+
+    def test_namespace_carrying_another_id_replaces_cached_project(self):
+        # Deleted and recreated since it was cached
+        self.entries[('project', 'c-default-cluster/my project')] = { 'id': 'c-default-cluster:p-1' }
+        recreated = { 'id': 'c-default-cluster:p-2', 'name': 'my project', 'clusterId': 'c-default-cluster' }
+        self.rancherMock.get_project_by_id = MagicMock(return_value=recreated)
+        namespace = V1Namespace(metadata=V1ObjectMeta(name='mynamespace', annotations={
+            'project-name-annotation': 'my project',
+            'project-id-annotation': 'c-default-cluster:p-2'
+        }))
+
+        self.sut.process_namespace(namespace)
+
+        self.rancherMock.get_project_by_id.assert_called_once_with('c-default-cluster:p-2')
+        self.sut.kubeapi.patch_namespace.assert_not_called()
+        self.assertEqual(recreated, self.entries[('project', 'c-default-cluster/my project')])
+
+    def test_project_gone_from_under_binding_is_forgotten(self):
+        self.entries[('project', 'c-default-cluster/my project')] = { 'id': 'c-default-cluster:p-1' }
+        jane = RancherPrincipal({ 'id': 'jdoe', 'name': 'Jane Doe', 'principalType': 'user' })
+        self.rancherMock.search_principal = MagicMock(return_value=jane)
+        self.rancherMock.get_project_bindings = MagicMock(return_value=[])
+        response = requests.Response()
+        response.status_code = 403
+        self.rancherMock.create_project_binding = MagicMock(side_effect=requests.HTTPError('403 Client Error', response=response))
+        namespace = V1Namespace(metadata=V1ObjectMeta(name='mynamespace', annotations={
+            'project-name-annotation': 'my project',
+            'owners-annotation': 'jdoe'
+        }))
+
+        with self.assertRaises(RoleMemberErrors):
+            self.sut.process_namespace(namespace)
+
+        self.assertNotIn(('project', 'c-default-cluster/my project'), self.entries)
+
+    def test_looked_up_and_created_projects_are_cached(self):
+        self.rancherMock.get_project = MagicMock(side_effect=lambda name, cluster_id: { 'id': 'p-123abc' } if name == 'my project' else None)
+        self.rancherMock.create_project = MagicMock(return_value={ 'id': 'p-456def' })
+
+        self.sut.process_namespace(V1Namespace(metadata=V1ObjectMeta(name='ns1', annotations={ 'project-name-annotation': 'my project' })))
+        self.sut.process_namespace(V1Namespace(metadata=V1ObjectMeta(name='ns2', annotations={ 'project-name-annotation': 'new project' })))
+
+        self.assertEqual({ 'id': 'p-123abc' }, self.entries[('project', 'c-default-cluster/my project')])
+        self.assertEqual({ 'id': 'p-456def' }, self.entries[('project', 'c-default-cluster/new project')])
+
+    def test_cached_principals_and_members_skip_lookups(self):
+        jane = { 'id': 'jdoe', 'name': 'Jane Doe', 'principalType': 'user' }
+        self.entries[('principal', 'jdoe')] = jane
+        self.entries[('binding', 'p-123abc')] = [ { 'id': 'b-1', 'roleTemplateId': 'my-role', 'userPrincipalId': 'jdoe' } ]
+
+        self.sut.handle_project_role('mynamespace', 'p-123abc', 'my-role', ['jdoe'])
+
+        self.rancherMock.search_principal.assert_not_called()
+        self.rancherMock.get_project_bindings.assert_not_called()
+        self.rancherMock.create_project_binding.assert_not_called()
+
+    def test_stale_snapshot_is_checked_against_rancher_before_writing(self):
+        jane = RancherPrincipal({ 'id': 'jdoe', 'name': 'Jane Doe', 'principalType': 'user' })
+        self.rancherMock.search_principal = MagicMock(return_value=jane)
+        # Cached before jane was added, elsewhere, and before b-1 was removed in Rancher
+        alex = RancherPrincipal({ 'id': 'aaardvark', 'name': 'Alex Aardvark', 'principalType': 'user' })
+        self.entries[('binding', 'p-123abc')] = [ make_binding('b-1', 'my-role', alex) ]
+        self.rancherMock.get_project_bindings = MagicMock(return_value=[ make_binding('b-2', 'my-role', jane) ])
+
+        self.sut.handle_project_role('mynamespace', 'p-123abc', 'my-role', ['jdoe'])
+
+        self.rancherMock.get_project_bindings.assert_called_once_with('p-123abc')
+        self.rancherMock.create_project_binding.assert_not_called()
+        self.rancherMock.delete_project_binding.assert_not_called()
+        self.assertEqual([ make_binding('b-2', 'my-role', jane) ], self.entries[('binding', 'p-123abc')])
+
+    def test_changed_members_refresh_snapshot(self):
+        jane = RancherPrincipal({ 'id': 'jdoe', 'name': 'Jane Doe', 'principalType': 'user' })
+        alex = RancherPrincipal({ 'id': 'aaardvark', 'name': 'Alex Aardvark', 'principalType': 'user' })
+        self.rancherMock.search_principal = MagicMock(return_value=jane)
+        self.rancherMock.get_project_bindings = MagicMock(return_value=[ make_binding('b-1', 'my-role', alex), make_binding('b-2', 'other-role', alex) ])
+        self.rancherMock.create_project_binding = MagicMock(return_value=make_binding('b-3', 'my-role', jane))
+
+        self.sut.handle_project_role('mynamespace', 'p-123abc', 'my-role', ['jdoe'])
+
+        self.assertEqual(jane.to_dict(), self.entries[('principal', 'jdoe')])
+        self.assertEqual([ make_binding('b-2', 'other-role', alex), make_binding('b-3', 'my-role', jane) ], self.entries[('binding', 'p-123abc')])
+
+    def test_failed_change_leaves_no_snapshot(self):
+        jane = RancherPrincipal({ 'id': 'jdoe', 'name': 'Jane Doe', 'principalType': 'user' })
+        self.rancherMock.search_principal = MagicMock(return_value=jane)
+        self.rancherMock.get_project_bindings = MagicMock(return_value=[])
+        self.rancherMock.create_project_binding = MagicMock(side_effect=RancherResponseError('url', None))
+
+        with self.assertRaises(RancherResponseError):
+            self.sut.handle_project_role('mynamespace', 'p-123abc', 'my-role', ['jdoe'])
+
+        self.assertNotIn(('binding', 'p-123abc'), self.entries)
+
+    def test_missing_principal_not_cached(self):
+        self.rancherMock.search_principal = MagicMock(return_value=None)
+        self.rancherMock.get_project_bindings = MagicMock(return_value=[])
+
+        self.sut.handle_project_role('mynamespace', 'p-123abc', 'my-role', ['nobody'])
+
+        self.assertNotIn(('principal', 'nobody'), self.entries)
+
+class TestDesiredMembers(TestRancherProjectManagement):
+    def setUp(self):
+        super().setUp()
+        self.jane = RancherPrincipal({ 'id': 'local://jdoe', 'name': 'Jane Doe', 'principalType': 'user' })
+        self.rancherMock.get_project = MagicMock(return_value={ 'id': 'c-1:p-123abc' })
+        self.rancherMock.search_principal = MagicMock(return_value=self.jane)
+        self.rancherMock.get_project_bindings = MagicMock(return_value=[ make_binding('b-1', 'project-owner', self.jane, 'c-1:p-123abc') ])
+        self.namespace = V1Namespace(metadata=V1ObjectMeta(name='mynamespace', annotations={
+            'project-name-annotation': 'my project',
+            'owners-annotation': 'jdoe'
+        }))
+
+    def test_records_fingerprint_and_namespace(self):
+        self.sut.process_namespace(self.namespace)
+
+        self.assertEqual({ 'c-1:p-123abc': { 'project-owner': membership_fingerprint(['local://jdoe']) } }, self.sut.desired_snapshot())
+        self.assertEqual(('my project', 'mynamespace', 'c-default-cluster'), self.sut.project_namespaces['c-1:p-123abc'])
+
+    def test_snapshot_leaves_out_other_shards(self):
+        self.sut.process_namespace(self.namespace)
+        self.sut.shard = MagicMock()
+        self.sut.shard.owns = MagicMock(return_value=False)
+
+        self.assertEqual({}, self.sut.desired_snapshot())
+
+    def test_recheck_rereads_namespace_past_cached_bindings(self):
+        self.sut.process_namespace(self.namespace)
+        self.sut.cache = MagicMock()
+        self.sut.cache.get = MagicMock(return_value=(False, None))
+        self.sut.kubeapi.read_namespace = MagicMock(return_value=self.namespace)
+
+        self.sut.recheck_project('c-1:p-123abc')
+
+        self.sut.cache.invalidate.assert_any_call('binding', 'c-1:p-123abc')
+        self.sut.kubeapi.read_namespace.assert_called_once_with('mynamespace')
+        self.assertEqual(2, self.rancherMock.get_project_bindings.call_count)
+        self.assertIn('c-1:p-123abc', self.sut.desired_snapshot())
+
+    def test_failed_lookups_leave_role_unchecked(self):
+        self.rancherMock.search_principal = MagicMock(side_effect=RancherResponseError('url', None))
+
+        with self.assertRaises(RancherResponseError):
+            self.sut.process_namespace(self.namespace)
+
+        self.assertEqual({ 'c-1:p-123abc': { 'project-owner': None } }, self.sut.desired_snapshot())
+
+    def test_recheck_waits_for_project_being_processed(self):
+        self.sut.process_namespace(self.namespace)
+        self.sut.kubeapi.read_namespace = MagicMock(return_value=self.namespace)
+        recheck = threading.Thread(target=self.sut.recheck_project, args=('c-1:p-123abc',))
+
+        with self.sut._project_lock(('c-default-cluster', 'my project')):
+            recheck.start()
+            while self.sut._project_locks[('c-default-cluster', 'my project')][1] < 2:
+                time.sleep(0.001)
+            self.sut.kubeapi.read_namespace.assert_not_called()
+        recheck.join(5)
+
+        self.sut.kubeapi.read_namespace.assert_called_once_with('mynamespace')
+        self.assertEqual({}, self.sut._project_locks)
+
+    def test_recheck_forgets_deleted_namespace(self):
+        self.sut.process_namespace(self.namespace)
+        self.sut.kubeapi.read_namespace = MagicMock(side_effect=ApiException(status=404))
+
+        self.sut.recheck_project('c-1:p-123abc')
+
+        self.assertEqual({}, self.sut.desired_snapshot())
+        self.assertNotIn('c-1:p-123abc', self.sut.project_namespaces)
+
+    def test_failed_recheck_is_kept(self):
+        self.sut.process_namespace(self.namespace)
+        self.sut.kubeapi.read_namespace = MagicMock(return_value=self.namespace)
+        self.rancherMock.get_project_bindings = MagicMock(side_effect=RancherResponseError('url', None))
+
+        with self.assertRaises(RancherResponseError):
+            self.sut.recheck_project('c-1:p-123abc')
+
+        self.assertIn('c-1:p-123abc', self.sut.desired_snapshot())
+
+class TestNamespacePatcher(TestRancherProjectManagement):
+    def setUp(self):
+        super().setUp()
+        self.rancherMock.get_project_by_id = MagicMock(return_value=None)
+        self.rancherMock.get_project = MagicMock(return_value={ 'id': 'p-123abc', 'name': 'my project' })
+        self.sut.patcher = NamespacePatcher(self.sut.kubeapi, workers=2, retry_delay=0, on_patched=self.sut._namespace_patched)
+        self.addCleanup(self.sut.patcher.close)
+
+    def test_patches_go_through_patcher(self):
+        namespace = NamespaceRecord('mynamespace', { 'project-name-annotation': 'my project' })
+
+        self.sut.process_namespace(namespace)
+        self.assertTrue(self.sut.patcher.join(5))
+
+        self.sut.kubeapi.patch_namespace.assert_called_once_with('mynamespace',
+                { 'metadata': { 'annotations': { 'project-id-annotation': 'p-123abc' } } })
+        self.assertEqual(1, self.sut.changes['namespaces_annotated'])
+
+    def test_reconcile_all_waits_for_patches_and_counts_their_errors(self):
+        self.rancherMock.call_counts = Counter()
+        self.rancherMock.list_projects = MagicMock(return_value=[ { 'id': 'p-123abc', 'name': 'my project', 'clusterId': 'c-default-cluster' } ])
+        self.rancherMock.list_project_role_bindings = MagicMock(return_value=[])
+        ns1 = V1Namespace(metadata=V1ObjectMeta(name='ns1', annotations={ 'project-name-annotation': 'my project' }))
+        ns2 = V1Namespace(metadata=V1ObjectMeta(name='ns2', annotations={ 'project-name-annotation': 'my project' }))
+        self.sut.kubeapi.list_namespace = MagicMock(return_value=V1NamespaceList(items=[ ns1, ns2 ]))
+        self.sut.kubeapi.patch_namespace = MagicMock(side_effect=[ None, ApiException(status=403) ])
+
+        report = self.sut.reconcile_all()
+
+        self.assertEqual(2, self.sut.kubeapi.patch_namespace.call_count)
+        self.assertEqual(1, report.errors)
+        self.assertEqual(1, report.changes['namespaces_annotated'])
+        self.assertIn('patch_namespaces', report.phases)
+
+    def test_only_patches_that_went_through_are_counted(self):
+        self.sut.kubeapi.patch_namespace = MagicMock(side_effect=[ ApiException(status=503), None ])
+
+        self.sut.process_namespace(NamespaceRecord('mynamespace', { 'project-name-annotation': 'my project' }))
+        self.assertTrue(self.sut.patcher.join(5))
+
+        self.assertEqual(2, self.sut.kubeapi.patch_namespace.call_count)
+        self.assertEqual(1, self.sut.changes['namespaces_annotated'])
+
+class TestProvisionProjects(TestRancherProjectManagement):
+    def setUp(self):
+        super().setUp()
+        self.sut.rancher = FakeRancher()
+        self.sut.rancher.projects['default-cluster:p-0'] = { 'id': 'default-cluster:p-0', 'name': 'existing', 'clusterId': 'default-cluster' }
+
+    def make_namespace(self, name, project, cluster=None):
+        annotations = { 'project-name-annotation': project }
+        if cluster is not None:
+            annotations['cluster-name-annotation'] = cluster
+        return NamespaceRecord(name, annotations)
+
+    def test_creates_each_missing_project_once_in_its_cluster(self):
+        namespaces = [ self.make_namespace('ns1', 'existing'), self.make_namespace('ns2', 'new'), self.make_namespace('ns3', 'new'),
+                       self.make_namespace('ns4', 'elsewhere', 'other-cluster'), NamespaceRecord('ns5', {}) ]
+
+        index = self.sut.provision_projects(namespaces, max_workers=4)
+
+        self.assertEqual({ ('default-cluster', 'existing'), ('default-cluster', 'new'), ('other-cluster', 'elsewhere') }, set(index))
+        self.assertEqual(3, len(self.sut.rancher.projects))
+        self.assertEqual(2, self.sut.changes['projects_created'])
+
+    def test_same_name_in_another_cluster_is_another_project(self):
+        self.sut.provision_projects([ self.make_namespace('ns1', 'existing'), self.make_namespace('ns2', 'existing', 'other-cluster') ])
+        namespace = self.make_namespace('ns2', 'existing', 'other-cluster')
+
+        self.sut.process_namespace(namespace)
+
+        self.assertEqual(2, len(self.sut.rancher.projects))
+        self.assertTrue(namespace.annotations['project-id-annotation'].startswith('other-cluster:'))
+
+    def test_failed_creations_are_left_for_processing(self):
+        self.sut.rancher.create_project = MagicMock(side_effect=ValueError('No cluster by that name'))
+
+        index = self.sut.provision_projects([ self.make_namespace('ns1', 'new') ])
+
+        self.assertNotIn(('default-cluster', 'new'), index)
+        self.assertEqual(0, self.sut.changes['projects_created'])
+
+    def test_concurrent_requests_for_one_project_create_it_once(self):
+        creating = threading.Event()
+        release = threading.Event()
+        create_project = self.sut.rancher.create_project
+        def slow_create(*args):
+            creating.set()
+            release.wait(5)
+            return create_project(*args)
+        self.sut.rancher.create_project = MagicMock(side_effect=slow_create)
+        threads = [ threading.Thread(target=self.sut._create_project, args=('new', 'default-cluster')) for _ in range(2) ]
+        threads[0].start()
+        creating.wait(5)
+        threads[1].start()
+        # Let the first finish only once the second is waiting on it
+        while self.sut._project_locks[('default-cluster', 'new')][1] < 2:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.sut.rancher.create_project.assert_called_once()
+        self.assertEqual(1, sum(project['name'] == 'new' for project in self.sut.rancher.projects.values()))
+        self.assertEqual({}, self.sut._project_locks)
+
+    def test_project_created_since_lookup_is_not_created_again(self):
+        self.assertIsNone(self.sut._find_project('new', 'default-cluster'))
+        # Another thread creates it and is done with it before this one gets to create it
+        other = threading.Thread(target=self.sut._create_project, args=('new', 'default-cluster'))
+        other.start()
+        other.join(5)
+
+        project = self.sut._create_project('new', 'default-cluster')
+
+        self.assertEqual(1, sum(project['name'] == 'new' for project in self.sut.rancher.projects.values()))
+        self.assertIn(project['id'], self.sut.rancher.projects)
+        self.assertEqual(1, self.sut.changes['projects_created'])
+
+    def test_watch_creates_projects_before_processing_namespaces(self):
+        source = MagicMock()
+        source.list_page = MagicMock(return_value=([ self.make_namespace('ns1', 'new'), self.make_namespace('ns2', 'new') ], None))
+        source.stream = MagicMock(return_value=[])
+        self.sut.namespace_source = source
+        self.sut.preprovision_workers = 2
+        processed = []
+        process_namespace = self.sut.process_namespace
+        self.sut.process_namespace = lambda ns: (processed.append(len(self.sut.rancher.projects)), process_namespace(ns))
+
+        self.sut.watch()
+
+        self.assertEqual([ 2, 2 ], processed)
+        self.assertEqual(1, self.sut.changes['projects_created'])
+        # The project listing, the cluster lookup and the check before creating, the namespaces find their project in the listing
+        self.assertEqual(3, self.sut.rancher.call_counts['GET'])
+        self.assertIsNone(self.sut._project_index)
+
+class TestReconcileAll(TestRancherProjectManagement):
+    def setUp(self):
+        super().setUp()
+        self.rancherMock.call_counts = Counter()
+        self.rancherMock.list_projects = MagicMock(return_value=[ { 'id': 'p-123abc', 'name': 'my project', 'clusterId': 'c-default-cluster' } ])
+
+    def test_uses_prefetched_projects_and_principals(self):
+        jane = RancherPrincipal({ 'id': 'jdoe', 'name': 'Jane Doe', 'principalType': 'user' })
+        ns1 = V1Namespace(metadata=V1ObjectMeta(name='ns1', annotations={
+            'project-name-annotation': 'my project', 'owners-annotation': 'jdoe' }))
+        ns2 = V1Namespace(metadata=V1ObjectMeta(name='ns2', annotations={
+            'project-name-annotation': 'my project', 'project-id-annotation': 'p-123abc', 'owners-annotation': 'jdoe' }))
+        ns3 = V1Namespace(metadata=V1ObjectMeta(name='ns3'))
+        self.sut.kubeapi.list_namespace = MagicMock(return_value=V1NamespaceList(items=[ ns1, ns2, ns3 ]))
+        self.rancherMock.search_principal = MagicMock(return_value=jane)
+        self.rancherMock.list_project_role_bindings = MagicMock(return_value=[])
+        self.rancherMock.create_project_binding = MagicMock(return_value=make_binding('b-1', 'project-owner', jane))
+
+        report = self.sut.reconcile_all(max_workers=4)
+
+        self.rancherMock.get_project.assert_not_called()
+        self.rancherMock.get_project_bindings.assert_not_called()
+        self.rancherMock.list_project_role_bindings.assert_called_once()
+        self.rancherMock.search_principal.assert_called_once_with('jdoe')
+        self.sut.kubeapi.patch_namespace.assert_called_once_with('ns1', ns1)
+        self.assertEqual(3, report.namespaces)
+        self.assertEqual(0, report.errors)
+        self.assertEqual({ 'list_namespaces', 'prefetch', 'reconcile' }, set(report.phases.keys()))
+        self.assertEqual(1, report.changes['namespaces_annotated'])
+        self.assertEqual(1, report.changes['members_added'])
+        self.assertIsNone(self.sut._project_index)
+        self.assertIsNone(self.sut._principal_cache)
+        self.assertIsNone(self.sut._binding_index)
+
+    def test_missing_project_created_once_per_project(self):
+        ns1 = V1Namespace(metadata=V1ObjectMeta(name='ns1', annotations={ 'project-name-annotation': 'new project' }))
+        ns2 = V1Namespace(metadata=V1ObjectMeta(name='ns2', annotations={ 'project-name-annotation': 'new project' }))
+        self.sut.kubeapi.list_namespace = MagicMock(return_value=V1NamespaceList(items=[ ns1, ns2 ]))
+        self.rancherMock.create_project = MagicMock(return_value={ 'id': 'p-456def', 'name': 'new project' })
+
+        report = self.sut.reconcile_all()
+
+        self.rancherMock.create_project.assert_called_once_with('new project', 'default-cluster')
+        self.assertEqual(2, self.sut.kubeapi.patch_namespace.call_count)
+        self.assertEqual(1, report.changes['projects_created'])
+
+    def test_errors_are_counted_not_raised(self):
+        ns1 = V1Namespace(metadata=V1ObjectMeta(name='ns1', annotations={ 'project-name-annotation': 'my project' }))
+        ns2 = V1Namespace(metadata=V1ObjectMeta(name='ns2', annotations={ 'project-name-annotation': 'other project' }))
+        self.sut.kubeapi.list_namespace = MagicMock(return_value=V1NamespaceList(items=[ ns1, ns2 ]))
+        self.rancherMock.create_project = MagicMock(side_effect=ValueError('No cluster by that name'))
+
+        report = self.sut.reconcile_all()
+
+        self.assertEqual(1, report.errors)
+        self.sut.kubeapi.patch_namespace.assert_called_once_with('ns1', ns1)
+
+    def test_reports_rancher_calls(self):
+        self.sut.kubeapi.list_namespace = MagicMock(return_value=V1NamespaceList(items=[]))
+        self.rancherMock.call_counts = Counter({ 'GET': 5 })
+        self.rancherMock.list_projects.side_effect = lambda: self.rancherMock.call_counts.update({ 'GET': 2 }) or []
+
+        report = self.sut.reconcile_all()
+
+        self.assertEqual({ 'GET': 2 }, dict(report.rancher_calls))
+        self.assertEqual(2, report.to_dict()['rancher_calls_total'])
 
 class TestWatch(TestRancherProjectManagement):
     def test_no_namespaces_does_nothing_and_watches(self):
@@ -306,6 +927,76 @@ class TestWatch(TestRancherProjectManagement):
         watchermock.stream.assert_called_once()
         watchermock.stream.assert_called_with(self.sut.kubeapi.list_namespace)
 
+    def test_resync_during_listing_lists_again(self):
+        ns1 = V1Namespace(metadata=V1ObjectMeta(name='mynamespace'))
+        self.sut.kubeapi.list_namespace = MagicMock(return_value=V1NamespaceList(items=[ ns1 ]))
+        watchermock = MagicMock()
+        watchermock.stream = MagicMock(return_value=[ { 'type': 'MODIFIED', 'object': ns1 } ])
+        watch.Watch = MagicMock(return_value=watchermock)
+        # A shard rebalance while the first listing is being processed, before there's a watcher to stop
+        self.sut.process_namespace = MagicMock()
+        self.sut.process_namespace.side_effect = lambda ns: self.sut.request_resync() if self.sut.process_namespace.call_count == 1 else None
+
+        self.sut.watch()
+
+        watchermock.stream.assert_not_called()
+
+        self.sut.watch()
+
+        self.assertEqual(3, self.sut.process_namespace.call_count)
+        watchermock.stream.assert_called_once()
+
+    def test_resync_before_stream_started_ends_it(self):
+        ns1 = V1Namespace(metadata=V1ObjectMeta(name='mynamespace'))
+        self.sut.kubeapi.list_namespace = MagicMock(return_value=V1NamespaceList(items=[]))
+        watchermock = MagicMock()
+        def stream(*args):
+            # Asked for once the watcher is in place but before it's streaming, so stopping it does nothing
+            self.sut.request_resync()
+            yield { 'type': 'MODIFIED', 'object': ns1 }
+        watchermock.stream = MagicMock(side_effect=stream)
+        watch.Watch = MagicMock(return_value=watchermock)
+        self.sut.process_namespace = MagicMock()
+
+        self.sut.watch()
+
+        self.sut.process_namespace.assert_not_called()
+
+    def test_pages_initial_list_and_reports_ready_after_first_page(self):
+        ns1 = V1Namespace(metadata=V1ObjectMeta(name='mynamespace'))
+        ns2 = V1Namespace(metadata=V1ObjectMeta(name='mynamespace2'))
+        page1 = V1NamespaceList(items=[ ns1 ], metadata=V1ListMeta(_continue='token1'))
+        page2 = V1NamespaceList(items=[ ns2 ], metadata=V1ListMeta())
+        ready_when_processed = []
+        self.sut.kubeapi.list_namespace = MagicMock(side_effect=[ page1, page2 ])
+        self.sut.process_namespace = MagicMock(side_effect=lambda ns: ready_when_processed.append(self.sut.ready.is_set()))
+
+        watchermock = MagicMock()
+        watchermock.stream = MagicMock(return_value=[])
+        watch.Watch = MagicMock(return_value=watchermock)
+
+        self.sut.watch()
+
+        self.sut.kubeapi.list_namespace.assert_has_calls([ call(limit=500, _continue=None), call(limit=500, _continue='token1') ])
+        self.assertEqual([ False, True ], ready_when_processed)
+        self.assertTrue(self.sut.ready.is_set())
+
+    def test_lean_watch_uses_raw_watcher(self):
+        self.sut.lean_watch = True
+        record = NamespaceRecord('mynamespace', {})
+        raw_watcher = MagicMock()
+        raw_watcher.list_page = MagicMock(return_value=([ record ], None))
+        raw_watcher.stream = MagicMock(return_value=[ { 'type': 'MODIFIED', 'object': record } ])
+        self.sut.process_namespace = MagicMock()
+
+        with patch('RancherProjectManager.RancherProjectManagement.RawNamespaceWatch', return_value=raw_watcher) as raw_class:
+            self.sut.watch()
+
+        raw_class.assert_called_once_with(self.sut.kubeapi, self.sut.annotation_keys())
+        raw_watcher.list_page.assert_called_once_with(500, None)
+        self.sut.process_namespace.assert_has_calls([ call(record), call(record) ])
+        watch.Watch.assert_not_called()
+
     def test_error_does_not_terminate_watch(self):
         ns1 = V1Namespace(metadata=V1ObjectMeta(name='mynamespace'))
         ns2 = V1Namespace(metadata=V1ObjectMeta(name='mynamespace2'))
@@ -331,6 +1022,171 @@ class TestWatch(TestRancherProjectManagement):
         watchermock.stream.assert_called_once()
         watchermock.stream.assert_called_with(self.sut.kubeapi.list_namespace)
 
+class TestResumableWatch(TestRancherProjectManagement):
+    def setUp(self):
+        super().setUp()
+        self.sut.watch_timeout = 300
+        self.sut.idle_timeout = 120
+        self.sut.process_namespace = MagicMock()
+        self.sut.kubeapi.list_namespace = MagicMock(return_value=V1NamespaceList(items=[], metadata=V1ListMeta(resource_version='100')))
+        self.streams = []
+        watch.Watch = MagicMock(side_effect=self.make_watcher)
+
+    def make_watcher(self):
+        # Each connection gets a watcher playing the next of self.streams: a list of (event, resourceVersion) or an exception
+        watcher = MagicMock()
+        watcher.resource_version = None
+        script = self.streams.pop(0)
+
+        def stream(func, **kwargs):
+            func(**kwargs)
+            if isinstance(script, Exception):
+                raise script
+            for event, resource_version in script:
+                watcher.resource_version = resource_version
+                yield event
+            if not self.streams:
+                self.sut.request_resync()
+        watcher.stream = MagicMock(side_effect=stream)
+        return watcher
+
+    def watch_kwargs(self):
+        return [ c[1] for c in self.sut.kubeapi.list_namespace.call_args_list if c[1].get('allow_watch_bookmarks') ]
+
+    def test_resumes_from_listing_then_last_resource_version_seen(self):
+        ns1 = V1Namespace(metadata=V1ObjectMeta(name='ns1', resource_version='101'))
+        self.streams = [ [ ({ 'type': 'MODIFIED', 'object': ns1 }, '101'), ({ 'type': 'BOOKMARK', 'object': None }, '150') ], [] ]
+
+        self.sut.watch()
+
+        self.sut.process_namespace.assert_called_once_with(ns1)
+        self.assertEqual([ '100', '150' ], [ kwargs['resource_version'] for kwargs in self.watch_kwargs() ])
+        self.assertEqual({ 'timeout_seconds': 300, 'allow_watch_bookmarks': True, 'resource_version': '100',
+                           '_request_timeout': (120, 120) }, self.watch_kwargs()[0])
+        self.assertEqual({ 'timeout': 1 }, dict(self.sut.watch_reconnects))
+        self.assertIsNotNone(self.sut.last_reconnect_seconds)
+        self.assertLess(self.sut.seconds_since_last_watch_event(), 5)
+
+    def test_stale_connection_reconnects_straight_away(self):
+        self.streams = [ urllib3.exceptions.ReadTimeoutError(None, None, 'Read timed out'), [] ]
+
+        with patch('RancherProjectManager.RancherProjectManagement.time.sleep') as sleep:
+            self.sut.watch()
+
+        self.assertEqual({ 'stale': 1 }, dict(self.sut.watch_reconnects))
+        self.assertEqual(2, len(self.watch_kwargs()))
+        sleep.assert_not_called()
+
+    def test_repeated_connection_errors_back_off(self):
+        error = urllib3.exceptions.ProtocolError('Connection reset')
+        self.streams = [ error, error, error, [] ]
+
+        with patch('RancherProjectManager.RancherProjectManagement.time.sleep') as sleep:
+            self.sut.watch()
+
+        self.assertEqual({ 'error': 3 }, dict(self.sut.watch_reconnects))
+        self.assertEqual([ call(1), call(2) ], sleep.call_args_list)
+
+    def test_resync_ends_the_watch_without_reconnecting(self):
+        self.streams = [ [] ]
+
+        self.sut.watch()
+
+        self.assertEqual(1, len(self.watch_kwargs()))
+        self.assertEqual({}, dict(self.sut.watch_reconnects))
+
+    def test_lean_watch_resumes_too(self):
+        self.sut.lean_watch = True
+        raw_watcher = MagicMock()
+        raw_watcher.resource_version = '100'
+        raw_watcher.list_page = MagicMock(return_value=([], None))
+        record = NamespaceRecord('ns1', {}, '101')
+
+        def stream(bookmarks=False, **kwargs):
+            raw_watcher.resource_version = '101'
+            yield { 'type': 'MODIFIED', 'object': record }
+            self.sut.request_resync()
+        raw_watcher.stream = MagicMock(side_effect=stream)
+
+        with patch('RancherProjectManager.RancherProjectManagement.RawNamespaceWatch', return_value=raw_watcher):
+            self.sut.watch()
+
+        self.sut.process_namespace.assert_called_once_with(record)
+        raw_watcher.stream.assert_called_once_with(bookmarks=True, timeout_seconds=300, allow_watch_bookmarks=True,
+                                                   resource_version='100', _request_timeout=(120, 120))
+        self.assertEqual(self.sut._watch_connected, raw_watcher.on_connect)
+
+class TestPriorityQueue(TestRancherProjectManagement):
+    def setUp(self):
+        super().setUp()
+        self.sut.priority_queue = True
+        self.processed = []
+        self.sut.process_namespace = MagicMock(side_effect=lambda ns: self.processed.append(as_record(ns).name))
+        self.watchermock = MagicMock()
+        self.watchermock.stream = MagicMock(return_value=[])
+        watch.Watch = MagicMock(return_value=self.watchermock)
+
+    def make_namespace(self, name, project_id='p-1', owners='jdoe'):
+        annotations = { 'project-name-annotation': 'my project', 'owners-annotation': owners }
+        if project_id is not None:
+            annotations['project-id-annotation'] = project_id
+        return V1Namespace(metadata=V1ObjectMeta(name=name, annotations=annotations))
+
+    def test_unassigned_namespaces_first(self):
+        self.sut.kubeapi.list_namespace = MagicMock(return_value=V1NamespaceList(items=[
+            self.make_namespace('done1'), self.make_namespace('new1', project_id=None),
+            V1Namespace(metadata=V1ObjectMeta(name='unmanaged', annotations={})),
+            self.make_namespace('done2'), self.make_namespace('new2', project_id=None)
+        ]))
+
+        self.sut.watch()
+
+        self.assertTrue(self.sut._queue.join(timeout=5))
+        self.assertEqual([ 'new1', 'new2', 'done1', 'done2' ], self.processed)
+        self.assertTrue(self.sut.ready.is_set())
+
+    def test_changed_owners_are_urgent_unchanged_are_not(self):
+        self.assertEqual(LOW, self.sut._priority(as_record(self.make_namespace('ns1'))))
+        self.assertEqual(LOW, self.sut._priority(as_record(self.make_namespace('ns1'))))
+        self.assertEqual(HIGH, self.sut._priority(as_record(self.make_namespace('ns1', owners='jdoe,asmith'))))
+        self.assertIsNone(self.sut._priority(as_record(V1Namespace(metadata=V1ObjectMeta(name='ns2', annotations={})))))
+
+    def test_watch_events_go_through_queue(self):
+        ns = self.make_namespace('ns1')
+        self.sut.kubeapi.list_namespace = MagicMock(return_value=V1NamespaceList(items=[]))
+        self.watchermock.stream = MagicMock(return_value=[
+            { 'type': 'ADDED', 'object': self.make_namespace('ignored') },
+            { 'type': 'MODIFIED', 'object': ns },
+            { 'type': 'DELETED', 'object': ns }
+        ])
+
+        self.sut.watch()
+
+        self.assertTrue(self.sut._queue.join(timeout=5))
+        self.assertEqual([ 'ns1' ], self.processed)
+        self.assertNotIn('ns1', self.sut._seen_wants)
+
+    def test_worker_survives_namespace_errors(self):
+        self.sut.process_namespace = MagicMock(side_effect=[ RancherResponseError('url', None), None ])
+        self.sut.kubeapi.list_namespace = MagicMock(return_value=V1NamespaceList(items=[
+            self.make_namespace('ns1'), self.make_namespace('ns2')
+        ]))
+
+        self.sut.watch()
+
+        self.assertTrue(self.sut._queue.join(timeout=5))
+        self.assertEqual(2, self.sut.process_namespace.call_count)
+
+    def test_unexpected_worker_error_ends_watch(self):
+        self.sut.process_namespace = MagicMock(side_effect=TypeError('boom'))
+        self.sut.kubeapi.list_namespace = MagicMock(return_value=V1NamespaceList(items=[ self.make_namespace('ns1') ]))
+        def stream_until_worker_dies(*args):
+            self.sut._worker.join(timeout=5)
+            return iter([])
+        self.watchermock.stream = MagicMock(side_effect=stream_until_worker_dies)
+
+        with self.assertRaises(TypeError):
+            self.sut.watch()
+
 if __name__ == '__main__':
     unittest.main()
-
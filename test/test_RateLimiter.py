@@ -0,0 +1,47 @@
+import unittest
+from unittest.mock import patch
+from RancherProjectManager import *
+
+class TestRateLimiter(unittest.TestCase):
+    def test_invalid_args_throw_err(self):
+        with self.assertRaises(ValueError):
+            RateLimiter(0)
+        with self.assertRaises(ValueError):
+            RateLimiter(5, 0)
+
+    @patch('RancherProjectManager.RateLimiter.time')
+    def test_burst_passes_then_throttles(self, time_mock):
+        time_mock.monotonic.return_value = 100.0
+        sut = RateLimiter(2, burst=3)
+
+        waits = [ sut.acquire() for _ in range(5) ]
+
+        self.assertEqual([0.0, 0.0, 0.0, 0.5, 1.0], waits)
+        self.assertEqual(2, time_mock.sleep.call_count)
+
+    @patch('RancherProjectManager.RateLimiter.time')
+    def test_tokens_refill_over_time(self, time_mock):
+        time_mock.monotonic.return_value = 100.0
+        sut = RateLimiter(2, burst=1)
+        sut.acquire()
+
+        time_mock.monotonic.return_value = 100.5
+        wait = sut.acquire()
+
+        self.assertEqual(0.0, wait)
+        time_mock.sleep.assert_not_called()
+
+    @patch('RancherProjectManager.RateLimiter.time')
+    def test_try_acquire_never_waits_or_goes_into_debt(self, time_mock):
+        time_mock.monotonic.return_value = 100.0
+        sut = RateLimiter(2, burst=1)
+
+        self.assertEqual(0.0, sut.try_acquire())
+        self.assertEqual(0.5, sut.try_acquire())
+        self.assertEqual(0.5, sut.try_acquire())
+        time_mock.monotonic.return_value = 100.5
+        self.assertEqual(0.0, sut.try_acquire())
+        time_mock.sleep.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+from kubernetes.client.exceptions import ApiException
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+from RancherProjectManager import *
+
+def ns_json(name, rv, annotations=None):
+    return { 'metadata': { 'name': name, 'resourceVersion': rv, 'annotations': annotations,
+                           'managedFields': [ { 'manager': 'kubectl' } ] }, 'spec': { 'finalizers': [ 'kubernetes' ] } }
+
+def event_line(type, obj):
+    return json.dumps({ 'type': type, 'object': obj })
+
+class TestNamespaceRecord(unittest.TestCase):
+    def test_from_dict_keeps_only_requested_annotations(self):
+        record = NamespaceRecord.from_dict(ns_json('myns', '12', { 'mine': 'a', 'kubectl.kubernetes.io/last-applied-configuration': '{}' }), ['mine', 'other'])
+
+        self.assertEqual(NamespaceRecord('myns', { 'mine': 'a' }, '12'), record)
+
+    def test_from_dict_without_annotations(self):
+        record = NamespaceRecord.from_dict(ns_json('myns', '12'))
+
+        self.assertEqual({}, record.annotations)
+
+    def test_has_no_instance_dict(self):
+        with self.assertRaises(AttributeError):
+            NamespaceRecord('myns', {}).extra = 1
+
+class TestRawNamespaceWatch(unittest.TestCase):
+    def setUp(self):
+        self.kubeapi = MagicMock()
+        self.sut = RawNamespaceWatch(self.kubeapi, ['mine'])
+
+    def test_list_page_returns_records_and_continue(self):
+        resp = MagicMock()
+        resp.data = json.dumps({ 'metadata': { 'resourceVersion': '50', 'continue': 'token1' },
+                                 'items': [ ns_json('ns1', '10', { 'mine': 'a' }), ns_json('ns2', '11') ] }).encode()
+        self.kubeapi.list_namespace = MagicMock(return_value=resp)
+
+        records, _continue = self.sut.list_page(100)
+
+        self.kubeapi.list_namespace.assert_called_once_with(limit=100, _continue=None, _preload_content=False)
+        self.assertEqual([ NamespaceRecord('ns1', { 'mine': 'a' }, '10'), NamespaceRecord('ns2', {}, '11') ], records)
+        self.assertEqual('token1', _continue)
+        self.assertEqual('50', self.sut.resource_version)
+
+    @patch('RancherProjectManager.RawNamespaceWatch.iter_resp_lines')
+    def test_stream_yields_records_and_tracks_resource_version(self, iter_lines):
+        self.sut.resource_version = '50'
+        iter_lines.side_effect = [
+            [ event_line('MODIFIED', ns_json('ns1', '51', { 'mine': 'a' })),
+              '',
+              event_line('BOOKMARK', { 'metadata': { 'resourceVersion': '60' } }) ],
+            [ event_line('ADDED', ns_json('ns2', '61')) ]
+        ]
+
+        events = []
+        for event in self.sut.stream():
+            events.append(event)
+            if len(events) == 2:
+                self.sut.stop()
+
+        self.assertEqual([ { 'type': 'MODIFIED', 'object': NamespaceRecord('ns1', { 'mine': 'a' }, '51') },
+                           { 'type': 'ADDED', 'object': NamespaceRecord('ns2', {}, '61') } ], events)
+        self.assertEqual('50', self.kubeapi.list_namespace.call_args_list[0][1]['resource_version'])
+        self.assertEqual('60', self.kubeapi.list_namespace.call_args_list[1][1]['resource_version'])
+        self.assertEqual('61', self.sut.resource_version)
+
+    @patch('RancherProjectManager.RawNamespaceWatch.iter_resp_lines')
+    def test_stream_with_timeout_ends_with_the_connection_and_can_yield_bookmarks(self, iter_lines):
+        iter_lines.return_value = [ event_line('BOOKMARK', { 'metadata': { 'resourceVersion': '60' } }) ]
+        self.sut.on_connect = MagicMock()
+
+        events = list(self.sut.stream(bookmarks=True, timeout_seconds=300, _request_timeout=(120, 120)))
+
+        self.assertEqual([ { 'type': 'BOOKMARK', 'object': None } ], events)
+        self.kubeapi.list_namespace.assert_called_once_with(watch=True, _preload_content=False, allow_watch_bookmarks=True,
+                                                            timeout_seconds=300, _request_timeout=(120, 120))
+        self.sut.on_connect.assert_called_once()
+        self.assertEqual('60', self.sut.resource_version)
+
+    @patch('RancherProjectManager.RawNamespaceWatch.iter_resp_lines')
+    def test_error_event_raises_api_exception(self, iter_lines):
+        iter_lines.return_value = [ event_line('ERROR', { 'code': 410, 'reason': 'Expired', 'message': 'too old' }) ]
+
+        with self.assertRaises(ApiException) as e:
+            list(self.sut.stream())
+
+        self.assertEqual(410, e.exception.status)
+
+if __name__ == '__main__':
+    unittest.main()
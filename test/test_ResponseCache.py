@@ -0,0 +1,57 @@
+import unittest
+from RancherProjectManager import *
+
+class TestResponseCache(unittest.TestCase):
+    def test_unknown_url_sends_no_validators(self):
+        self.assertEqual({}, ResponseCache().request_headers('https://rancher/v3/projects'))
+
+    def test_sends_back_stored_validators(self):
+        sut = ResponseCache()
+        sut.store('https://rancher/v3/projects', { 'ETag': '"abc"', 'Last-Modified': 'Mon, 19 Oct 2026 10:00:00 GMT' }, b'{}')
+
+        self.assertEqual({ 'If-None-Match': '"abc"', 'If-Modified-Since': 'Mon, 19 Oct 2026 10:00:00 GMT' },
+                         sut.request_headers('https://rancher/v3/projects'))
+
+    def test_not_modified_serves_body_and_counts_hit(self):
+        sut = ResponseCache()
+        sut.store('https://rancher/v3/projects', { 'ETag': '"abc"' }, b'{"data":[]}')
+
+        self.assertEqual(b'{"data":[]}', sut.not_modified('https://rancher/v3/projects'))
+        self.assertEqual(1, sut.hits)
+        self.assertEqual(1, sut.misses)
+        self.assertEqual(0.5, sut.hit_ratio())
+        self.assertEqual(11, sut.bytes_saved)
+
+    def test_responses_without_validators_not_kept(self):
+        sut = ResponseCache()
+        sut.store('https://rancher/v3/projects', { 'ETag': '"abc"' }, b'{}')
+        sut.store('https://rancher/v3/projects', {}, b'{"data":[]}')
+
+        self.assertEqual(0, len(sut))
+        self.assertEqual(0, sut.size)
+        self.assertIsNone(sut.not_modified('https://rancher/v3/projects'))
+
+    def test_evicts_least_recently_used_over_budget(self):
+        sut = ResponseCache(max_bytes=10)
+        sut.store('a', { 'ETag': '"a"' }, b'aaaa')
+        sut.store('b', { 'ETag': '"b"' }, b'bbbb')
+        sut.not_modified('a')
+        sut.store('c', { 'ETag': '"c"' }, b'cccc')
+
+        self.assertEqual({}, sut.request_headers('b'))
+        self.assertNotEqual({}, sut.request_headers('a'))
+        self.assertEqual(8, sut.size)
+        self.assertEqual(1, sut.evictions)
+
+    def test_body_over_budget_not_kept(self):
+        sut = ResponseCache(max_bytes=4)
+        sut.store('a', { 'ETag': '"a"' }, b'aaaaa')
+
+        self.assertEqual(0, len(sut))
+
+    def test_invalid_budget_throws_err(self):
+        with self.assertRaises(ValueError):
+            ResponseCache(0)
+
+if __name__ == '__main__':
+    unittest.main()
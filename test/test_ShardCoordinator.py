@@ -0,0 +1,133 @@
+from datetime import datetime, timedelta, timezone
+from kubernetes import client
+from kubernetes.client.exceptions import ApiException
+import unittest
+import logging
+from unittest.mock import MagicMock
+from RancherProjectManager import *
+
+def make_lease(holder, renewed_ago):
+    renew_time = datetime.now(timezone.utc) - timedelta(seconds=renewed_ago)
+    return client.V1Lease(metadata=client.V1ObjectMeta(name=f'shards-{holder}', resource_version=f'{holder}-1'),
+                          spec=client.V1LeaseSpec(holder_identity=holder, lease_duration_seconds=15, renew_time=renew_time))
+
+class TestHashRing(unittest.TestCase):
+    def test_empty_ring_has_no_owner(self):
+        self.assertIsNone(HashRing([]).owner('my project'))
+
+    def test_owner_is_stable_and_member(self):
+        ring = HashRing(['pod-a', 'pod-b', 'pod-c'])
+
+        owner = ring.owner('my project')
+
+        self.assertIn(owner, ['pod-a', 'pod-b', 'pod-c'])
+        self.assertEqual(owner, HashRing(['pod-c', 'pod-b', 'pod-a']).owner('my project'))
+
+    def test_spreads_keys_across_members(self):
+        ring = HashRing(['pod-a', 'pod-b', 'pod-c'])
+
+        owners = [ ring.owner(f'project-{i}') for i in range(300) ]
+
+        for member in ['pod-a', 'pod-b', 'pod-c']:
+            self.assertGreater(owners.count(member), 50)
+
+    def test_removing_member_only_moves_its_keys(self):
+        before = HashRing(['pod-a', 'pod-b', 'pod-c'])
+        after = HashRing(['pod-a', 'pod-b'])
+
+        for i in range(300):
+            key = f'project-{i}'
+            if before.owner(key) != 'pod-c':
+                self.assertEqual(before.owner(key), after.owner(key))
+
+class TestShardCoordinator(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.INFO, filename='/dev/null')
+
+    def setUp(self):
+        self.api = MagicMock()
+        self.api.read_namespaced_lease = MagicMock(return_value=make_lease('pod-a', 1))
+        self.rebalance = MagicMock()
+        self.sut = ShardCoordinator(self.api, 'kube-system', 'shards', 'pod-a', on_rebalance=self.rebalance)
+
+    def test_heartbeat_creates_own_lease(self):
+        self.api.read_namespaced_lease = MagicMock(side_effect=ApiException(status=404))
+        self.api.list_namespaced_lease = MagicMock(return_value=client.V1LeaseList(items=[]))
+
+        self.sut.heartbeat()
+
+        self.api.create_namespaced_lease.assert_called_once()
+        lease = self.api.create_namespaced_lease.call_args[0][1]
+        self.assertEqual('shards-pod-a', lease.metadata.name)
+        self.assertEqual({ 'rancher-project-mgmt.motus.com/shard-group': 'shards' }, lease.metadata.labels)
+        self.rebalance.assert_not_called()
+
+    def test_new_member_rebalances(self):
+        self.api.list_namespaced_lease = MagicMock(return_value=client.V1LeaseList(items=[
+            make_lease('pod-a', 1), make_lease('pod-b', 1) ]))
+
+        self.sut.heartbeat()
+
+        self.api.replace_namespaced_lease.assert_called_once()
+        self.api.list_namespaced_lease.assert_called_with('kube-system',
+                label_selector='rancher-project-mgmt.motus.com/shard-group=shards')
+        self.rebalance.assert_called_once_with(['pod-a', 'pod-b'])
+
+    def test_expired_member_ignored(self):
+        self.api.list_namespaced_lease = MagicMock(return_value=client.V1LeaseList(items=[
+            make_lease('pod-a', 1), make_lease('pod-b', 60) ]))
+
+        self.sut.heartbeat()
+
+        self.rebalance.assert_not_called()
+        self.assertTrue(self.sut.owns('any project'))
+        self.api.delete_namespaced_lease.assert_not_called()
+
+    def test_long_expired_member_lease_is_deleted(self):
+        self.api.list_namespaced_lease = MagicMock(return_value=client.V1LeaseList(items=[
+            make_lease('pod-a', 3600), make_lease('pod-b', 1), make_lease('pod-c', 600) ]))
+        self.api.delete_namespaced_lease = MagicMock(side_effect=ApiException(status=409))
+
+        self.sut.heartbeat()
+
+        self.api.delete_namespaced_lease.assert_called_once()
+        args, kwargs = self.api.delete_namespaced_lease.call_args
+        self.assertEqual(('shards-pod-c', 'kube-system'), args)
+        self.assertEqual('pod-c-1', kwargs['body'].preconditions.resource_version)
+        self.rebalance.assert_called_once_with(['pod-a', 'pod-b'])
+
+    def test_owns_nothing_once_own_lease_may_have_run_out(self):
+        self.api.list_namespaced_lease = MagicMock(return_value=client.V1LeaseList(items=[ make_lease('pod-a', 1) ]))
+        self.assertFalse(self.sut.owns('any project'))
+        self.sut.heartbeat()
+        self.assertTrue(self.sut.owns('any project'))
+
+        self.api.replace_namespaced_lease = MagicMock(side_effect=ApiException(status=500))
+        self.sut._renewed_at -= 15
+        with self.assertRaises(ApiException):
+            self.sut.heartbeat()
+
+        self.assertFalse(self.sut.owns('any project'))
+
+    def test_renewal_after_lapse_rebalances(self):
+        self.api.list_namespaced_lease = MagicMock(return_value=client.V1LeaseList(items=[ make_lease('pod-a', 1) ]))
+        self.sut.heartbeat()
+        self.sut._renewed_at -= 15
+
+        self.sut.heartbeat()
+
+        self.assertTrue(self.sut.owns('any project'))
+        self.rebalance.assert_called_once_with(['pod-a'])
+
+    def test_unchanged_membership_does_not_rebalance(self):
+        self.api.list_namespaced_lease = MagicMock(return_value=client.V1LeaseList(items=[
+            make_lease('pod-a', 1), make_lease('pod-b', 1) ]))
+
+        self.sut.heartbeat()
+        self.sut.heartbeat()
+
+        self.rebalance.assert_called_once()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+import logging
+from unittest.mock import patch
+from RancherProjectManager import *
+
+class TestWarmCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.INFO, filename='/dev/null')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'cache.db')
+
+    def open(self, scope='https://rancher/v3', ttls=None):
+        cache = WarmCache(self.path, scope, ttls)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_miss_then_hit(self):
+        sut = self.open()
+
+        self.assertEqual((False, None), sut.get('project', 'my project'))
+        sut.put('project', 'my project', { 'id': 'p-123abc' })
+
+        self.assertEqual((True, { 'id': 'p-123abc' }), sut.get('project', 'my project'))
+        self.assertEqual(1, sut.hits)
+        self.assertEqual(1, sut.misses)
+
+    def test_survives_reopen(self):
+        self.open().put('principal', 'jdoe', { 'id': 'jdoe', 'name': 'Jane Doe', 'principalType': 'user' })
+
+        sut = self.open()
+
+        self.assertEqual((True, { 'id': 'jdoe', 'name': 'Jane Doe', 'principalType': 'user' }), sut.get('principal', 'jdoe'))
+
+    def test_put_many(self):
+        self.open().put_many('project', [ ('a', { 'id': 'p-1' }), ('b', { 'id': 'p-2' }) ])
+
+        sut = self.open()
+
+        self.assertEqual((True, { 'id': 'p-2' }), sut.get('project', 'b'))
+
+    def test_expired_entries_miss(self):
+        with patch('RancherProjectManager.WarmCache.time') as time_mock:
+            time_mock.time.return_value = 1000.0
+            sut = self.open(ttls={ 'binding': 60 })
+            sut.put('binding', 'p-1/project-owner', [])
+
+            time_mock.time.return_value = 1059.0
+            self.assertEqual((True, []), sut.get('binding', 'p-1/project-owner'))
+            time_mock.time.return_value = 1061.0
+            self.assertEqual((False, None), sut.get('binding', 'p-1/project-owner'))
+
+    def test_expired_entries_not_loaded(self):
+        with patch('RancherProjectManager.WarmCache.time') as time_mock:
+            time_mock.time.return_value = 1000.0
+            self.open().put('binding', 'p-1/project-owner', [])
+
+            time_mock.time.return_value = 2000.0
+            sut = self.open()
+
+        self.assertEqual({}, sut._entries['binding'])
+
+    def test_invalidate(self):
+        self.open().put('project', 'my project', { 'id': 'p-123abc' })
+        sut = self.open()
+
+        sut.invalidate('project', 'my project')
+
+        self.assertEqual((False, None), sut.get('project', 'my project'))
+        self.assertEqual((False, None), self.open().get('project', 'my project'))
+
+    def test_other_scope_discards_entries(self):
+        self.open().put('project', 'my project', { 'id': 'p-123abc' })
+
+        sut = self.open(scope='https://other-rancher/v3')
+
+        self.assertEqual((False, None), sut.get('project', 'my project'))
+
+    def test_other_schema_version_discards_entries(self):
+        self.open().put('project', 'my project', { 'id': 'p-123abc' })
+        db = sqlite3.connect(self.path)
+        with db:
+            db.execute("UPDATE meta SET value = '0' WHERE key = 'schema_version'")
+        db.close()
+
+        sut = self.open()
+
+        self.assertEqual((False, None), sut.get('project', 'my project'))
+
+if __name__ == '__main__':
+    unittest.main()
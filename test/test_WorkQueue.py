@@ -0,0 +1,82 @@
+import threading
+import unittest
+from unittest.mock import MagicMock
+from RancherProjectManager import *
+from RancherProjectManager.WorkQueue import HIGH, LOW
+
+class TestWorkQueue(unittest.TestCase):
+    def drain(self, sut):
+        items = []
+        while sut.pending():
+            key, item, priority = sut.get()
+            items.append(item)
+            sut.done(priority)
+        return items
+
+    def test_high_before_low_then_fifo(self):
+        sut = WorkQueue()
+        sut.put('a', 'a1', LOW)
+        sut.put('b', 'b1', HIGH)
+        sut.put('c', 'c1', LOW)
+        sut.put('d', 'd1', HIGH)
+
+        self.assertEqual([ 'b1', 'd1', 'a1', 'c1' ], self.drain(sut))
+
+    def test_requeue_replaces_item_and_keeps_place(self):
+        sut = WorkQueue()
+        sut.put('a', 'a1', LOW)
+        sut.put('b', 'b1', LOW)
+        sut.put('a', 'a2', LOW)
+
+        self.assertEqual([ 'a2', 'b1' ], self.drain(sut))
+
+    def test_requeue_at_higher_priority_jumps_ahead(self):
+        sut = WorkQueue()
+        sut.put('a', 'a1', LOW)
+        sut.put('b', 'b1', LOW)
+        sut.put('b', 'b2', HIGH)
+        sut.put('b', 'b3', LOW)
+
+        self.assertEqual(1, sut.pending(HIGH))
+        self.assertEqual([ 'b3', 'a1' ], self.drain(sut))
+
+    def test_pending_counts_items_being_worked_on(self):
+        sut = WorkQueue()
+        sut.put('a', 'a1', HIGH)
+
+        key, item, priority = sut.get()
+
+        self.assertEqual(1, sut.pending(HIGH))
+        self.assertFalse(sut.join(timeout=0))
+        sut.done(priority)
+        self.assertEqual(0, sut.pending())
+        self.assertTrue(sut.join(timeout=0))
+
+    def test_throttled_low_priority_yields_to_high(self):
+        limiter = MagicMock()
+        limiter.try_acquire = MagicMock(return_value=30.0)
+        sut = WorkQueue(limiter)
+        sut.put('a', 'a1', LOW)
+        got = []
+        worker = threading.Thread(target=lambda: got.append(sut.get()))
+        worker.start()
+
+        sut.put('b', 'b1', HIGH)
+        worker.join(timeout=5)
+
+        self.assertEqual([ ('b', 'b1', HIGH) ], got)
+        self.assertEqual(1, sut.pending(LOW))
+
+    def test_close_releases_waiting_get(self):
+        sut = WorkQueue()
+        got = []
+        worker = threading.Thread(target=lambda: got.append(sut.get()))
+        worker.start()
+
+        sut.close()
+        worker.join(timeout=5)
+
+        self.assertEqual([ None ], got)
+
+if __name__ == '__main__':
+    unittest.main()